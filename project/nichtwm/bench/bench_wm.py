@@ -0,0 +1,161 @@
+#!/usr/bin/env python3
+
+"""
+Headless benchmark for nichtwm.
+
+Starts a private Xvfb (or Xephyr), runs WindowManager against it and drives it with
+synthetic clients and XTest key events. For every window count it reports:
+
+  map_ms        MapWindow from a client -> window mapped at its tiled geometry
+  keypress_ms   XTest key press -> first window unmapped by the bound workspace switch
+  switch_away_ms / switch_back_ms   workspace switch until every window is unmapped / mapped again
+  requests_*    X requests the WM sent for each of those operations
+
+Results are written as JSON so runs from different commits can be compared:
+
+  ./bench_wm.py --counts 1,10,100,500 --output before.json
+  ./bench_wm.py --counts 1,10,100,500 --compare before.json
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import statistics
+import subprocess
+
+import xcffib.xproto as xproto
+
+from harness import XServer, Clients, bench_config, start_wm, settle
+
+"""Git revision of the tree being measured, if there is one."""
+def revision() -> str:
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except OSError:
+        return ''
+
+"""Map windows until there are `count`, timing each map."""
+def grow(clients, counter, count, map_latencies, map_requests) -> None:
+    while len(clients.windows) < count:
+        window = clients.create()
+        before = counter.requests
+        start = time.perf_counter()
+        clients.map(window)
+        clients.wait_for(xproto.MapNotifyEvent, [window])
+        map_latencies.append(time.perf_counter() - start)
+        map_requests.append(settle(counter) - before)
+
+"""Switch to workspace 2 and back with XTest, timing both directions."""
+def switch(clients, counter) -> dict:
+    windows = list(clients.windows)
+
+    before = counter.requests
+    start = time.perf_counter()
+    clients.press('2')
+    first, _ = clients.wait_for(xproto.UnmapNotifyEvent, windows)
+    away = time.perf_counter() - start
+    away_requests = settle(counter) - before
+
+    before = counter.requests
+    start = time.perf_counter()
+    clients.press('1')
+    clients.wait_for(xproto.MapNotifyEvent, windows)
+    back = time.perf_counter() - start
+    back_requests = settle(counter) - before
+
+    return {
+        'keypress_ms': first * 1e3,
+        'switch_away_ms': away * 1e3,
+        'switch_back_ms': back * 1e3,
+        'requests_switch_away': away_requests,
+        'requests_switch_back': back_requests,
+    }
+
+"""Run the whole sweep on one server. Returns the list of per-count results."""
+def run(counts, server, repeat) -> list:
+    results = []
+    with XServer(server) as xserver:
+        wm, counter, config_dir = start_wm(xserver.display, bench_config())
+        clients = Clients(xserver.display)
+        try:
+            map_latencies, map_requests = [], []
+            for count in counts:
+                # Only the maps that brought us from the previous count to this one
+                map_latencies.clear()
+                map_requests.clear()
+                grow(clients, counter, count, map_latencies, map_requests)
+
+                switches = [switch(clients, counter) for _ in range(repeat)]
+                result = {
+                    'windows': count,
+                    'map_ms': statistics.median(map_latencies) * 1e3 if map_latencies else None,
+                    'requests_map': statistics.median(map_requests) if map_requests else None,
+                }
+                for key in switches[0]:
+                    result[key] = statistics.median(s[key] for s in switches)
+                results.append(result)
+                print(json.dumps(result), file=sys.stderr)
+        finally:
+            clients.close()
+            shutil.rmtree(config_dir, ignore_errors=True)
+    return results
+
+"""Metrics of `current` that got worse than `baseline` by more than `tolerance`."""
+def regressions(baseline, current, tolerance) -> list:
+    found = []
+    previous = {r['windows']: r for r in baseline['results']}
+    for result in current['results']:
+        old = previous.get(result['windows'])
+        if old is None:
+            continue
+        for key, value in result.items():
+            if key == 'windows' or value is None or old.get(key) is None:
+                continue
+            # Request counts must not grow at all; timings get some slack for noise
+            if key.startswith('requests'):
+                worse = value > old[key]
+            else:
+                worse = value > old[key] * (1 + tolerance)
+            if worse:
+                found.append(f"{result['windows']} windows: {key} {old[key]:.2f} -> {value:.2f}")
+    return found
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--counts', default='1,10,50,100,250,500', help="comma-separated window counts (ascending)")
+    parser.add_argument('--server', choices=('xvfb', 'xephyr'), default='xvfb')
+    parser.add_argument('--repeat', type=int, default=5, help="workspace switches per window count")
+    parser.add_argument('--output', help="write results here instead of stdout")
+    parser.add_argument('--compare', help="previous results to check for regressions")
+    parser.add_argument('--tolerance', type=float, default=0.25, help="allowed relative slowdown for timings")
+    args = parser.parse_args()
+
+    counts = sorted(int(c) for c in args.counts.split(','))
+    report = {
+        'revision': revision(),
+        'timestamp': time.time(),
+        'server': args.server,
+        'results': run(counts, args.server, args.repeat),
+    }
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+
+    if args.compare:
+        with open(args.compare) as f:
+            found = regressions(json.load(f), report, args.tolerance)
+        for line in found:
+            print(f"REGRESSION {line}", file=sys.stderr)
+        return 1 if found else 0
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
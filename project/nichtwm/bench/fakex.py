@@ -0,0 +1,312 @@
+#!/usr/bin/env python3
+
+"""
+In-process stand-in for an xcffib connection.
+
+FakeConnection implements the parts of xcffib.Connection and conn.core that nichtwm uses,
+logs every request, counts round-trips (.reply()/.check()) and flushes, and feeds events
+from a trace instead of a socket. Its descriptor is always readable; once the trace has run out
+and the WM has had a few looks at the empty queue (enough to settle pending replies and commit),
+it raises ConnectionException, which ends WindowManager's event loop, so a replay runs at full
+speed and terminates.
+
+Traces are JSON lines, one event per line: {"type": "MapRequest", "window": 4194305, ...}.
+TraceRecorder writes them from a real connection; load_trace reads them back.
+"""
+
+import os
+import json
+import collections
+from types import SimpleNamespace
+
+import xcffib
+import xcffib.xproto as xproto
+import xcffib.randr as randr
+
+ROOT_WINDOW = 0x100
+FIRST_CLIENT_WINDOW = 0x400001
+
+# Empty polls at the end of a trace before the fake server "goes away": the drain that finds the
+# queue empty, the look that settles pending replies, and the one that finds nothing left to do
+IDLE_POLLS = 3
+
+# Keysyms the default fake keyboard carries, two per keycode (plain, shifted)
+DEFAULT_KEYS = (
+    [(c, c.upper()) for c in 'abcdefghijklmnopqrstuvwxyz'] +
+    [(d, s) for d, s in zip('1234567890', ('exclam', 'at', 'numbersign', 'dollar', 'percent',
+                                          'asciicircum', 'ampersand', 'asterisk', 'parenleft', 'parenright'))] +
+    [(name, name) for name in ('Return', 'space', 'Tab', 'Escape', 'BackSpace', 'Super_L', 'Alt_L',
+                               'Shift_L', 'Control_L', 'Left', 'Right', 'Up', 'Down')] +
+    [(f'F{i}', f'F{i}') for i in range(1, 13)]
+)
+
+"""Keysym grid (min_keycode, keysyms_per_keycode, keysyms) for a list of (plain, shifted) key names."""
+def build_keymap(keys=DEFAULT_KEYS, min_keycode=10):
+    import xpybutil.keysymdef # only needed to build the fake keyboard
+
+    keysyms = []
+    for plain, shifted in keys:
+        keysyms += [xpybutil.keysymdef.keysyms[plain], xpybutil.keysymdef.keysyms[shifted]]
+    return min_keycode, 2, keysyms
+
+"""Cookie whose reply is computed from the request; .reply()/.check() count as round-trips."""
+class FakeCookie:
+    def __init__(self, conn, sequence, reply=None, error=None) -> None:
+        self.conn = conn
+        self.sequence = sequence
+        self._reply = reply
+        self._error = error
+
+    def reply(self):
+        self.conn.round_trips += 1
+        if self._error is not None:
+            raise self._error
+        return self._reply
+
+    def check(self) -> None:
+        self.conn.round_trips += 1
+        if self._error is not None:
+            raise self._error
+
+    def discard_reply(self) -> None:
+        pass
+
+"""conn.core stand-in: any request name is accepted and logged; known ones get canned replies."""
+class FakeCore:
+    def __init__(self, conn) -> None:
+        self._conn = conn
+
+    def __getattr__(self, name):
+        def request(*args, **kwargs):
+            return self._conn.request(name, args)
+        request.__name__ = name
+        return request
+
+class FakeConnection:
+    def __init__(self, events=(), width=2560, height=1600, keymap=None, batch_size=None, monitors=None) -> None:
+        min_keycode, keysyms_per_keycode, keysyms = keymap or build_keymap()
+        self.keysyms_per_keycode = keysyms_per_keycode
+        self.keysyms = keysyms
+
+        screen = SimpleNamespace(
+            root=ROOT_WINDOW, width_in_pixels=width, height_in_pixels=height,
+            root_depth=24, root_visual=0x21,
+        )
+        self.setup = SimpleNamespace(
+            roots=[screen], min_keycode=min_keycode,
+            max_keycode=min_keycode + len(keysyms) // keysyms_per_keycode - 1,
+        )
+
+        self.core = FakeCore(self)
+        self.events = collections.deque(events)
+        self.batch_size = batch_size   # events poll_for_event hands out before pretending the queue is empty
+        self._batch_left = batch_size
+        self._empty_polls = 0          # polls that found the trace exhausted
+        self.requests = []             # (name, args) of every request, in order
+        self.request_counts = collections.Counter()
+        self.round_trips = 0
+        self.flushes = 0
+        self.sequence = 0
+        self.next_id = FIRST_CLIENT_WINDOW
+        self.dead_windows = set()      # windows whose requests should fail with BadWindow
+        self.override_redirect = set() # windows GetWindowAttributes reports as override-redirect
+        self.children = []             # top-level windows QueryTree reports, as if left by a previous WM
+        self.unmapped = set()          # windows GetWindowAttributes reports as unmapped
+        self.properties = {}           # (window, atom) -> GetProperty reply
+        self.atoms = {}                # name -> atom for InternAtom
+        self.monitors = monitors or [(0, 0, width, height)] # RandR monitors as (x, y, width, height), first is primary
+        self._read_fd, self._write_fd = os.pipe()
+        os.write(self._write_fd, b'x') # never drained: the trace is always "readable", like a busy socket
+
+    ## xcffib.Connection
+    def get_setup(self):
+        return self.setup
+
+    def flush(self) -> None:
+        self.flushes += 1
+
+    def poll_for_event(self):
+        if not self.events:
+            self._empty_polls += 1
+            if self._empty_polls > IDLE_POLLS:
+                raise xcffib.ConnectionException(0) # End of the trace: behave like the server went away
+            return None
+        if self.batch_size is not None:
+            if self._batch_left == 0:
+                self._batch_left = self.batch_size
+                return None # Batch boundary: the queue looks empty once, the next poll starts the next batch
+            self._batch_left -= 1
+        return self._deliver(self.events.popleft())
+
+    def wait_for_event(self):
+        if not self.events:
+            raise xcffib.ConnectionException(0) # End of the trace: behave like the server went away
+        if self.batch_size is not None:
+            self._batch_left = self.batch_size - 1
+        return self._deliver(self.events.popleft())
+
+    def _deliver(self, event):
+        if isinstance(event, Exception):
+            raise event # an X error sitting in the queue: xcffib raises it from poll_for_event/wait_for_event
+        # Like a real server: the event comes after every request sent so far was processed
+        event.sequence = self.sequence & 0xffff
+        return event
+
+    def generate_id(self) -> int:
+        self.next_id += 1
+        return self.next_id
+
+    def get_file_descriptor(self) -> int:
+        return self._read_fd
+
+    def disconnect(self) -> None:
+        for fd in (self._read_fd, self._write_fd):
+            try:
+                os.close(fd)
+            except OSError:
+                pass
+
+    def __call__(self, extension_key):
+        # Extensions (RandR, XTest...) share the same logging core
+        return self.core
+
+    ## Requests
+    def request(self, name, args):
+        self.sequence += 1
+        self.requests.append((name, args))
+        self.request_counts[name] += 1
+
+        if name.endswith('Unchecked'):
+            name = name[:-len('Unchecked')]
+        if name.endswith('Checked'):
+            name = name[:-len('Checked')]
+
+        reply = getattr(self, f'_reply_{name}', None)
+        if reply is None:
+            return FakeCookie(self, self.sequence)
+        return reply(*args)
+
+    def _bad_window(self, window):
+        if window in self.dead_windows:
+            return FakeCookie(self, self.sequence, error=make_error('Window', window))
+        return None
+
+    def _reply_GetWindowAttributes(self, window, *args):
+        return self._bad_window(window) or FakeCookie(self, self.sequence, SimpleNamespace(
+            override_redirect=window in self.override_redirect,
+            map_state=xproto.MapState.Unmapped if window in self.unmapped else xproto.MapState.Viewable,
+            _class=xproto.WindowClass.InputOutput,
+        ))
+
+    def _reply_GetGeometry(self, drawable, *args):
+        return self._bad_window(drawable) or FakeCookie(self, self.sequence, SimpleNamespace(
+            x=0, y=0, width=100, height=100, border_width=0, root=ROOT_WINDOW,
+        ))
+
+    def _reply_GetKeyboardMapping(self, first_keycode, count, *args):
+        start = (first_keycode - self.setup.min_keycode) * self.keysyms_per_keycode
+        return FakeCookie(self, self.sequence, SimpleNamespace(
+            keysyms_per_keycode=self.keysyms_per_keycode,
+            keysyms=self.keysyms[start:start + count * self.keysyms_per_keycode],
+        ))
+
+    def _reply_InternAtom(self, only_if_exists, name_len, name, *args):
+        name = name.decode() if isinstance(name, bytes) else name
+        atom = self.atoms.setdefault(name, 0x200 + len(self.atoms))
+        return FakeCookie(self, self.sequence, SimpleNamespace(atom=atom))
+
+    def _reply_GetProperty(self, delete, window, atom, *args):
+        return self._bad_window(window) or FakeCookie(self, self.sequence, self.properties.get(
+            (window, atom), SimpleNamespace(format=0, type=0, value_len=0, value=[])))
+
+    def _reply_QueryVersion(self, major_version, minor_version, *args):
+        # RandR: claim 1.5 so monitors get queried
+        return FakeCookie(self, self.sequence, SimpleNamespace(major_version=1, minor_version=5))
+
+    def _reply_GetMonitors(self, window, get_active, *args):
+        return FakeCookie(self, self.sequence, SimpleNamespace(monitors=[
+            SimpleNamespace(name=0x300 + index, primary=index == 0, x=x, y=y, width=width, height=height)
+            for index, (x, y, width, height) in enumerate(self.monitors)
+        ]))
+
+    def _reply_QueryTree(self, window, *args):
+        return FakeCookie(self, self.sequence, SimpleNamespace(root=ROOT_WINDOW, parent=0, children=list(self.children),
+                                                        children_len=len(self.children)))
+
+    ## Helpers for benchmarks
+    """Keycode carrying `keysym`, like KeyUtil.get_keycode."""
+    def keycode(self, keysym) -> int:
+        index = self.keysyms.index(keysym)
+        return self.setup.min_keycode + index // self.keysyms_per_keycode
+
+    def reset_counters(self) -> None:
+        self.requests.clear()
+        self.request_counts.clear()
+        self.round_trips = 0
+        self.flushes = 0
+
+## Traces
+
+# Attributes xcffib puts on every event that say nothing about the event itself
+_SKIPPED_ATTRIBUTES = {'unpacker', 'bufsize', 'response_type', 'xge'}
+
+"""Build an event object of `type_name` ('MapRequest', 'KeyPress', 'ScreenChangeNotify'...) from its fields."""
+def make_event(type_name, **fields):
+    cls = getattr(xproto, f'{type_name}Event', None) or getattr(randr, f'{type_name}Event')
+    event = cls.__new__(cls) # skip the buffer-parsing __init__
+    event.sequence = 0
+    event.__dict__.update(fields)
+    return event
+
+"""X error `name` ('Window', 'Match'...) about `bad_value`, to put in a trace between events."""
+def make_error(name, bad_value=0):
+    cls = getattr(xproto, f'{name}Error')
+    error = cls.__new__(cls) # what a real error raises, without a buffer to parse
+    error.bad_value = bad_value
+    return error
+
+"""JSON-friendly dict of an event's fields."""
+def event_to_dict(event) -> dict:
+    record = {'type': type(event).__name__[:-len('Event')]}
+    for name, value in vars(event).items():
+        if name in _SKIPPED_ATTRIBUTES or name.startswith('_'):
+            continue
+        if isinstance(value, (int, bool)):
+            record[name] = value
+    return record
+
+"""Read a JSON-lines trace into a list of events."""
+def load_trace(path) -> list:
+    events = []
+    with open(path) as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            record = json.loads(line)
+            events.append(make_event(record.pop('type'), **record))
+    return events
+
+"""Wraps a real connection and appends every event it delivers to a JSON-lines trace."""
+class TraceRecorder:
+    def __init__(self, conn, path) -> None:
+        self._conn = conn
+        self._file = open(path, 'a', buffering=1)
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+    def _record(self, event):
+        if event is not None:
+            self._file.write(json.dumps(event_to_dict(event)) + '\n')
+        return event
+
+    def wait_for_event(self):
+        return self._record(self._conn.wait_for_event())
+
+    def poll_for_event(self):
+        return self._record(self._conn.poll_for_event())
+
+    def disconnect(self) -> None:
+        self._file.close()
+        self._conn.disconnect()
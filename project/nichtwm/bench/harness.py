@@ -0,0 +1,197 @@
+#!/usr/bin/env python3
+
+"""
+Shared plumbing for nichtwm's benchmarks: a throwaway X server (Xvfb or Xephyr),
+a WindowManager running against it in a background thread, a request counter wrapped
+around the WM's connection, and a connection that plays synthetic clients.
+"""
+
+import os
+import sys
+import time
+import shutil
+import select
+import tempfile
+import threading
+import subprocess
+
+import yaml
+
+import xcffib
+import xcffib.xproto as xproto
+import xcffib.xtest
+
+# nichtwm's modules live next to the executable, not in a package
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'bin'))
+
+from nichtwm import WindowManager # noqa: E402
+from utils import KeyUtil         # noqa: E402
+
+BENCH_MODIFIER = 'super'
+BENCH_MODIFIER_KEY = 'Super_L'
+
+# Core event codes XTest's FakeInput expects
+KEY_PRESS, KEY_RELEASE = 2, 3
+
+"""Config used by the benchmarks: one workspace switch per digit key."""
+def bench_config(num_workspaces=6):
+    return {
+        'modifier': BENCH_MODIFIER,
+        'num-o-workspaces': num_workspaces,
+        'actions': [{'key': str(i), 'action': f'SWITCH_WORKSPACE_{i}'} for i in range(1, num_workspaces + 1)],
+        'control-socket': False, # don't collide with the socket of the nichtwm running the desktop
+    }
+
+"""A private X server on the first free display, torn down on exit."""
+class XServer:
+    def __init__(self, server='xvfb', size=(2560, 1600)) -> None:
+        self.server = server
+        self.size = size
+        self.process = None
+        self.display = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.stop()
+
+    def start(self) -> None:
+        number = next(n for n in range(90, 200) if not os.path.exists(f'/tmp/.X11-unix/X{n}') and not os.path.exists(f'/tmp/.X{n}-lock'))
+        self.display = f':{number}'
+        width, height = self.size
+
+        if self.server == 'xephyr':
+            command = [shutil.which('Xephyr') or 'Xephyr', self.display, '-screen', f'{width}x{height}', '-nolisten', 'tcp']
+        else:
+            command = [shutil.which('Xvfb') or 'Xvfb', self.display, '-screen', '0', f'{width}x{height}x24', '-nolisten', 'tcp']
+        self.process = subprocess.Popen(command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+        # Wait for the socket instead of sleeping a fixed amount
+        deadline = time.monotonic() + 10
+        while not os.path.exists(f'/tmp/.X11-unix/X{number}'):
+            if self.process.poll() is not None or time.monotonic() > deadline:
+                raise RuntimeError(f"{command[0]} failed to start on {self.display}")
+            time.sleep(0.01)
+
+    def stop(self) -> None:
+        if self.process is not None:
+            self.process.terminate()
+            self.process.wait()
+            self.process = None
+
+"""Proxy around conn.core counting every request the WM sends."""
+class RequestCounter:
+    def __init__(self, core) -> None:
+        self._core = core
+        self.requests = 0
+
+    def __getattr__(self, name):
+        request = getattr(self._core, name)
+        if not callable(request):
+            return request
+
+        def counted(*args, **kwargs):
+            self.requests += 1
+            return request(*args, **kwargs)
+        return counted
+
+"""Wait until the counter stops moving, i.e. the WM finished reacting."""
+def settle(counter, quiet=0.02, timeout=5.0) -> int:
+    deadline = time.monotonic() + timeout
+    last = counter.requests
+    quiet_since = time.monotonic()
+    while time.monotonic() < deadline:
+        time.sleep(quiet / 4)
+        if counter.requests != last:
+            last = counter.requests
+            quiet_since = time.monotonic()
+        elif time.monotonic() - quiet_since >= quiet:
+            break
+    return last
+
+"""Run a WindowManager on `display` in a daemon thread. Returns (wm, counter, config_dir).
+Its config cache goes to config_dir too: a benchmark leaves nothing in the user's cache, and
+always measures a cold start."""
+def start_wm(display, config):
+    config_dir = tempfile.mkdtemp(prefix='nichtwm-bench-')
+    os.environ['XDG_CACHE_HOME'] = config_dir
+    config_path = os.path.join(config_dir, 'config.yaml')
+    with open(config_path, 'w') as f:
+        yaml.safe_dump(config, f)
+
+    wm = WindowManager(config_path=config_path, display=display)
+    counter = RequestCounter(wm.conn.core)
+    wm.conn.core = counter
+
+    threading.Thread(target=wm.run, name='nichtwm', daemon=True).start()
+    settle(counter)
+    return wm, counter, config_dir
+
+"""Synthetic clients: plain InputOutput windows on their own connection, plus XTest input."""
+class Clients:
+    def __init__(self, display) -> None:
+        self.conn = xcffib.connect(display=display)
+        self.screen = self.conn.get_setup().roots[0]
+        self.root = self.screen.root
+        self.xtest = self.conn(xcffib.xtest.key)
+        self.key_util = KeyUtil(self.conn)
+        self.windows = []
+
+    """Create (but don't map) a window that reports its own structure changes."""
+    def create(self) -> int:
+        window = self.conn.generate_id()
+        self.conn.core.CreateWindow(
+            self.screen.root_depth, window, self.root,
+            0, 0, 100, 100, 0,
+            xproto.WindowClass.InputOutput, self.screen.root_visual,
+            xproto.CW.EventMask, [xproto.EventMask.StructureNotify]
+        )
+        self.windows.append(window)
+        return window
+
+    def map(self, window) -> None:
+        self.conn.core.MapWindow(window)
+        self.conn.flush()
+
+    def destroy(self, window) -> None:
+        self.conn.core.DestroyWindow(window)
+        self.conn.flush()
+        self.windows.remove(window)
+
+    """Press and release modifier+key through XTest."""
+    def press(self, key, modifier=BENCH_MODIFIER_KEY) -> None:
+        keycodes = [self.key_util.get_keycode(KeyUtil.string_to_keysym(name)) for name in (modifier, key)]
+        for keycode in keycodes:
+            self.xtest.FakeInput(KEY_PRESS, keycode, xproto.Time.CurrentTime, self.root, 0, 0, 0)
+        for keycode in reversed(keycodes):
+            self.xtest.FakeInput(KEY_RELEASE, keycode, xproto.Time.CurrentTime, self.root, 0, 0, 0)
+        self.conn.flush()
+
+    """Block until every window in `windows` got an event of type `event_type`.
+    Returns the seconds until the first and until the last of them arrived."""
+    def wait_for(self, event_type, windows, timeout=10.0) -> tuple:
+        start = time.perf_counter()
+        first = None
+        remaining = set(windows)
+        fd = self.conn.get_file_descriptor()
+
+        while remaining:
+            event = self.conn.poll_for_event()
+            if event is None:
+                left = timeout - (time.perf_counter() - start)
+                if left <= 0:
+                    raise TimeoutError(f"{len(remaining)} windows never got {event_type.__name__}")
+                select.select([fd], [], [], left)
+                continue
+            if isinstance(event, event_type) and event.window in remaining:
+                remaining.discard(event.window)
+                if first is None:
+                    first = time.perf_counter() - start
+
+        last = time.perf_counter() - start
+        return (last if first is None else first), last
+
+    def close(self) -> None:
+        self.conn.disconnect()
@@ -0,0 +1,186 @@
+#!/usr/bin/env python3
+
+"""
+Replay X event traces through WindowManager on a fake connection.
+
+  ./replay.py generate --windows 200 --output churn.jsonl   synthetic trace: maps, pointer crossings,
+                                                            workspace switches and layout changes
+  ./replay.py play churn.jsonl [--profile]                  replay at full speed, print request/round-trip
+                                                            counts and where the Python time went
+  ./replay.py record --display :1 --output session.jsonl    run nichtwm for real and record what it receives
+
+No X server is needed to play a trace, so the Python-side hot paths (dispatch, layout,
+bookkeeping) can be profiled in isolation and requests counted exactly.
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import argparse
+import tempfile
+
+import yaml
+
+from fakex import FakeConnection, TraceRecorder, load_trace, event_to_dict, make_event, build_keymap, ROOT_WINDOW, FIRST_CLIENT_WINDOW
+
+# nichtwm's modules live next to the executable, not in a package
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'bin'))
+
+import xcffib                     # noqa: E402
+import xcffib.xproto as xproto    # noqa: E402
+import xpybutil.keysymdef         # noqa: E402
+
+from nichtwm import WindowManager # noqa: E402
+from metrics import METRICS       # noqa: E402
+
+MOD4 = int(xproto.ModMask._4)
+
+"""Config for replays: workspace switches on 1-6, layout cycling on space."""
+def replay_config(num_workspaces=6) -> dict:
+    actions = [{'key': str(i), 'action': f'SWITCH_WORKSPACE_{i}'} for i in range(1, num_workspaces + 1)]
+    actions.append({'key': 'space', 'action': 'NEXT_LAYOUT'})
+    # No control socket: a replay must not take over the one of a nichtwm running for real
+    return {'modifier': 'super', 'num-o-workspaces': num_workspaces, 'actions': actions, 'control-socket': False}
+
+"""Write `config` to a temporary config.yaml. Returns (directory, path).
+The config cache goes to the same directory: a replay leaves nothing in the user's cache, and
+always starts cold."""
+def write_config(config):
+    directory = tempfile.mkdtemp(prefix='nichtwm-replay-')
+    os.environ['XDG_CACHE_HOME'] = directory
+    path = os.path.join(directory, 'config.yaml')
+    with open(path, 'w') as f:
+        yaml.safe_dump(config, f)
+    return directory, path
+
+"""A synthetic session: windows appear in bursts and some close, the pointer wanders, workspaces and layouts change."""
+def generate(windows, seed=0) -> list:
+    rng = random.Random(seed)
+    _, _, keysyms = keymap = build_keymap()
+    min_keycode, per_keycode = keymap[0], keymap[1]
+
+    def key(name):
+        keycode = min_keycode + keysyms.index(xpybutil.keysymdef.keysyms[name]) // per_keycode
+        return make_event('KeyPress', detail=keycode, state=MOD4, root=ROOT_WINDOW, event=ROOT_WINDOW, child=0)
+
+    events = []
+    mapped = []
+    for index in range(windows):
+        window = FIRST_CLIENT_WINDOW + 0x1000 + index
+        mapped.append(window)
+        events.append(make_event('MapRequest', parent=ROOT_WINDOW, window=window))
+        # Freshly started clients tend to ask for a size right away
+        for _ in range(rng.randint(0, 3)):
+            events.append(make_event('ConfigureRequest', window=window, parent=ROOT_WINDOW, sibling=0, stack_mode=0,
+                                     x=0, y=0, width=rng.randint(100, 800), height=rng.randint(100, 600),
+                                     border_width=0, value_mask=0xf))
+        for _ in range(rng.randint(1, 4)):
+            events.append(make_event('EnterNotify', event=rng.choice(mapped), root=ROOT_WINDOW, child=0,
+                                     detail=0, mode=0, state=0, same_screen_focus=1))
+        # Clients close windows too: unmap, then destroy
+        if index % 8 == 7:
+            window = mapped.pop(rng.randrange(len(mapped)))
+            events += [make_event('UnmapNotify', event=ROOT_WINDOW, window=window, from_configure=0),
+                       make_event('DestroyNotify', event=ROOT_WINDOW, window=window)]
+        if index % 25 == 24:
+            events.append(key('space'))
+        if index % 50 == 49:
+            events += [key(str(rng.randint(2, 6))), key('1')]
+    return events
+
+"""Replay `events` through a WindowManager on a FakeConnection. Returns (stats, connection)."""
+def play(events, config, profile=False, batch_size=None):
+    directory, config_path = write_config(config)
+    try:
+        conn = FakeConnection(events, batch_size=batch_size)
+        wm = WindowManager(config_path=config_path, conn=conn)
+        conn.reset_counters()
+        METRICS.reset()
+
+        profiler = None
+        if profile:
+            import cProfile
+            profiler = cProfile.Profile()
+            profiler.enable()
+
+        start = time.perf_counter()
+        wm.run()
+        elapsed = time.perf_counter() - start
+
+        if profiler is not None:
+            profiler.disable()
+            import pstats
+            pstats.Stats(profiler, stream=sys.stderr).sort_stats('cumulative').print_stats(25)
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+    stats = {
+        'events': len(events),
+        'seconds': elapsed,
+        'events_per_second': len(events) / elapsed if elapsed else None,
+        'requests': len(conn.requests),
+        'round_trips': conn.round_trips,
+        'flushes': conn.flushes,
+        'requests_by_type': dict(conn.request_counts.most_common()),
+        'managed_windows': len(wm.clients),
+        'metrics': METRICS.snapshot(),
+    }
+    return stats, conn
+
+"""Run nichtwm on a real display, recording every event it receives."""
+def record(display, output, config_path=None) -> None:
+    conn = TraceRecorder(xcffib.connect(display=display), output)
+    WindowManager(config_path=config_path, conn=conn).run()
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    generate_parser = commands.add_parser('generate', help="write a synthetic trace")
+    generate_parser.add_argument('--windows', type=int, default=100)
+    generate_parser.add_argument('--seed', type=int, default=0)
+    generate_parser.add_argument('--output', required=True)
+
+    play_parser = commands.add_parser('play', help="replay a trace on the fake connection")
+    play_parser.add_argument('trace')
+    play_parser.add_argument('--config', help="config.yaml to use instead of the built-in replay config")
+    play_parser.add_argument('--profile', action='store_true', help="print a cProfile summary to stderr")
+    play_parser.add_argument('--batch-size', type=int, help="events per batch (default: the whole trace is queued at once)")
+    play_parser.add_argument('--log-requests', help="write every request the WM sent to this file")
+
+    record_parser = commands.add_parser('record', help="run nichtwm on a real display and record its events")
+    record_parser.add_argument('--display', default=os.environ.get('DISPLAY'))
+    record_parser.add_argument('--config', help="config.yaml to run with")
+    record_parser.add_argument('--output', required=True)
+
+    args = parser.parse_args()
+
+    if args.command == 'generate':
+        with open(args.output, 'w') as f:
+            for event in generate(args.windows, args.seed):
+                f.write(json.dumps(event_to_dict(event)) + '\n')
+        return 0
+
+    if args.command == 'record':
+        record(args.display, args.output, args.config)
+        return 0
+
+    config = replay_config()
+    if args.config:
+        with open(args.config) as f:
+            config = yaml.safe_load(f)
+
+    stats, conn = play(load_trace(args.trace), config, args.profile, args.batch_size)
+    if args.log_requests:
+        with open(args.log_requests, 'w') as f:
+            for name, request_args in conn.requests:
+                f.write(f"{name} {list(request_args)}\n")
+    json.dump(stats, sys.stdout, indent=2)
+    print()
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,289 @@
+#!/usr/bin/env python3
+
+"""
+Soak test for nichtwm: weeks of window churn squeezed into minutes, checking that memory and
+latency stay flat.
+
+  ./soak.py --cycles 200000                      against a private Xvfb (or Xephyr), like bench_wm.py
+  ./soak.py --cycles 200000 --fake               against fakex.FakeConnection, no X server needed
+  ./soak.py --cycles 200000 --output soak.json   write the report to a file instead of stdout
+
+In each cycle a client maps a new window and asks for a size. Once `--windows` are open, the
+oldest one is destroyed. Every `--switch-every` cycles the WM switches to workspace 2 and back.
+The number of live windows stays the same, so everything the WM holds should stay the same size.
+
+The WM runs in this process, so every `--interval` cycles a sample records:
+  heap_kb       Python heap traced by tracemalloc
+  rss_kb        resident set size, from /proc/self/statm
+  objects       live objects the garbage collector tracks
+  cycle_us      median and p99 time of a cycle since the last sample
+
+The first sample after `--warmup` cycles is the baseline, so caches filling up and first-time
+allocations are not counted. At the end the report lists the source lines whose allocations grew
+the most since the baseline. The exit status is 1 if the heap or RSS grew by more than allowed,
+or if the median cycle time drifted by more than `--max-drift` times its baseline.
+"""
+
+import os
+import gc
+import sys
+import json
+import time
+import shutil
+import argparse
+import statistics
+import collections
+import tracemalloc
+
+import xcffib.xproto as xproto
+import xpybutil.keysymdef
+
+from fakex import FakeConnection, make_event, ROOT_WINDOW, FIRST_CLIENT_WINDOW
+from harness import XServer, Clients, bench_config, start_wm
+from replay import MOD4, replay_config, write_config
+from bench_wm import revision
+
+from nichtwm import WindowManager # noqa: E402 (harness put bin/ on the path)
+
+PAGE_SIZE = os.sysconf('SC_PAGE_SIZE')
+
+# Empty polls between two fake cycles: the drain that finds the queue empty, and the look that settles pending replies
+SETTLE_POLLS = 2
+
+"""Resident set size of this process in bytes."""
+def rss() -> int:
+    with open('/proc/self/statm') as f:
+        return int(f.read().split()[1]) * PAGE_SIZE
+
+"""Samples this process every `interval` cycles and compares the samples with the baseline."""
+class Soak:
+    def __init__(self, interval, warmup) -> None:
+        self.interval = interval
+        self.warmup = warmup
+        self.wm = None          # WindowManager under test, for its client count
+        self.cycles = 0
+        self.latencies = []     # seconds per cycle since the last sample
+        self.samples = []
+        self.baseline = None    # index of the baseline sample
+        self.snapshot = None    # tracemalloc snapshot taken with the baseline sample
+
+    def record(self, seconds) -> None:
+        self.cycles += 1
+        self.latencies.append(seconds)
+        if self.cycles % self.interval == 0:
+            self.sample()
+
+    def sample(self) -> None:
+        gc.collect() # only count what is really still referenced
+        latencies = sorted(self.latencies)
+        self.latencies.clear()
+        sample = {
+            'cycles': self.cycles,
+            'heap_kb': tracemalloc.get_traced_memory()[0] / 1024,
+            'rss_kb': rss() / 1024,
+            'objects': len(gc.get_objects()),
+            'clients': len(self.wm.clients) if self.wm is not None else None,
+            'cycle_us': statistics.median(latencies) * 1e6 if latencies else None,
+            'cycle_p99_us': latencies[int(len(latencies) * 0.99)] * 1e6 if latencies else None,
+        }
+        self.samples.append(sample)
+        if self.baseline is None and self.cycles >= self.warmup:
+            self.baseline = len(self.samples) - 1
+            self.snapshot = self._take_snapshot()
+        print(json.dumps(sample), file=sys.stderr)
+
+    """Growth from the baseline to the last sample, and the `top` source lines that grew the most."""
+    def growth(self, top) -> tuple:
+        if self.baseline is None or self.baseline == len(self.samples) - 1:
+            return {}, []
+        first, last = self.samples[self.baseline], self.samples[-1]
+        growth = {
+            'cycles': last['cycles'] - first['cycles'],
+            'heap_kb': last['heap_kb'] - first['heap_kb'],
+            'rss_kb': last['rss_kb'] - first['rss_kb'],
+            'objects': last['objects'] - first['objects'],
+            'cycle_drift': last['cycle_us'] / first['cycle_us'] if first['cycle_us'] else None,
+        }
+        lines = [{
+            'where': f'{stat.traceback[0].filename}:{stat.traceback[0].lineno}',
+            'size_kb': stat.size_diff / 1024,
+            'count': stat.count_diff,
+        } for stat in self._take_snapshot().compare_to(self.snapshot, 'lineno')[:top] if stat.size_diff > 0]
+        return growth, lines
+
+    def _take_snapshot(self):
+        return tracemalloc.take_snapshot().filter_traces((
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, __file__), # the samples themselves
+            tracemalloc.Filter(False, '<frozen importlib._bootstrap>'),
+        ))
+
+"""Cycles on a real server: the WM in a background thread, clients on their own connection."""
+def run_x(args, soak) -> None:
+    with XServer(args.server) as xserver:
+        wm, counter, config_dir = start_wm(xserver.display, bench_config())
+        soak.wm = wm
+        clients = Clients(xserver.display)
+        try:
+            for cycle in range(args.cycles):
+                start = time.perf_counter()
+                window = clients.create()
+                clients.map(window)
+                clients.wait_for(xproto.MapNotifyEvent, [window])
+                # Freshly started clients tend to ask for a size right away; nothing to wait for,
+                # the WM handles it before anything this client sends next
+                clients.conn.core.ConfigureWindow(window, xproto.ConfigWindow.Width | xproto.ConfigWindow.Height,
+                                                  [200 + cycle % 400, 150 + cycle % 300])
+
+                if len(clients.windows) > args.windows:
+                    oldest = clients.windows[0]
+                    clients.destroy(oldest)
+                    clients.wait_for(xproto.DestroyNotifyEvent, [oldest])
+
+                if cycle % args.switch_every == args.switch_every - 1:
+                    windows = list(clients.windows)
+                    clients.press('2')
+                    clients.wait_for(xproto.UnmapNotifyEvent, windows)
+                    clients.press('1')
+                    clients.wait_for(xproto.MapNotifyEvent, windows)
+
+                soak.record(time.perf_counter() - start)
+        finally:
+            clients.close()
+            shutil.rmtree(config_dir, ignore_errors=True)
+
+"""FakeConnection that gets its events one cycle at a time. When the WM has drained and committed
+a cycle, it calls `next_cycle()` for the next cycle's events; an empty list ends the run. Requests
+are counted but not logged, because the log would grow for the whole run."""
+class SoakConnection(FakeConnection):
+    def __init__(self, next_cycle) -> None:
+        super().__init__()
+        self.next_cycle = next_cycle
+        self.requests = collections.deque(maxlen=0)
+        self._settle_polls = 0
+
+    def poll_for_event(self):
+        if not self.events:
+            self._settle_polls += 1
+            if self._settle_polls <= SETTLE_POLLS:
+                return None
+            self._settle_polls = 0
+            self.events.extend(self.next_cycle())
+        return super().poll_for_event()
+
+"""Events of an endless fake session, one list per cycle."""
+def fake_cycles(conn, windows, switch_every):
+    def key(name):
+        return make_event('KeyPress', detail=conn.keycode(xpybutil.keysymdef.keysyms[name]), state=MOD4,
+                          root=ROOT_WINDOW, event=ROOT_WINDOW, child=0)
+
+    live = collections.deque()
+    cycle = 0
+    while True:
+        # New XIDs every time, like a long session: nothing keyed by window may outlive its window
+        window = FIRST_CLIENT_WINDOW + 0x1000 + cycle
+        live.append(window)
+        events = [
+            make_event('MapRequest', parent=ROOT_WINDOW, window=window),
+            make_event('ConfigureRequest', window=window, parent=ROOT_WINDOW, sibling=0, stack_mode=0,
+                       x=0, y=0, width=200 + cycle % 400, height=150 + cycle % 300, border_width=0, value_mask=0xf),
+            make_event('EnterNotify', event=window, root=ROOT_WINDOW, child=0, detail=0, mode=0, state=0, same_screen_focus=1),
+        ]
+        if len(live) > windows:
+            oldest = live.popleft()
+            events += [make_event('UnmapNotify', event=ROOT_WINDOW, window=oldest, from_configure=0),
+                       make_event('DestroyNotify', event=ROOT_WINDOW, window=oldest)]
+        if cycle % switch_every == switch_every - 1:
+            events += [key('2'), key('1')]
+        yield events
+        cycle += 1
+
+"""Cycles on the fake connection: the WM runs here, and a cycle lasts from one refill to the next."""
+def run_fake(args, soak) -> None:
+    cycles = None
+    last = None
+
+    def next_cycle():
+        nonlocal last
+        now = time.perf_counter()
+        if last is not None and soak.cycles < args.cycles:
+            soak.record(now - last)
+        last = now
+        if soak.cycles >= args.cycles:
+            return []
+        return next(cycles)
+
+    directory, config_path = write_config(replay_config())
+    try:
+        conn = SoakConnection(next_cycle)
+        cycles = fake_cycles(conn, args.windows, args.switch_every)
+        soak.wm = WindowManager(config_path=config_path, conn=conn)
+        soak.wm.run()
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+"""Thresholds the growth broke, as readable lines."""
+def failures(growth, args) -> list:
+    found = []
+    if growth.get('heap_kb', 0) > args.max_heap_growth:
+        found.append(f"heap grew by {growth['heap_kb']:.0f} KiB (limit {args.max_heap_growth} KiB)")
+    if growth.get('rss_kb', 0) > args.max_rss_growth:
+        found.append(f"RSS grew by {growth['rss_kb']:.0f} KiB (limit {args.max_rss_growth} KiB)")
+    if (growth.get('cycle_drift') or 0) > args.max_drift:
+        found.append(f"median cycle time drifted by {growth['cycle_drift']:.2f}x (limit {args.max_drift}x)")
+    return found
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--cycles', type=int, default=200000)
+    parser.add_argument('--fake', action='store_true', help="use fakex.FakeConnection instead of an X server")
+    parser.add_argument('--server', choices=('xvfb', 'xephyr'), default='xvfb')
+    parser.add_argument('--windows', type=int, default=50, help="windows open at once")
+    parser.add_argument('--switch-every', type=int, default=10, help="cycles between workspace switches")
+    parser.add_argument('--interval', type=int, default=10000, help="cycles between samples")
+    parser.add_argument('--warmup', type=int, default=20000, help="cycles before the baseline sample")
+    parser.add_argument('--frames', type=int, default=1, help="traceback depth tracemalloc keeps")
+    parser.add_argument('--top', type=int, default=10, help="growing source lines to report")
+    parser.add_argument('--max-heap-growth', type=int, default=512, help="KiB")
+    parser.add_argument('--max-rss-growth', type=int, default=16384, help="KiB")
+    parser.add_argument('--max-drift', type=float, default=1.5, help="last median cycle time / baseline")
+    parser.add_argument('--output', help="write the report here instead of stdout")
+    args = parser.parse_args()
+
+    if args.warmup + args.interval > args.cycles:
+        parser.error("--cycles must leave at least one interval after --warmup")
+
+    tracemalloc.start(args.frames)
+    soak = Soak(args.interval, args.warmup)
+    if args.fake:
+        run_fake(args, soak)
+    else:
+        run_x(args, soak)
+    growth, lines = soak.growth(args.top)
+    tracemalloc.stop()
+
+    found = failures(growth, args)
+    report = {
+        'revision': revision(),
+        'timestamp': time.time(),
+        'server': 'fake' if args.fake else args.server,
+        'windows': args.windows,
+        'samples': soak.samples,
+        'growth': growth,
+        'top_growth': lines,
+        'failures': found,
+    }
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+
+    for line in found:
+        print(f"LEAK {line}", file=sys.stderr)
+    return 1 if found else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
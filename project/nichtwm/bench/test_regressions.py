@@ -0,0 +1,161 @@
+#!/usr/bin/env python3
+
+"""
+Regression tests on the fake X connection (see fakex.py); no X server needed.
+
+  python3 -m unittest test_regressions     from bench/
+"""
+
+import os
+import shutil
+import logging
+import tempfile
+import unittest
+from unittest import mock
+
+import yaml
+import xcffib
+import xcffib.xproto as xproto
+
+from fakex import FakeConnection, make_event, make_error, ROOT_WINDOW, FIRST_CLIENT_WINDOW
+from replay import replay_config, write_config
+
+from nichtwm import WindowManager # noqa: E402 (replay put bin/ on the path)
+
+A, B, C = FIRST_CLIENT_WINDOW + 1, FIRST_CLIENT_WINDOW + 2, FIRST_CLIENT_WINDOW + 3
+
+def map_request(window):
+    return make_event('MapRequest', parent=ROOT_WINDOW, window=window)
+
+def enter_notify(window):
+    return make_event('EnterNotify', event=window, root=ROOT_WINDOW, child=0, detail=0, mode=0, state=0, same_screen_focus=1)
+
+class FakeWMTest(unittest.TestCase):
+    def setUp(self) -> None:
+        # The config cache goes to a throwaway directory, not the user's
+        self.cache = tempfile.mkdtemp(prefix='nichtwm-test-cache-')
+        patcher = mock.patch.dict(os.environ, {'XDG_CACHE_HOME': self.cache})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(shutil.rmtree, self.cache, True)
+        logging.disable(logging.CRITICAL)
+        self.addCleanup(logging.disable, logging.NOTSET)
+
+    """Run a WindowManager over `events` until the fake server goes away."""
+    def run_wm(self, events, **config):
+        directory, self.config_path = write_config(dict(replay_config(), **config))
+        self.addCleanup(shutil.rmtree, directory, True)
+        conn = FakeConnection(events)
+        wm = WindowManager(config_path=self.config_path, conn=conn)
+        wm.run()
+        return wm, conn
+
+class DrainTest(FakeWMTest):
+    def test_consecutive_errors_keep_the_batch(self) -> None:
+        wm, _ = self.run_wm([map_request(A), map_request(B), make_error('Window', 1), make_error('Window', 2), map_request(C)])
+        self.assertEqual(set(wm.clients), {A, B, C})
+
+    def test_failing_handler_keeps_the_batch(self) -> None:
+        events = [map_request(A), make_event('KeyPress', detail=0, state=0, root=ROOT_WINDOW, event=ROOT_WINDOW, child=0), map_request(B)]
+        with mock.patch.object(WindowManager, '_handle_key_press_event', side_effect=RuntimeError('boom')):
+            wm, conn = self.run_wm(events)
+        self.assertEqual(set(wm.clients), {A, B})
+        self.assertEqual(conn.request_counts['MapWindow'], 2) # committed and flushed despite the error
+
+    def test_failing_map_request_costs_only_that_event(self) -> None:
+        with mock.patch.object(WindowManager, '_graceful_shutdown') as shutdown, \
+             mock.patch('rules.RuleEngine.request', side_effect=[RuntimeError('boom'), {}, {}]):
+            wm, _ = self.run_wm([map_request(A), map_request(B), map_request(C)], rules=[{'class': 'mpv', 'floating': True}])
+        shutdown.assert_not_called()
+        self.assertEqual(set(wm.clients), {B, C})
+
+class ConfigureRequestTest(FakeWMTest):
+    def configure_request(self, window):
+        return make_event('ConfigureRequest', window=window, parent=ROOT_WINDOW, sibling=0, stack_mode=0,
+                          x=5, y=5, width=123, height=45, border_width=0, value_mask=0xf)
+
+    def test_tiled_window_keeps_its_tile(self) -> None:
+        wm, conn = self.run_wm([map_request(A)])
+        tile = wm.clients.get(A).geometry
+        conn.requests.clear()
+        wm._handle_configure_request_event(self.configure_request(A))
+        wm._commit_batch()
+        self.assertEqual(wm.clients.get(A).geometry, tile)
+        self.assertNotIn('ConfigureWindow', [name for name, _ in conn.requests])
+        (name, (_, destination, _, event)), = [request for request in conn.requests if request[0] == 'SendEvent']
+        self.assertEqual(destination, A)
+        notify = xproto.ConfigureNotifyEvent(xcffib.MemoryUnpacker(event))
+        self.assertEqual((notify.x, notify.y, notify.width, notify.height), tile)
+
+    def test_floating_window_gets_what_it_asks_for(self) -> None:
+        wm, conn = self.run_wm([map_request(A)])
+        wm._set_floating(A, True)
+        wm._commit_batch()
+        conn.requests.clear()
+        wm._handle_configure_request_event(self.configure_request(A))
+        self.assertIn(('ConfigureWindow', (A, 0x7f, [5, 5, 123, 45, 0, 0, 0])), conn.requests)
+
+class RoundTripTest(FakeWMTest):
+    def test_batch_with_a_round_trip_looks_at_the_queue_again(self) -> None:
+        wm, conn = self.run_wm([])
+        # The keymap refresh waits for a reply, during which xcb may queue events the socket won't signal
+        conn.events.append(make_event('MappingNotify', request=int(xproto.Mapping.Keyboard), first_keycode=conn.setup.min_keycode, count=1))
+        conn._empty_polls = 0
+        wm.loop = mock.Mock()
+        wm._process_x_events()
+        wm.loop.call_soon.assert_called_once_with(wm._process_x_events)
+
+class CrossingFenceTest(FakeWMTest):
+    def test_focus_follows_the_pointer_past_sequence_wraparound(self) -> None:
+        wm, conn = self.run_wm([map_request(A), map_request(B)], **{'focus-interval': 0})
+        for index in range(12000): # about 84000 requests: the 16-bit sequence wraps around
+            window = (A, B)[index % 2]
+            conn.sequence += 7 # traffic of other batches
+            wm._handle_enter_notify_event(conn._deliver(enter_notify(window)))
+            self.assertEqual(wm.focused, window, f"crossing {index} was taken for one of ours")
+            wm._commit_batch()
+
+class MoveToWorkspaceTest(FakeWMTest):
+    def test_missing_workspace_keeps_focus_and_place(self) -> None:
+        wm, _ = self.run_wm([map_request(A), map_request(B)])
+        focused, workspace = wm.focused, wm.clients.get(wm.focused).workspace
+        wm._handle_action('MOVE_TO_WORKSPACE_9') # 6 workspaces
+        self.assertEqual(wm.focused, focused)
+        self.assertEqual(wm.clients.get(focused).workspace, workspace)
+
+class ReloadTest(FakeWMTest):
+    def state(self, wm):
+        return (dict(wm.config), dict(wm.keybinds), wm.button_modifier,
+                [tiling_manager.layout for manager in wm.workspace_managers for tiling_manager in manager.tiling_managers])
+
+    def test_bad_config_is_not_half_applied(self) -> None:
+        wm, _ = self.run_wm([])
+        before = self.state(wm)
+        with open(self.config_path, 'w') as f:
+            yaml.safe_dump(dict(replay_config(), layout='grid', modifier='hyper'), f)
+        self.assertFalse(wm.reload_config())
+        self.assertEqual(self.state(wm), before)
+
+    def test_malformed_config_is_rejected(self) -> None:
+        wm, _ = self.run_wm([])
+        before = self.state(wm)
+        for config in (dict(replay_config(), actions=[{'action': 'NEXT_LAYOUT'}]), # no key
+                       dict(replay_config(), actions='space'),
+                       dict(replay_config(), actions=['space']),
+                       dict(replay_config(), rules={'class': 'mpv'}),
+                       ['modifier', 'super'],
+                       'super'):
+            with open(self.config_path, 'w') as f:
+                yaml.safe_dump(config, f)
+            self.assertFalse(wm.reload_config(), config)
+            self.assertEqual(self.state(wm), before)
+
+    def test_good_config_is_applied(self) -> None:
+        wm, _ = self.run_wm([])
+        with open(self.config_path, 'w') as f:
+            yaml.safe_dump(dict(replay_config(), layout='grid'), f)
+        self.assertTrue(wm.reload_config())
+        self.assertEqual(wm.workspace_manager.tiling_manager().layout, 'grid')
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,368 @@
+#!/usr/bin/env python3
+
+"""
+Unit tests for the parts of nichtwm that are plain logic: the client registry, window rules,
+the control socket, the config cache, the layouts and the scrolling view. No X server needed.
+
+  python3 -m unittest test_units     from bench/
+"""
+
+import os
+import sys
+import json
+import shutil
+import socket
+import asyncio
+import logging
+import tempfile
+import unittest
+from types import SimpleNamespace
+from unittest import mock
+
+import yaml
+
+from fakex import FakeConnection, FIRST_CLIENT_WINDOW
+
+# nichtwm's modules live next to the executable, not in a package
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'bin'))
+
+import xcffib.xproto as xproto    # noqa: E402
+
+import layouts                    # noqa: E402
+import configcache                # noqa: E402
+from clients import ClientRegistry # noqa: E402
+from rules import RuleEngine, ATOM_NAMES # noqa: E402
+from tiling import TilingManager  # noqa: E402
+from ipc import ControlServer, parse_message # noqa: E402
+from configcache import ConfigCache, check_config # noqa: E402
+
+A, B, C, D, E = (FIRST_CLIENT_WINDOW + index for index in range(1, 6))
+
+class QuietTest(unittest.TestCase):
+    def setUp(self) -> None:
+        logging.disable(logging.CRITICAL)
+        self.addCleanup(logging.disable, logging.NOTSET)
+
+    def tempdir(self) -> str:
+        directory = tempfile.mkdtemp(prefix='nichtwm-test-')
+        self.addCleanup(shutil.rmtree, directory, True)
+        return directory
+
+class ClientRegistryTest(unittest.TestCase):
+    def setUp(self) -> None:
+        self.clients = ClientRegistry(3)
+        for window in (A, B, C):
+            self.clients.add(window, 0)
+
+    def test_ring_order_and_wraparound(self) -> None:
+        self.assertEqual(self.clients.windows(0), [A, B, C])
+        self.assertEqual(self.clients.next(C), A)
+        self.assertEqual(self.clients.prev(A), C)
+        self.assertEqual(self.clients.first(0), A)
+
+    def test_add_front_and_twice(self) -> None:
+        self.clients.add(D, 0, front=True)
+        self.clients.add(A, 1) # already managed: stays where it is
+        self.assertEqual(self.clients.windows(0), [D, A, B, C])
+        self.assertEqual(self.clients.count(1), 0)
+
+    def test_remove_head_and_last(self) -> None:
+        self.clients.remove(A)
+        self.assertEqual(self.clients.windows(0), [B, C])
+        self.assertIsNone(self.clients.remove(A))
+        self.clients.remove(B)
+        self.clients.remove(C)
+        self.assertEqual(self.clients.windows(0), [])
+        self.assertIsNone(self.clients.first(0))
+        self.assertEqual(self.clients.count(0), 0)
+
+    def test_move_and_promote(self) -> None:
+        self.clients.move(B, 2)
+        self.clients.promote(C)
+        self.assertEqual(self.clients.windows(0), [C, A])
+        self.assertEqual(self.clients.windows(2), [B])
+        self.assertEqual(self.clients.get(B).workspace, 2)
+        self.assertEqual(self.clients.counts, [2, 0, 1])
+
+    def test_tiled_skips_floating(self) -> None:
+        self.clients.get(B).floating = True
+        self.assertEqual(self.clients.tiled(0), [A, C])
+
+    def test_resize_keeps_order(self) -> None:
+        self.clients.add(D, 2)
+        self.clients.resize(2)
+        self.assertEqual(self.clients.windows(1), [D])
+        self.clients.resize(1)
+        self.assertEqual(self.clients.windows(0), [A, B, C, D])
+        self.assertEqual(self.clients.counts, [4])
+
+    def test_changes_counts_membership_only(self) -> None:
+        changes = self.clients.changes
+        self.clients.promote(B)
+        self.assertEqual(self.clients.changes, changes)
+        self.clients.move(B, 1)
+        self.clients.remove(C)
+        self.assertEqual(self.clients.changes, changes + 2)
+
+class RuleEngineTest(QuietTest):
+    def setUp(self) -> None:
+        super().setUp()
+        self.atoms = {name: 100 + index for index, name in enumerate(ATOM_NAMES)}
+        self.conn = FakeConnection()
+
+    def window(self, window, instance='', window_class='', title='', types=()):
+        properties = self.conn.properties
+        properties[(window, xproto.Atom.WM_CLASS)] = SimpleNamespace(value=f'{instance}\0{window_class}\0'.encode())
+        properties[(window, self.atoms['_NET_WM_NAME'])] = SimpleNamespace(value=title.encode())
+        properties[(window, self.atoms['_NET_WM_WINDOW_TYPE'])] = SimpleNamespace(
+            value=b''.join(self.atoms[f'_NET_WM_WINDOW_TYPE_{name.upper()}'].to_bytes(4, sys.byteorder) for name in types))
+        return window
+
+    def match(self, engine, window) -> dict:
+        return engine.match(engine.request(self.conn, window))
+
+    def test_exact_regex_and_type_matchers(self) -> None:
+        engine = RuleEngine([{'class': 'mpv', 'floating': True},
+                             {'instance-regex': '^crx_', 'workspace': 4},
+                             {'title': 'Picture-in-Picture', 'geometry': [1, 2, 3, 4]},
+                             {'type': 'dialog', 'floating': True}], self.atoms, num_workspaces=6)
+        self.assertEqual(self.match(engine, self.window(A, 'mpv', 'mpv')), {'floating': True})
+        self.assertEqual(self.match(engine, self.window(B, 'crx_abc', 'Chromium')), {'workspace': 4})
+        self.assertEqual(self.match(engine, self.window(C, title='Firefox - Picture-in-Picture')), {'geometry': [1, 2, 3, 4]})
+        self.assertEqual(self.match(engine, self.window(D, types=('normal', 'dialog'))), {'floating': True})
+        self.assertEqual(self.match(engine, self.window(E, 'xterm', 'XTerm')), {})
+
+    def test_every_matching_rule_applies_in_order(self) -> None:
+        engine = RuleEngine([{'class': 'mpv', 'workspace': 2}, {'title': '.', 'workspace': 3}], self.atoms, num_workspaces=6)
+        self.assertEqual(self.match(engine, self.window(A, 'mpv', 'mpv', 'video')), {'workspace': 3})
+
+    def test_all_exact_matchers_of_a_rule_must_match(self) -> None:
+        engine = RuleEngine([{'class': 'Chromium', 'instance': 'crx_app', 'floating': True}], self.atoms)
+        self.assertEqual(self.match(engine, self.window(A, 'chromium', 'Chromium')), {})
+        self.assertEqual(self.match(engine, self.window(B, 'crx_app', 'Chromium')), {'floating': True})
+
+    def test_invalid_rules_are_dropped(self) -> None:
+        engine = RuleEngine(['mpv',                                  # not a mapping
+                             {'floating': True},                     # matches nothing
+                             {'class': 'a', 'colour': 'red'},        # unknown key
+                             {'type': 'window'},                     # unknown type
+                             {'title': '('},                         # bad regex
+                             {'class': 'a', 'workspace': 0},
+                             {'class': 'a', 'workspace': 7},         # only 6 workspaces
+                             {'class': 'a', 'geometry': [1, 2, 3]},
+                             {'class': 'a', 'workspace': 6}], self.atoms, num_workspaces=6)
+        self.assertEqual([rule.index for rule in engine.rules], [8])
+
+    def test_no_rules_no_requests(self) -> None:
+        engine = RuleEngine(None, self.atoms)
+        self.assertFalse(engine)
+        self.assertEqual(engine.request(self.conn, A), {})
+        self.assertEqual(self.conn.requests, [])
+
+    def test_gone_window_matches_nothing(self) -> None:
+        engine = RuleEngine([{'class': 'mpv', 'floating': True}], self.atoms)
+        self.conn.dead_windows.add(A)
+        self.assertEqual(self.match(engine, A), {})
+
+class ParseMessageTest(unittest.TestCase):
+    def test_separators_blanks_and_case(self) -> None:
+        self.assertEqual(parse_message('switch_workspace_2; next_layout\n\n  query_focused ;'),
+                         ['SWITCH_WORKSPACE_2', 'NEXT_LAYOUT', 'QUERY_FOCUSED'])
+        self.assertEqual(parse_message(' ;\n'), [])
+
+class ControlServerTest(QuietTest):
+    def setUp(self) -> None:
+        super().setUp()
+        self.path = os.path.join(self.tempdir(), 'nichtwm.sock')
+        self.loop = asyncio.new_event_loop()
+        self.addCleanup(self.loop.close)
+
+    def serve(self, handler):
+        server = ControlServer(self.path, handler)
+        server.attach(self.loop)
+        self.addCleanup(server.close)
+        return server
+
+    """Send `data` from a client thread and return the decoded reply."""
+    def send(self, data) -> dict:
+        def client():
+            with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+                sock.connect(self.path)
+                sock.sendall(data)
+                sock.shutdown(socket.SHUT_WR)
+                return sock.makefile().readline()
+        return json.loads(self.loop.run_until_complete(self.loop.run_in_executor(None, client)))
+
+    def test_reply_of_the_handler(self) -> None:
+        self.serve(lambda message: {'ok': True, 'results': parse_message(message)})
+        self.assertEqual(self.send(b'next_layout'), {'ok': True, 'results': ['NEXT_LAYOUT']})
+        self.assertEqual(os.stat(self.path).st_mode & 0o777, 0o600)
+
+    def test_failing_handler_still_answers(self) -> None:
+        self.serve(mock.Mock(side_effect=RuntimeError('boom')))
+        self.assertEqual(self.send(b'NEXT_LAYOUT'), {'ok': False, 'error': 'boom'})
+
+    def test_bad_and_oversized_messages(self) -> None:
+        handler = mock.Mock(return_value={'ok': True})
+        self.serve(handler)
+        self.assertEqual(self.send(b'\xff\xfe'), {'ok': False, 'error': 'message is not UTF-8'})
+        self.assertEqual(self.send(b'x' * (70 * 1024)), {'ok': False, 'error': 'message too long'})
+        handler.assert_not_called()
+
+    def test_live_socket_is_not_taken_over(self) -> None:
+        self.serve(lambda message: {'ok': True})
+        with self.assertRaises(OSError):
+            ControlServer(self.path, lambda message: {'ok': True})
+
+class ConfigCacheTest(QuietTest):
+    def setUp(self) -> None:
+        super().setUp()
+        directory = self.tempdir()
+        self.config_path = os.path.join(directory, 'config.yaml')
+        self.cache_path = os.path.join(directory, 'cache', 'config.cache')
+        self.write({'modifier': 'super', 'num-o-workspaces': 6, 'actions': [{'key': 'space', 'action': 'NEXT_LAYOUT'}]})
+
+    def write(self, config) -> None:
+        with open(self.config_path, 'w') as f:
+            yaml.safe_dump(config, f)
+
+    def load(self) -> dict:
+        return ConfigCache(self.config_path, self.cache_path).load()
+
+    def test_miss_then_hit_without_parsing(self) -> None:
+        config = self.load()
+        self.assertTrue(os.path.exists(self.cache_path))
+        with mock.patch.object(ConfigCache, '_parse', side_effect=AssertionError('parsed again')):
+            self.assertEqual(self.load(), config)
+            os.utime(self.config_path, ns=(0, 0)) # touched, same content
+            self.assertEqual(self.load(), config)
+
+    def test_changed_file_misses(self) -> None:
+        self.load()
+        self.write({'modifier': 'alt', 'num-o-workspaces': 4, 'actions': []})
+        self.assertEqual(self.load()['num-o-workspaces'], 4)
+
+    def test_corrupt_cache_is_rebuilt(self) -> None:
+        self.load()
+        with open(self.cache_path, 'wb') as f:
+            f.write(b'not a pickle')
+        self.assertEqual(self.load()['modifier'], 'super')
+        self.assertEqual(ConfigCache(self.config_path, self.cache_path)._read_cache()['config']['modifier'], 'super')
+
+    def test_keysyms_and_keycodes(self) -> None:
+        cache = ConfigCache(self.config_path, self.cache_path)
+        cache.load()
+        self.assertEqual(len(cache.keysyms), 1)
+        cache.store_keycodes('keymap', {cache.keysyms[0]: 65})
+        reloaded = ConfigCache(self.config_path, self.cache_path)
+        reloaded.load()
+        self.assertEqual(reloaded.keycodes('keymap'), {cache.keysyms[0]: 65})
+        self.assertIsNone(reloaded.keycodes('another keymap'))
+
+    def test_missing_and_malformed_files(self) -> None:
+        self.load()
+        self.assertEqual(ConfigCache(self.config_path + '.missing', self.cache_path).load(), {})
+        for config in (['a list'], {'actions': 'space'}, {'actions': [{'action': 'NEXT_LAYOUT'}]},
+                       {'actions': [{'key': 'space'}]}, {'rules': {'class': 'mpv'}}):
+            self.write(config)
+            with self.assertRaises(ValueError):
+                self.load()
+        # Never cached: the good config's entry is still there
+        self.assertEqual(ConfigCache(self.config_path, self.cache_path)._read_cache()['config']['modifier'], 'super')
+
+    def test_check_config_accepts_commands_and_actions(self) -> None:
+        check_config({'actions': [{'key': 'Return', 'command': 'xterm'}, {'key': '1', 'action': 'SWITCH_WORKSPACE_1'}],
+                      'rules': None})
+
+    def test_one_cache_per_config_file(self) -> None:
+        with mock.patch.dict(os.environ, {'XDG_CACHE_HOME': '/cache'}):
+            first = configcache.default_cache_path('/home/a/config.yaml')
+            self.assertEqual(first, configcache.default_cache_path('/home/a/../a/config.yaml'))
+            self.assertNotEqual(first, configcache.default_cache_path('/tmp/bench/config.yaml'))
+            self.assertTrue(first.startswith('/cache/nichtwm/'))
+
+class LayoutsTest(unittest.TestCase):
+    RECT = (10, 20, 2560, 1600)
+
+    def test_numpy_and_lists_agree(self) -> None:
+        if layouts._backend(layouts.NUMPY_MIN_COUNT) is None:
+            self.skipTest("NumPy is not installed")
+        for name, layout in layouts.LAYOUTS.items():
+            for params in ({}, {'gap': 4, 'masters': 2, 'master-ratio': 0.6, 'column-ratio': 0.3}):
+                for count in (layouts.NUMPY_MIN_COUNT, 100, 257):
+                    batch = layouts.as_list(layout(count, self.RECT, params))
+                    with mock.patch.object(layouts, '_backend', return_value=None):
+                        plain = layout(count, self.RECT, params)
+                    self.assertEqual(batch, plain, f"{name} with {count} windows, {params}")
+
+    def test_few_windows_stay_plain_python(self) -> None:
+        self.assertIsInstance(layouts.grid(layouts.NUMPY_MIN_COUNT - 1, self.RECT, {}), list)
+
+    def test_rects_cover_the_area(self) -> None:
+        for name in ('columns', 'master-stack', 'grid', 'fibonacci', 'spiral'):
+            for count in (1, 2, 5, 10):
+                rects = layouts.as_list(layouts.LAYOUTS[name](count, self.RECT, {}))
+                self.assertEqual(len(rects), count)
+                self.assertEqual(sum(width * height for _, _, width, height in rects), 2560 * 1600, f"{name} {count}")
+
+    def test_empty_and_tiny(self) -> None:
+        for layout in layouts.LAYOUTS.values():
+            self.assertEqual(layout(0, self.RECT, {}), [])
+            self.assertTrue(all(width >= 1 and height >= 1 for _, _, width, height in
+                                layouts.as_list(layout(40, (0, 0, 8, 8), {'gap': 4}))))
+
+    def test_scrolling_columns(self) -> None:
+        params = {'column-ratio': 0.5}
+        self.assertEqual(layouts.columns_in_view(self.RECT, params), 2)
+        self.assertEqual(layouts.scrolling(2, self.RECT, params), [(10, 20, 1280, 1600), (1290, 20, 1280, 1600)])
+
+class ScrollingViewTest(unittest.TestCase):
+    def setUp(self) -> None:
+        self.clients = ClientRegistry(1)
+        screen = SimpleNamespace(width_in_pixels=2000, height_in_pixels=1000)
+        self.tiling = TilingManager(FakeConnection(), screen, 1, self.clients, 0, layout='scrolling',
+                                    params={'column-ratio': 0.5}, rect=(0, 0, 2000, 1000))
+        for window in (A, B, C, D, E):
+            self.tiling.add_window(window)
+        self.arrange()
+
+    def arrange(self) -> tuple:
+        self.tiling.arrange_windows()
+        return self.tiling.take_view_changes()
+
+    def test_view_starts_at_the_strip_start(self) -> None:
+        self.assertEqual(self.tiling._view(), [A, B])
+        self.assertEqual(self.tiling.visible_windows(), [A, B])
+        self.assertEqual(self.clients.get(B).geometry, (1000, 0, 1000, 1000))
+        self.assertIsNone(self.clients.get(C).geometry) # never laid out while out of view
+
+    def test_scroll_one_column_right(self) -> None:
+        self.tiling.scroll_to(C)
+        self.assertEqual(self.arrange(), ([A], [C]))
+        self.assertEqual(self.tiling.visible_windows(), [B, C])
+
+    def test_scroll_far_and_back(self) -> None:
+        self.tiling.scroll_to(E) # near the end: the view is pulled back to stay full
+        hidden, revealed = self.arrange()
+        self.assertEqual((sorted(hidden), revealed), ([A, B], [D, E]))
+        self.tiling.scroll_to(A)
+        self.arrange()
+        self.assertEqual(self.tiling.visible_windows(), [A, B])
+
+    def test_scroll_to_a_shown_window_does_nothing(self) -> None:
+        self.tiling.scroll_to(B)
+        self.assertFalse(self.tiling.dirty)
+
+    def test_floating_windows_are_skipped_and_shown(self) -> None:
+        self.clients.get(B).floating = True
+        self.assertEqual(self.tiling._view(), [A, C])
+        self.assertTrue(self.tiling.shows(self.clients.get(B)))
+
+    def test_anchor_leaving(self) -> None:
+        self.tiling.leave_view(A)
+        self.tiling.remove_window(A)
+        self.arrange()
+        self.assertEqual(self.tiling.visible_windows(), [B, C])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,162 @@
+#!/usr/bin/env python3
+
+"""
+Client registry: the single record of every window nichtwm manages.
+
+Each managed window gets one Client record, indexed by XID. The clients of a workspace
+form a circular doubly-linked ring in tiling order, so membership, lookup, removal,
+reordering and moving between workspaces are all O(1). WindowManager, TilingManager and
+WorkspaceManager all read from the same registry instead of keeping lists of their own.
+"""
+
+class Client:
+    __slots__ = ('window', 'workspace', 'prev', 'next', 'geometry', 'ignore_unmaps', 'floating', 'mapped')
+
+    def __init__(self, window, workspace) -> None:
+        self.window = window       # XID
+        self.workspace = workspace # index into the registry's workspaces
+        self.prev = None           # neighbours in the workspace ring
+        self.next = None
+        self.geometry = None       # (x, y, width, height) last sent to the server, None if unknown
+        self.ignore_unmaps = 0     # UnmapNotify events still to come from our own UnmapWindow requests
+        self.floating = False      # keeps its own geometry instead of taking a tile
+        self.mapped = False        # mapped by us (or found mapped at startup) and not unmapped since
+
+    def __repr__(self) -> str:
+        return f"Client({self.window}, workspace={self.workspace})"
+
+class ClientRegistry:
+    def __init__(self, num_workspaces) -> None:
+        self.clients = {}                     # window -> Client
+        self.heads = [None] * num_workspaces  # first Client of each workspace's ring
+        self.counts = [0] * num_workspaces    # clients per workspace
+        self.changes = 0                      # bumped whenever a window is added, removed or changes workspace
+
+    def __contains__(self, window) -> bool:
+        return window in self.clients
+
+    def __len__(self) -> int:
+        return len(self.clients)
+
+    def __iter__(self):
+        return iter(self.clients)
+
+    """Client record of a window, or None if it isn't managed."""
+    def get(self, window):
+        return self.clients.get(window)
+
+    """Start managing a window on a workspace, at the end of its ring (or the front)."""
+    def add(self, window, workspace, front=False) -> Client:
+        client = self.clients.get(window)
+        if client is not None:
+            return client
+
+        client = Client(window, workspace)
+        self.clients[window] = client
+        self._link(client, front)
+        self.changes += 1
+        return client
+
+    """Stop managing a window. Returns its Client, or None if it wasn't managed."""
+    def remove(self, window):
+        client = self.clients.pop(window, None)
+        if client is not None:
+            self._unlink(client)
+            self.changes += 1
+        return client
+
+    """Move a window to the end of another workspace's ring."""
+    def move(self, window, workspace) -> None:
+        client = self.clients[window]
+        if client.workspace == workspace:
+            return
+        self._unlink(client)
+        client.workspace = workspace
+        self._link(client, front=False)
+        self.changes += 1
+
+    """Move a window to the front of its workspace (the master slot in most layouts)."""
+    def promote(self, window) -> None:
+        client = self.clients[window]
+        if self.heads[client.workspace] is client:
+            return
+        self._unlink(client)
+        self._link(client, front=True)
+
+    """Change the number of workspaces; clients of dropped workspaces join the end of the new last one."""
+    def resize(self, num_workspaces) -> None:
+        self.remap(num_workspaces, lambda workspace: min(workspace, num_workspaces - 1))
+
+    """Renumber workspaces: every client of workspace w ends up on mapping(w), keeping ring order.
+    Client records (and their cached geometry) are kept, only relinked."""
+    def remap(self, num_workspaces, mapping) -> None:
+        rings = [self._ring(workspace) for workspace in range(len(self.heads))]
+        self.heads = [None] * num_workspaces
+        self.counts = [0] * num_workspaces
+        for workspace, ring in enumerate(rings):
+            target = mapping(workspace)
+            for client in ring:
+                client.workspace = target
+                self._link(client, front=False)
+        self.changes += 1
+
+    """Windows of a workspace, in tiling order."""
+    def windows(self, workspace) -> list:
+        return [client.window for client in self._ring(workspace)]
+
+    """Windows of a workspace that take a tile, in tiling order."""
+    def tiled(self, workspace) -> list:
+        return [client.window for client in self._ring(workspace) if not client.floating]
+
+    """Number of windows on a workspace."""
+    def count(self, workspace) -> int:
+        return self.counts[workspace]
+
+    """First window of a workspace, or None if it's empty."""
+    def first(self, workspace):
+        head = self.heads[workspace]
+        return head.window if head is not None else None
+
+    """Window after `window` on its workspace, wrapping around."""
+    def next(self, window):
+        return self.clients[window].next.window
+
+    """Window before `window` on its workspace, wrapping around."""
+    def prev(self, window):
+        return self.clients[window].prev.window
+
+    def _ring(self, workspace) -> list:
+        ring = []
+        head = client = self.heads[workspace]
+        while client is not None:
+            ring.append(client)
+            client = client.next
+            if client is head:
+                break
+        return ring
+
+    def _link(self, client, front) -> None:
+        workspace = client.workspace
+        head = self.heads[workspace]
+        if head is None:
+            client.prev = client.next = client
+            self.heads[workspace] = client
+        else:
+            tail = head.prev
+            client.prev, client.next = tail, head
+            tail.next = head.prev = client
+            if front:
+                self.heads[workspace] = client
+        self.counts[workspace] += 1
+
+    def _unlink(self, client) -> None:
+        workspace = client.workspace
+        if client.next is client:
+            self.heads[workspace] = None
+        else:
+            client.prev.next = client.next
+            client.next.prev = client.prev
+            if self.heads[workspace] is client:
+                self.heads[workspace] = client.next
+        client.prev = client.next = None
+        self.counts[workspace] -= 1
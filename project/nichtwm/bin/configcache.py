@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+
+"""
+Precompiled config cache, so startup doesn't pay for YAML parsing and the keysym table.
+
+The cache (a pickle under $XDG_CACHE_HOME/nichtwm/, one per config file) holds the parsed
+config, the keysym of every binding and, per keyboard mapping, the keycodes those keysyms
+resolved to. It is keyed by the config file's mtime/size first (no read at all when those match)
+and its content hash second (a touched-but-identical file still hits). Only on a miss are yaml
+and xpybutil's keysym table imported.
+"""
+
+import os
+import pickle
+import hashlib
+import logging
+
+CACHE_VERSION = 1
+
+"""Check the shape the rest of the WM relies on: a mapping at the top, `actions` a list of mappings
+that each have a `key` and a `command` or `action`, and `rules` a list. Raises ValueError."""
+def check_config(config) -> None:
+    if not isinstance(config, dict):
+        raise ValueError(f"the config must be a mapping, not {type(config).__name__}")
+    actions = config.get('actions', [])
+    if not isinstance(actions, list):
+        raise ValueError(f"actions must be a list, not {type(actions).__name__}")
+    for index, action in enumerate(actions):
+        if not isinstance(action, dict):
+            raise ValueError(f"action {index + 1} must be a mapping, not {type(action).__name__}")
+        if 'key' not in action:
+            raise ValueError(f"action {index + 1} has no key")
+        if 'command' not in action and 'action' not in action:
+            raise ValueError(f"binding for key {action['key']} has neither a command nor an action")
+    if not isinstance(config.get('rules') or [], list):
+        raise ValueError(f"rules must be a list, not {type(config['rules']).__name__}")
+
+"""Default location of the cache file of `config_path`. Named after the config's absolute path, so a
+nichtwm started with another config (a benchmark, a replay) doesn't overwrite the main one's cache."""
+def default_cache_path(config_path) -> str:
+    directory = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.environ.get('HOME', '/tmp'), '.cache')
+    name = hashlib.blake2b(os.path.abspath(config_path).encode(), digest_size=8).hexdigest()
+    return os.path.join(directory, 'nichtwm', f'config-{name}.cache')
+
+class ConfigCache:
+    def __init__(self, config_path, cache_path=None) -> None:
+        self.config_path = config_path
+        self.cache_path = cache_path or default_cache_path(config_path)
+        self.config = {}
+        self.keysyms = []   # keysym of each entry of config['actions'], None if it doesn't resolve
+        self._entry = None  # what's on disk / about to be written
+
+    """Load the config, from the cache when the file hasn't changed. Returns the config dict, empty
+    if the file is missing or isn't YAML; raises ValueError if it parses into something unusable
+    (see check_config). Only a config that passed the check gets cached."""
+    def load(self) -> dict:
+        try:
+            stat = os.stat(self.config_path)
+        except FileNotFoundError:
+            logging.error(f"Config file not found: {self.config_path}")
+            self.config, self.keysyms, self._entry = {}, [], None
+            return self.config
+
+        stat_key = (os.path.abspath(self.config_path), stat.st_mtime_ns, stat.st_size)
+        entry = self._read_cache()
+
+        # Fast path: same file, same mtime and size, nothing to read
+        if entry is not None and entry['stat'] == stat_key:
+            return self._use(entry)
+
+        with open(self.config_path, 'rb') as f:
+            data = f.read()
+        digest = hashlib.blake2b(data, digest_size=16).hexdigest()
+
+        # Touched but identical (editor re-save, git checkout): still valid
+        if entry is not None and entry['hash'] == digest:
+            entry['stat'] = stat_key
+            self._write_cache(entry)
+            return self._use(entry)
+
+        config = self._parse(data)
+        if config:
+            check_config(config)
+        entry = {
+            'version': CACHE_VERSION,
+            'stat': stat_key,
+            'hash': digest,
+            'config': config,
+            'keysyms': self._resolve_keysyms(config),
+            'keycodes': {}, # keyboard mapping digest -> {keysym: keycode}
+        }
+        if config:
+            self._write_cache(entry)
+        return self._use(entry)
+
+    """Keycodes resolved for this config under the keyboard mapping `keymap_digest`, or None."""
+    def keycodes(self, keymap_digest):
+        if self._entry is None:
+            return None
+        return self._entry['keycodes'].get(keymap_digest)
+
+    """Remember the keycodes resolved under `keymap_digest` for the next start."""
+    def store_keycodes(self, keymap_digest, keycodes) -> None:
+        if self._entry is None or self._entry['keycodes'].get(keymap_digest) == keycodes:
+            return
+        # Only the current mapping is worth keeping
+        self._entry['keycodes'] = {keymap_digest: keycodes}
+        self._write_cache(self._entry)
+
+    def _use(self, entry) -> dict:
+        self._entry = entry
+        self.config = entry['config']
+        self.keysyms = entry['keysyms']
+        logging.debug("Loaded config %s", self.config_path) # not the config itself: formatting it costs on every start
+        return self.config
+
+    def _parse(self, data) -> dict:
+        import yaml # Only needed when the cache misses
+
+        try:
+            return yaml.safe_load(data) or {}
+        except yaml.YAMLError as e:
+            logging.error(f"Error loading YAML config: {e}")
+            return {}
+
+    def _resolve_keysyms(self, config) -> list:
+        from utils import KeyUtil
+
+        return [KeyUtil.string_to_keysym(action['key']) for action in config.get('actions', [])]
+
+    def _read_cache(self):
+        try:
+            with open(self.cache_path, 'rb') as f:
+                entry = pickle.load(f)
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            logging.debug(f"Ignoring unreadable config cache {self.cache_path}: {e}")
+            return None
+
+        if not isinstance(entry, dict) or entry.get('version') != CACHE_VERSION:
+            return None
+        return entry
+
+    def _write_cache(self, entry) -> None:
+        try:
+            os.makedirs(os.path.dirname(self.cache_path), exist_ok=True)
+            temporary = f'{self.cache_path}.{os.getpid()}'
+            with open(temporary, 'wb') as f:
+                pickle.dump(entry, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(temporary, self.cache_path) # never leave a half-written cache behind
+        except OSError as e:
+            logging.debug(f"Could not write config cache {self.cache_path}: {e}")
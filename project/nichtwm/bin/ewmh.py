@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+
+"""
+EWMH root window properties, so bars and pagers can follow nichtwm instead of polling X.
+
+Every atom nichtwm uses is interned once at startup: all InternAtom requests go out together and
+their replies are read after, one round-trip for the lot. EWMH keeps the last value written to
+each property and the WM hands it the whole state once per batch; only values that changed are
+written, so a burst of events costs at most one ChangeProperty per property, and a batch that
+changed nothing visible to EWMH costs none.
+"""
+
+import struct
+import logging
+
+import xcffib
+import xcffib.xproto as xproto
+
+# Atoms the WM needs; interned together at startup
+ATOM_NAMES = (
+    'UTF8_STRING',
+    '_NET_SUPPORTED',
+    '_NET_SUPPORTING_WM_CHECK',
+    '_NET_WM_NAME',
+    '_NET_NUMBER_OF_DESKTOPS',
+    '_NET_CURRENT_DESKTOP',
+    '_NET_CLIENT_LIST',
+    '_NET_ACTIVE_WINDOW',
+    '_NET_WM_DESKTOP',
+)
+
+# What nichtwm advertises in _NET_SUPPORTED
+SUPPORTED = (
+    '_NET_SUPPORTING_WM_CHECK',
+    '_NET_WM_NAME',
+    '_NET_NUMBER_OF_DESKTOPS',
+    '_NET_CURRENT_DESKTOP',
+    '_NET_CLIENT_LIST',
+    '_NET_ACTIVE_WINDOW',
+    '_NET_WM_DESKTOP',
+)
+
+"""Intern `names` in one round-trip. Returns name -> atom; names the server refused are left out."""
+def intern_atoms(conn, names) -> dict:
+    cookies = [(name, conn.core.InternAtom(False, len(name), name)) for name in names]
+    atoms = {}
+    for name, cookie in cookies:
+        try:
+            atoms[name] = cookie.reply().atom
+        except xcffib.Error as e:
+            logging.error(f"Failed to intern atom {name}: {e}")
+    return atoms
+
+class EWMH:
+    def __init__(self, conn, root_window, atoms) -> None:
+        self.conn = conn
+        self.root_window = root_window
+        self.atoms = atoms        # name -> atom, see intern_atoms()
+        self.check_window = None  # _NET_SUPPORTING_WM_CHECK child; the server destroys it when the WM disconnects
+        self.written = {}         # (window, property name) -> last value written
+
+    """Announce an EWMH-compliant WM called `name`: the supporting check window and _NET_SUPPORTED."""
+    def setup(self, name) -> None:
+        self.check_window = self.conn.generate_id()
+        self.conn.core.CreateWindow(
+            0, # depth: copied from the parent; an InputOnly window has none anyway
+            self.check_window, self.root_window,
+            -1, -1, 1, 1, 0,
+            xproto.WindowClass.InputOnly,
+            0, # visual: copied from the parent
+            0, []
+        )
+        self._write(self.root_window, '_NET_SUPPORTING_WM_CHECK', xproto.Atom.WINDOW, (self.check_window,))
+        self._write(self.check_window, '_NET_SUPPORTING_WM_CHECK', xproto.Atom.WINDOW, (self.check_window,))
+        self._write_string(self.check_window, '_NET_WM_NAME', name)
+        self._write(self.root_window, '_NET_SUPPORTED', xproto.Atom.ATOM,
+                    tuple(self.atoms[name] for name in SUPPORTED if name in self.atoms))
+
+    """Desktop count, current desktop and active window; each is only written if it changed."""
+    def update_desktops(self, num_desktops, current_desktop, active_window) -> None:
+        self._write(self.root_window, '_NET_NUMBER_OF_DESKTOPS', xproto.Atom.CARDINAL, (num_desktops,))
+        self._write(self.root_window, '_NET_CURRENT_DESKTOP', xproto.Atom.CARDINAL, (current_desktop,))
+        self._write(self.root_window, '_NET_ACTIVE_WINDOW', xproto.Atom.WINDOW,
+                    (active_window if active_window is not None else xproto.Window._None,))
+
+    """Client list (every managed window, oldest first) and the desktop of each one, as (window, desktop) pairs."""
+    def update_clients(self, clients, desktops) -> None:
+        self._write(self.root_window, '_NET_CLIENT_LIST', xproto.Atom.WINDOW, tuple(clients))
+        for window, desktop in desktops:
+            self._write(window, '_NET_WM_DESKTOP', xproto.Atom.CARDINAL, (desktop,))
+
+    """Drop what's cached about a window that isn't managed anymore."""
+    def forget(self, window) -> None:
+        self.written.pop((window, '_NET_WM_DESKTOP'), None)
+
+    """Set a format-32 property (CARDINAL, WINDOW, ATOM) unless it already holds `values`."""
+    def _write(self, window, name, type, values) -> None:
+        key = (window, name)
+        if self.written.get(key) == values or name not in self.atoms:
+            return
+        self.written[key] = values
+        data = struct.pack(f'={len(values)}I', *values)
+        self.conn.core.ChangeProperty(xproto.PropMode.Replace, window, self.atoms[name], type, 32, len(values), data)
+
+    def _write_string(self, window, name, value) -> None:
+        data = value.encode()
+        self.conn.core.ChangeProperty(xproto.PropMode.Replace, window, self.atoms[name],
+                                      self.atoms.get('UTF8_STRING', xproto.Atom.STRING), 8, len(data), data)
@@ -0,0 +1,52 @@
+#!/usr/bin/env python3
+
+"""
+Interactive move and resize of floating windows (modifier + button 1 drags, modifier + button 3
+resizes; dragging a tiled window floats it).
+
+Pointer motion arrives far faster than a client can redraw, so a drag never turns every
+MotionNotify into a ConfigureWindow: the event loop only keeps the last MotionNotify of each
+batch, the drag only remembers where the pointer is, and the WM sends the window's new geometry
+at most once per frame (`drag-rate`, per second) plus once more on release.
+"""
+
+import xcffib.xproto as xproto
+
+MOVE = 1   # button 1
+RESIZE = 3 # button 3
+MIN_SIZE = 16 # pixels; a resize never shrinks a window below this
+
+class Drag:
+    __slots__ = ('window', 'mode', 'pointer', 'geometry', 'target', 'sent')
+
+    def __init__(self, window, mode, pointer, geometry) -> None:
+        self.window = window     # XID being dragged
+        self.mode = mode         # MOVE or RESIZE
+        self.pointer = pointer   # (x, y) of the pointer at the button press, root coordinates
+        self.geometry = geometry # (x, y, width, height) of the window at the button press
+        self.target = pointer    # latest pointer position seen
+        self.sent = geometry     # last geometry sent to the server
+
+    """Where the window goes for the latest pointer position."""
+    def geometry_for_target(self) -> tuple:
+        x, y, width, height = self.geometry
+        dx, dy = self.target[0] - self.pointer[0], self.target[1] - self.pointer[1]
+        if self.mode == MOVE:
+            return (x + dx, y + dy, width, height)
+        return (x, y, max(MIN_SIZE, width + dx), max(MIN_SIZE, height + dy))
+
+"""Grab modifier + button 1/3 on the root window; presses, releases and motion while held come to the WM."""
+def grab_buttons(conn, root_window, modifier) -> None:
+    for button in (MOVE, RESIZE):
+        conn.core.GrabButton(
+            False, root_window,
+            xproto.EventMask.ButtonPress | xproto.EventMask.ButtonRelease | xproto.EventMask.ButtonMotion,
+            xproto.GrabMode.Async, xproto.GrabMode.Async,
+            xproto.Window._None, xproto.Cursor._None,
+            button, modifier
+        )
+
+"""Release the button grabs of grab_buttons()."""
+def ungrab_buttons(conn, root_window, modifier) -> None:
+    for button in (MOVE, RESIZE):
+        conn.core.UngrabButton(button, root_window, modifier)
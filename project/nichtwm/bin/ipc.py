@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+
+"""
+Control socket: drive nichtwm from scripts without synthesizing keystrokes.
+
+A client connects to a Unix socket, writes one message and shuts down its write side. A message
+is one or more commands separated by newlines or ';'. Commands are the actions config.yaml binds
+(SWITCH_WORKSPACE_2, NEXT_LAYOUT, KILL_WINDOW...) and QUERY_* state queries. The WM validates the
+whole message before applying any of it, applies it in one go and flushes once, then answers with
+a single JSON object: {"ok": true, "results": [...]} or {"ok": false, "error": "..."}.
+
+  nichtctl.py 'MOVE_TO_WORKSPACE_3; SWITCH_WORKSPACE_3; SET_LAYOUT_GRID'
+"""
+
+import os
+import json
+import socket
+import logging
+import traceback
+
+MAX_MESSAGE = 64 * 1024 # bytes; a message is a handful of short commands
+READ_TIMEOUT = 5.0      # seconds a connected client gets to finish its message before it's dropped
+
+"""Where the control socket lives unless config.yaml's `control-socket` names a path (which wins):
+$NICHTWM_SOCKET, else the runtime dir. nichtctl.py looks here too, so a path set only in the
+config has to be passed to it with --socket."""
+def default_socket_path() -> str:
+    if os.environ.get('NICHTWM_SOCKET'):
+        return os.environ['NICHTWM_SOCKET']
+    directory = os.environ.get('XDG_RUNTIME_DIR')
+    if directory:
+        return os.path.join(directory, 'nichtwm.sock')
+    return f'/tmp/nichtwm-{os.getuid()}.sock'
+
+"""Split a message into its commands."""
+def parse_message(message) -> list:
+    commands = []
+    for line in message.replace(';', '\n').splitlines():
+        command = line.strip()
+        if command:
+            commands.append(command.upper())
+    return commands
+
+class ControlServer:
+    def __init__(self, path, handler) -> None:
+        self.path = path
+        self.handler = handler # message (str) -> reply (dict)
+        self.loop = None       # asyncio loop serving the socket, see attach()
+        self.clients = {}      # connected client socket -> (bytes received so far, timeout handle)
+
+        # A socket file left by a crashed WM is fine to replace; one answering connections is not
+        if os.path.exists(path):
+            probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                probe.connect(path)
+                raise OSError(f"{path} is in use by another nichtwm")
+            except (ConnectionRefusedError, FileNotFoundError):
+                os.unlink(path)
+            finally:
+                probe.close()
+
+        self.socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        # The socket can kill windows; only its owner gets to use it. Created that way under a tight
+        # umask rather than chmod-ed after bind(), which would leave a moment where anyone could connect
+        umask = os.umask(0o177)
+        try:
+            self.socket.bind(path)
+        finally:
+            os.umask(umask)
+        self.socket.listen(8)
+        self.socket.setblocking(False)
+        logging.info(f"Control socket listening on {path}")
+
+    def fileno(self) -> int:
+        return self.socket.fileno()
+
+    """Serve the socket from an asyncio loop; clients are read as their data arrives, never waited on."""
+    def attach(self, loop) -> None:
+        self.loop = loop
+        loop.add_reader(self.socket, self._accept)
+
+    def _accept(self) -> None:
+        while True:
+            try:
+                client, _ = self.socket.accept()
+            except BlockingIOError:
+                return
+            client.setblocking(False)
+            self.clients[client] = (b'', self.loop.call_later(READ_TIMEOUT, self._drop, client, "timed out"))
+            self.loop.add_reader(client, self._receive, client)
+
+    def _receive(self, client) -> None:
+        data, timeout = self.clients[client]
+        try:
+            chunk = client.recv(4096)
+        except BlockingIOError:
+            return
+        except OSError as e:
+            self._drop(client, str(e))
+            return
+
+        if chunk:
+            data += chunk
+            if len(data) > MAX_MESSAGE:
+                self._reply(client, {'ok': False, 'error': 'message too long'})
+            else:
+                self.clients[client] = (data, timeout)
+            return
+
+        # EOF: the whole message is in
+        try:
+            reply = self.handler(data.decode())
+        except UnicodeDecodeError:
+            reply = {'ok': False, 'error': 'message is not UTF-8'}
+        except Exception as e:
+            # The client still gets an answer, and the WM's loop never sees the exception
+            logging.error(f"Control message failed: {e}")
+            logging.debug(traceback.format_exc())
+            reply = {'ok': False, 'error': str(e)}
+        self._reply(client, reply)
+
+    def _reply(self, client, reply) -> None:
+        try:
+            client.setblocking(True) # replies are small; the client is already waiting for it
+            client.settimeout(READ_TIMEOUT)
+            client.sendall(json.dumps(reply).encode() + b'\n')
+        except OSError as e:
+            logging.error(f"Control client dropped: {e}")
+        self._drop(client)
+
+    def _drop(self, client, reason=None) -> None:
+        if reason is not None:
+            logging.error(f"Control client dropped: {reason}")
+        _, timeout = self.clients.pop(client)
+        timeout.cancel()
+        self.loop.remove_reader(client)
+        client.close()
+
+    def close(self) -> None:
+        if self.loop is not None:
+            for client in list(self.clients):
+                self._drop(client)
+            self.loop.remove_reader(self.socket)
+        self.socket.close()
+        try:
+            os.unlink(self.path)
+        except FileNotFoundError:
+            pass
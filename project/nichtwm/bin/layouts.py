@@ -0,0 +1,245 @@
+#!/usr/bin/env python3
+
+"""
+Tiling layouts for nichtwm.
+
+Every layout is a pure function (count, rect, params) -> rects, where rect is the
+(x, y, width, height) area to tile and rects holds one (x, y, width, height) row per window,
+in stacking order. Nothing in here talks to X, so layouts can be called and benchmarked
+on their own (run this file to do so).
+
+From NUMPY_MIN_COUNT windows up, with NumPy installed, the rects come back as an int array of
+shape (count, 4) and are computed in batch; otherwise they come back as a list of tuples. NumPy is
+only imported the first time a layout gets that many windows: below it plain Python is as fast,
+and the import would add ~0.1 s to every start and restart.
+"""
+
+import math
+
+DEFAULT_LAYOUT = 'master-stack'
+
+# Window count from which the batch (NumPy) path pays for itself
+NUMPY_MIN_COUNT = 64
+
+_numpy = None         # the numpy module, once imported
+_numpy_tried = False  # import attempted (NumPy may not be installed)
+
+"""The numpy module if `count` windows are worth the batch path and NumPy is installed, else None."""
+def _backend(count):
+    global _numpy, _numpy_tried
+    if count < NUMPY_MIN_COUNT:
+        return None
+    if not _numpy_tried:
+        _numpy_tried = True
+        try:
+            import numpy
+            _numpy = numpy
+        except ImportError:
+            pass
+    return _numpy
+
+"""Offsets and sizes cutting `length` into `parts` slices that add up exactly."""
+def _split(length, parts, start=0, np=None):
+    if np is not None:
+        edges = start + (np.arange(parts + 1) * length) // parts
+        return edges[:-1], np.diff(edges)
+
+    edges = [start + (i * length) // parts for i in range(parts + 1)]
+    return edges[:-1], [b - a for a, b in zip(edges, edges[1:])]
+
+"""Stack per-window columns into rects, shrinking each by the configured gap."""
+def _rects(xs, ys, widths, heights, params, np=None):
+    gap = params.get('gap', 0)
+
+    if np is not None:
+        rects = np.column_stack(np.broadcast_arrays(xs, ys, widths, heights)).astype(np.int64)
+        if gap:
+            rects[:, :2] += gap
+            rects[:, 2:] -= 2 * gap
+        # X refuses zero-sized windows
+        np.maximum(rects[:, 2:], 1, out=rects[:, 2:])
+        return rects
+
+    count = max(len(v) for v in (xs, ys, widths, heights) if isinstance(v, list))
+    columns = [v if isinstance(v, list) else [v] * count for v in (xs, ys, widths, heights)]
+    return [(x + gap, y + gap, max(1, w - 2 * gap), max(1, h - 2 * gap)) for x, y, w, h in zip(*columns)]
+
+"""An empty result."""
+def _empty():
+    return []
+
+"""Every window fills the whole area; only the top one is visible."""
+def monocle(count, rect, params):
+    if count == 0:
+        return _empty()
+    np = _backend(count)
+    x, y, width, height = rect
+    if np is not None:
+        return _rects(np.full(count, x), y, width, height, params, np)
+    return _rects([x] * count, y, width, height, params, np)
+
+"""Equal-width columns side by side."""
+def columns(count, rect, params):
+    if count == 0:
+        return _empty()
+    np = _backend(count)
+    x, y, width, height = rect
+    xs, widths = _split(width, count, x, np)
+    return _rects(xs, y, widths, height, params, np)
+
+"""`masters` windows split the left `master-ratio` of the area, the rest stack on the right."""
+def master_stack(count, rect, params):
+    if count == 0:
+        return _empty()
+    np = _backend(count)
+    x, y, width, height = rect
+    masters = min(max(1, params.get('masters', 1)), count)
+    stacked = count - masters
+
+    if stacked == 0:
+        # Masters only: they take the full width
+        ys, heights = _split(height, masters, y, np)
+        return _rects(x, ys, width, heights, params, np)
+
+    master_width = int(width * params.get('master-ratio', 0.5))
+    master_ys, master_heights = _split(height, masters, y, np)
+    stack_ys, stack_heights = _split(height, stacked, y, np)
+
+    if np is not None:
+        xs = np.where(np.arange(count) < masters, x, x + master_width)
+        widths = np.where(np.arange(count) < masters, master_width, width - master_width)
+        return _rects(xs, np.concatenate((master_ys, stack_ys)), widths,
+                      np.concatenate((master_heights, stack_heights)), params, np)
+
+    xs = [x] * masters + [x + master_width] * stacked
+    widths = [master_width] * masters + [width - master_width] * stacked
+    return _rects(xs, master_ys + stack_ys, widths, master_heights + stack_heights, params, np)
+
+"""Near-square grid; the last row stretches its cells to use the full width."""
+def grid(count, rect, params):
+    if count == 0:
+        return _empty()
+    np = _backend(count)
+    x, y, width, height = rect
+    cols = math.ceil(math.sqrt(count))
+    rows = math.ceil(count / cols)
+    last_row_count = count - cols * (rows - 1)
+
+    if np is not None:
+        index = np.arange(count)
+        row = index // cols
+        col = index - row * cols
+        row_cols = np.where(row == rows - 1, last_row_count, cols)
+        xs = x + (col * width) // row_cols
+        widths = x + ((col + 1) * width) // row_cols - xs
+        ys = y + (row * height) // rows
+        heights = y + ((row + 1) * height) // rows - ys
+        return _rects(xs, ys, widths, heights, params, np)
+
+    xs, ys, widths, heights = [], [], [], []
+    for index in range(count):
+        row, col = divmod(index, cols)
+        row_cols = last_row_count if row == rows - 1 else cols
+        xs.append(x + (col * width) // row_cols)
+        widths.append(x + ((col + 1) * width) // row_cols - xs[-1])
+        ys.append(y + (row * height) // rows)
+        heights.append(y + ((row + 1) * height) // rows - ys[-1])
+    return _rects(xs, ys, widths, heights, params, np)
+
+"""Each window takes half of what the previous one left over, alternating split direction."""
+def _halving(count, rect, params, spiral):
+    if count == 0:
+        return _empty()
+    np = _backend(count)
+    x, y, width, height = rect
+    xs, ys, widths, heights = [], [], [], []
+
+    # Inherently sequential, but each step halves the area so past a few dozen windows
+    # the remaining rects are 1px anyway
+    for index in range(count):
+        if index == count - 1:
+            xs.append(x); ys.append(y); widths.append(width); heights.append(height)
+            break
+
+        turn = index % 4 if spiral else index % 2
+        if index % 2 == 0:
+            # Split vertically: this window keeps the left half (right half when spiralling back)
+            half = width // 2
+            if turn == 2:
+                xs.append(x + width - half); x_next = x
+            else:
+                xs.append(x); x_next = x + half
+            ys.append(y); widths.append(half); heights.append(height)
+            x, width = x_next, width - half
+        else:
+            # Split horizontally: top half (bottom half when spiralling back)
+            half = height // 2
+            if turn == 3:
+                ys.append(y + height - half); y_next = y
+            else:
+                ys.append(y); y_next = y + half
+            xs.append(x); widths.append(width); heights.append(half)
+            y, height = y_next, height - half
+
+    if np is not None:
+        return _rects(np.array(xs), np.array(ys), np.array(widths), np.array(heights), params, np)
+    return _rects(xs, ys, widths, heights, params, np)
+
+"""Fibonacci/dwindle: halves always carved from the top-left, windows shrink toward the bottom-right."""
+def fibonacci(count, rect, params):
+    return _halving(count, rect, params, spiral=False)
+
+"""Spiral: like fibonacci, but the halves rotate clockwise around the centre."""
+def spiral(count, rect, params):
+    return _halving(count, rect, params, spiral=True)
+
+"""Scrolling (PaperWM-style): windows sit side by side on an endless horizontal strip, each
+`column-ratio` of the area wide. Only the columns in view are ever laid out, so `count` here is
+how many of them there are (see columns_in_view), never the size of the workspace."""
+def scrolling(count, rect, params):
+    if count == 0:
+        return _empty()
+    np = _backend(count)
+    x, y, width, height = rect
+    column = _column_width(width, params)
+    if np is not None:
+        return _rects(x + np.arange(count) * column, y, column, height, params, np)
+    return _rects([x + index * column for index in range(count)], y, column, height, params, np)
+
+"""How many whole columns of the scrolling layout fit in `rect`."""
+def columns_in_view(rect, params):
+    width = rect[2]
+    return max(1, width // _column_width(width, params))
+
+def _column_width(width, params):
+    return max(1, int(width * params.get('column-ratio', 0.5)))
+
+LAYOUTS = {
+    'master-stack': master_stack,
+    'grid': grid,
+    'monocle': monocle,
+    'fibonacci': fibonacci,
+    'spiral': spiral,
+    'columns': columns,
+    'scrolling': scrolling,
+}
+
+"""Plain list of (x, y, width, height) tuples, whichever backend computed them."""
+def as_list(rects):
+    if _numpy is not None and isinstance(rects, _numpy.ndarray):
+        return [tuple(rect) for rect in rects.tolist()]
+    return rects
+
+"""Time every layout for a range of window counts, no X server needed."""
+def benchmark(counts=(1, 10, 100, 500), repeat=200):
+    import timeit
+
+    rect = (0, 0, 2560, 1600)
+    params = {'gap': 4}
+    for name, layout in LAYOUTS.items():
+        for count in counts:
+            seconds = min(timeit.repeat(lambda: layout(count, rect, params), number=repeat, repeat=3)) / repeat
+            print(f"{name:>12} {count:>5} windows: {seconds * 1e6:9.1f} us")
+
+if __name__ == '__main__':
+    benchmark()
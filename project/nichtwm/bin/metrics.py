@@ -0,0 +1,209 @@
+#!/usr/bin/env python3
+
+"""
+Always-on instrumentation for nichtwm's hot paths.
+
+METRICS is the process-wide collector (like logging's root logger): the event loop records
+how long each X event took to handle, InstrumentedConnection counts requests, blocking
+round-trips (.reply()/.check()) and flushes, and @timed measures phases such as
+arrange_windows. Everything is a handful of integer adds per event, so it stays on in
+production; `dump` writes a JSON snapshot (SIGUSR1 or the DUMP_METRICS action).
+"""
+
+import os
+import json
+import time
+import logging
+import functools
+
+"""Latency histogram with power-of-two microsecond buckets."""
+class Histogram:
+    __slots__ = ('buckets', 'count', 'total', 'max')
+
+    def __init__(self) -> None:
+        self.buckets = [0] * 32 # bucket i counts samples in [2^(i-1), 2^i) us
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def record(self, seconds) -> None:
+        micros = int(seconds * 1e6)
+        self.buckets[min(micros.bit_length(), 31)] += 1
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    """Upper bound (us) of the bucket holding the p-th percentile."""
+    def percentile(self, p) -> int:
+        target = self.count * p / 100
+        seen = 0
+        for index, count in enumerate(self.buckets):
+            seen += count
+            if count and seen >= target:
+                return 1 << index
+        return 0
+
+    def snapshot(self) -> dict:
+        return {
+            'count': self.count,
+            'mean_us': self.total / self.count * 1e6 if self.count else 0,
+            'p50_us': self.percentile(50),
+            'p99_us': self.percentile(99),
+            'max_us': self.max * 1e6,
+            'buckets_us': {1 << index: count for index, count in enumerate(self.buckets) if count},
+        }
+
+"""Per-event-type latency plus what handling those events cost in X traffic."""
+class EventStats:
+    __slots__ = ('latency', 'requests', 'round_trips')
+
+    def __init__(self) -> None:
+        self.latency = Histogram()
+        self.requests = 0
+        self.round_trips = 0
+
+class Metrics:
+    def __init__(self) -> None:
+        self.enabled = True
+        self.started = time.time()
+        self.requests = 0
+        self.round_trips = 0
+        self.flushes = 0
+        self.batches = 0
+        self.events = {} # event type -> EventStats
+        self.phases = {} # phase name -> Histogram
+        self.gauges = {} # name -> function returning the current value, read at snapshot time
+
+    """Account one handled event: how long it took and the X traffic it caused."""
+    def record_event(self, event_type, seconds, requests, round_trips) -> None:
+        stats = self.events.get(event_type)
+        if stats is None:
+            stats = self.events[event_type] = EventStats()
+        stats.latency.record(seconds)
+        stats.requests += requests
+        stats.round_trips += round_trips
+
+    def record_phase(self, name, seconds) -> None:
+        histogram = self.phases.get(name)
+        if histogram is None:
+            histogram = self.phases[name] = Histogram()
+        histogram.record(seconds)
+
+    """Report `function()` as `name` in every snapshot, e.g. the number of managed windows."""
+    def gauge(self, name, function) -> None:
+        self.gauges[name] = function
+
+    def snapshot(self) -> dict:
+        events = {}
+        for event_type, stats in self.events.items():
+            name = getattr(event_type, '__name__', str(event_type))
+            count = stats.latency.count or 1
+            events[name[:-len('Event')] if name.endswith('Event') else name] = dict(
+                stats.latency.snapshot(),
+                requests_per_event=stats.requests / count,
+                round_trips_per_event=stats.round_trips / count,
+            )
+
+        return {
+            'pid': os.getpid(),
+            'uptime_s': time.time() - self.started,
+            'requests': self.requests,
+            'round_trips': self.round_trips,
+            'flushes': self.flushes,
+            'batches': self.batches,
+            'gauges': {name: function() for name, function in self.gauges.items()},
+            'events': events,
+            'phases': {name: histogram.snapshot() for name, histogram in self.phases.items()},
+        }
+
+    """Write a JSON snapshot and return its path."""
+    def dump(self, path=None) -> str:
+        path = path or default_dump_path()
+        with open(path, 'w') as f:
+            json.dump(self.snapshot(), f, indent=2)
+        logging.info(f"Metrics written to {path}")
+        return path
+
+    def reset(self) -> None:
+        enabled, gauges = self.enabled, self.gauges
+        self.__init__()
+        self.enabled, self.gauges = enabled, gauges
+
+METRICS = Metrics()
+
+"""Where dumps go unless told otherwise."""
+def default_dump_path() -> str:
+    directory = os.environ.get('XDG_RUNTIME_DIR') or '/tmp'
+    return os.path.join(directory, f'nichtwm-metrics-{os.getpid()}.json')
+
+"""Decorator timing every call of a function as phase `name`."""
+def timed(name):
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if not METRICS.enabled:
+                return function(*args, **kwargs)
+            start = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                METRICS.record_phase(name, time.perf_counter() - start)
+        return wrapper
+    return decorator
+
+"""Cookie wrapper counting .reply()/.check() as blocking round-trips."""
+class InstrumentedCookie:
+    __slots__ = ('cookie',)
+
+    def __init__(self, cookie) -> None:
+        self.cookie = cookie
+
+    def reply(self):
+        METRICS.round_trips += 1
+        return self.cookie.reply()
+
+    def check(self):
+        METRICS.round_trips += 1
+        return self.cookie.check()
+
+    def __getattr__(self, name):
+        return getattr(self.cookie, name)
+
+"""Proxy around conn.core (or an extension) counting each request."""
+class InstrumentedExtension:
+    def __init__(self, extension) -> None:
+        self._extension = extension
+
+    def __getattr__(self, name):
+        request = getattr(self._extension, name)
+        if not callable(request):
+            return request
+
+        def counted(*args, **kwargs):
+            METRICS.requests += 1
+            return InstrumentedCookie(request(*args, **kwargs))
+
+        # Cache it so __getattr__ only runs once per request type
+        setattr(self, name, counted)
+        return counted
+
+"""Proxy around an xcffib connection feeding METRICS."""
+class InstrumentedConnection:
+    def __init__(self, conn) -> None:
+        self._conn = conn
+        self.core = InstrumentedExtension(conn.core)
+        self._extensions = {}
+
+    def flush(self):
+        METRICS.flushes += 1
+        return self._conn.flush()
+
+    def __call__(self, key):
+        extension = self._extensions.get(key)
+        if extension is None:
+            extension = self._extensions[key] = InstrumentedExtension(self._conn(key))
+        return extension
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
@@ -0,0 +1,55 @@
+#!/usr/bin/env python3
+
+"""
+Send commands to a running nichtwm through its control socket.
+
+  nichtctl.py SWITCH_WORKSPACE_2
+  nichtctl.py 'MOVE_TO_WORKSPACE_3; SWITCH_WORKSPACE_3' NEXT_LAYOUT    all applied at once, one flush
+  nichtctl.py QUERY_WORKSPACES QUERY_FOCUSED
+  some-script | nichtctl.py -                                          commands from stdin
+
+Prints the WM's JSON reply; exits 1 if it rejected the message, 2 if it couldn't be reached or didn't answer.
+"""
+
+import sys
+import json
+import socket
+import argparse
+
+from ipc import default_socket_path
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('commands', nargs='+', help="commands, or - to read them from stdin")
+    parser.add_argument('--socket', default=default_socket_path(), help="control socket (default: %(default)s)")
+    args = parser.parse_args()
+
+    message = sys.stdin.read() if args.commands == ['-'] else '\n'.join(args.commands)
+
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client:
+        try:
+            client.connect(args.socket)
+        except OSError as e:
+            print(f"nichtctl: cannot connect to {args.socket}: {e}", file=sys.stderr)
+            return 2
+        client.sendall(message.encode())
+        client.shutdown(socket.SHUT_WR) # end of message
+
+        data = b''
+        while chunk := client.recv(4096):
+            data += chunk
+
+    if not data:
+        print("nichtctl: nichtwm closed the connection without replying", file=sys.stderr)
+        return 2
+    try:
+        reply = json.loads(data)
+    except ValueError as e:
+        print(f"nichtctl: unreadable reply from nichtwm: {e}", file=sys.stderr)
+        return 2
+    json.dump(reply, sys.stdout, indent=2)
+    print()
+    return 0 if reply.get('ok') else 1
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -17,29 +17,63 @@
 # modules
 from utils import KeyUtil
 from tiling import TilingManager
+from workspaces import WorkspaceManager
+import outputs
+from clients import ClientRegistry
+from metrics import METRICS, InstrumentedConnection, timed
+from tracer import TRACE, event_window
+import tracer
+from configcache import ConfigCache
+from watch import ConfigWatcher
+from ipc import ControlServer, default_socket_path, parse_message
+from spawn import Spawner
+from ewmh import EWMH, intern_atoms
+from rules import RuleEngine
+import ewmh
+import rules
+import restart
+import floating
+from floating import Drag
+import layouts
 
 # xcb
 import xcffib # Python bindings for the X11 protocol
 import xcffib.xproto as xproto # Protocol types, constants, window management, event handling, etc
 
 # System utilities
-import subprocess    # Shell commands and external processes
+import functools     # Bind actions to their keybinding handlers
+import threading     # Signal handlers can only be installed from the main thread
 import os   # Get home path, get cpu thread count
-import yaml # Read config.yaml
+import asyncio # Event loop multiplexing the X connection, timers, signals and the other sources
+import time   # Event handling latency
+import signal # SIGUSR1 dumps the metrics, SIGUSR2 the trace
 
 # Debugging
 import logging   # Log useful data
 import traceback # Useful debug data
 
+# Events handled per loop iteration before other sources get a turn; the rest is picked up right after
+MAX_BATCH = 256
+# Editors write a file in several steps; reload once they've settled
+CONFIG_RELOAD_DELAY = 0.05
+# Seconds between two focus changes following the pointer; a crossing inside it is applied when it ends
+FOCUS_INTERVAL = 0.02
+# Window geometry updates per second while dragging; about the display's refresh rate
+DRAG_RATE = 60
+
 class WindowManager:
     """main"""
-    def __init__(self) -> None:
+    def __init__(self, config_path=None, display=None, conn=None) -> None:
+        self.started = time.perf_counter() # Startup is timed until the event loop is entered
+
+        # Command launcher; its helper is forked first, while the process is small and has no X connection
+        self.spawner = Spawner()
+
         ## Initialize X server
         try:
-            self.conn = xcffib.connect()                 # xcb connection
+            self.conn = conn or xcffib.connect(display=display) # xcb connection, $DISPLAY unless given
             self.screen = self.conn.get_setup().roots[0] # Get first available screen
             self.root_window = self.screen.root          # Initialize screen
-            self.tiling_manager = TilingManager(self.conn, self.screen, self.root_window)
 
         except xcffib.ConnectionException as e:
             logging.error(f"Failed to connect to X server: {e}")
@@ -49,32 +83,130 @@ class WindowManager:
 
         ## Config file
         # Set config path
-        config_path = f'{os.environ["HOME"]}/.config/nichtwm/config.yaml'
-        # Load config
+        self.config_path = config_path or f'{os.environ["HOME"]}/.config/nichtwm/config.yaml'
+        # Load config: from the precompiled cache when config.yaml hasn't changed, parsing YAML otherwise
+        self.config_cache = ConfigCache(self.config_path)
         try:
-            with open(config_path) as f:
-                self.config = yaml.safe_load(f)
-                logging.debug(f"Loaded config: {self.config}")
-
-        except FileNotFoundError:
-            logging.error(f"Config file not found: {config_path}")
-            self.config = {}
-
-        except yaml.YAMLError as e:
-            logging.error(f"Error loading YAML config: {e}")
-            self.config = {}
+            self.config = self.config_cache.load()
+        except ValueError as e: # a malformed file; there's no running config to fall back on yet
+            logging.error(f"Invalid config {self.config_path}: {e}")
+            raise RuntimeError("Config file is invalid.") from e
+
+        # Instrumentation: count requests/round-trips/flushes and time event handling unless turned off
+        METRICS.enabled = self.config.get('metrics', True)
+        if METRICS.enabled:
+            self.conn = InstrumentedConnection(self.conn)
+        # Flight recorder of the last `trace-size` events (see tracer.py); 0 turns it off
+        TRACE.resize(self.config.get('trace-size', tracer.DEFAULT_SIZE))
 
         # Keycodes/Keysyms utils
         self.key_util = KeyUtil(self.conn)
 
-        # Windows
-        self.windows = []
-        self.current_window = 0 # X root window is 0, then 1-indexed for spawned windows
-        self.num_windows = 0
-
-        # Workspaces
-        self.workspaces = [{'windows': [], 'tiling_manager': TilingManager(self.conn, self.screen, self.root_window)} for _ in range(self.config['num-o-workspaces'])]
-        self.current_workspace = 0
+        # Keybindings: resolved (keysym, modifier, handler) list and the (keycode, modmask) -> handler table
+        self.bindings = []
+        self.keybinds = {}
+
+        # Monitors, from RandR (the whole screen without it); each one gets its own set of workspaces
+        self.outputs = outputs.query_outputs(self.conn, self.root_window, (self.screen.width_in_pixels, self.screen.height_in_pixels))
+        self.num_workspaces = self.config['num-o-workspaces'] # per output
+
+        # Windows: every managed window lives in the client registry, shared with the tiling managers.
+        # Output i owns registry workspaces i * num_workspaces onwards.
+        self.clients = ClientRegistry(self.num_workspaces * len(self.outputs))
+        METRICS.gauge('clients', lambda: len(self.clients)) # live windows; should track what's open, not uptime
+        self.focused = None # XID of the focused window, None for the root
+        self.input_focus = None # window the last SetInputFocus went to; focus is only sent when `focused` differs
+
+        # Crossings our own requests cause (a re-tile or a switch moving windows under a resting pointer) must
+        # not move focus. A NoOperation goes out after every batch that moved windows; EnterNotify events
+        # carrying an older sequence number were generated by those requests, not by the user
+        self.crossing_fence = None
+        self.windows_moved = False  # set by whatever unmaps windows outside the workspace managers
+        # Pointer focus is rate-limited: at most one change per focus_interval, the last crossing wins
+        self.focus_interval = self.config.get('focus-interval', FOCUS_INTERVAL)
+        self.last_focus_change = 0.0
+        self.pending_focus = None   # window the pointer entered while rate-limited
+        self.focus_timer = None     # applies pending_focus once the interval is over
+
+        # Mouse move/resize of floating windows (see floating.py)
+        self.drag = None            # Drag in progress
+        self.drag_timer = None      # sends the drag's geometry at the next frame
+        self.drag_interval = 1 / self.config.get('drag-rate', DRAG_RATE)
+        self.last_drag_frame = 0.0  # time.monotonic() of the last geometry sent for a drag
+        self.button_modifier = None # modifier the move/resize buttons are grabbed with
+
+        # Map requests whose GetWindowAttributes reply hasn't been read yet: window -> cookie
+        self.pending_attributes = {}
+        # Map requests whose rule properties (see rules.py) haven't been read yet: window -> cookies.
+        # Read once per batch, before the batch's windows get mapped
+        self.pending_rules = {}
+
+        # Workspaces of each output: what's on screen, their tiling managers, and the windows waiting to be mapped
+        self.workspace_managers = [self._new_workspace_manager(index, output) for index, output in enumerate(self.outputs)]
+        # Output that workspace actions and new windows go to: follows focus, starts on the primary one
+        self.current_output = next((index for index, output in enumerate(self.outputs) if output.primary), 0)
+
+        # config.yaml is watched once the WM runs, and reloaded in place when it changes
+        self.config_watcher = None
+        # Unix socket taking the same actions as keybindings (see ipc.py), opened once the WM runs
+        self.control_server = None
+        # Atoms, interned all at once when the WM starts running; window rules are compiled with them
+        self.atoms = {}
+        self.rules = RuleEngine((), self.atoms)
+        # EWMH properties on the root window for bars and pagers (see ewmh.py), set up once the WM runs
+        self.ewmh = None
+        self.ewmh_changes = None # ClientRegistry.changes when the client list was last published
+
+        # asyncio loop, created by _start_event_loop; everything (X, timers, sockets, signals) runs on it
+        self.loop = None
+        self.stopped = None         # future resolved when the WM should exit
+        self.stopping = False       # _stop() ran; later calls are no-ops
+        self.x_fd = None            # descriptor of the X connection, watched by the loop
+        self.x_scheduled = False    # a _process_x_events call is already queued
+        self.reload_timer = None    # pending debounced config reload
+        self.max_batch = self.config.get('max-batch', MAX_BATCH)
+
+        # Event type -> handler, one dict lookup per event instead of an isinstance chain
+        self.event_handlers = {
+            xproto.KeyPressEvent: self._handle_key_press_event,
+            xproto.MapRequestEvent: self._handle_map_request_event,
+            xproto.UnmapNotifyEvent: self._handle_unmap_notify_event,
+            xproto.DestroyNotifyEvent: self._handle_destroy_notify_event,
+            xproto.ConfigureRequestEvent: self._handle_configure_request_event,
+            xproto.EnterNotifyEvent: self._handle_enter_notify_event,
+            xproto.ButtonPressEvent: self._handle_button_press_event,
+            xproto.MotionNotifyEvent: self._handle_motion_notify_event,
+            xproto.ButtonReleaseEvent: self._handle_button_release_event,
+            xproto.MappingNotifyEvent: self._handle_mapping_notify_event,
+        }
+        if outputs.randr is not None:
+            self.event_handlers[outputs.randr.ScreenChangeNotifyEvent] = self._handle_screen_change_event
+
+        # Event type -> coalescing key; within a batch only the last event per key gets handled
+        self.coalesced_events = {
+            # A client's last ConfigureRequest supersedes its earlier ones
+            xproto.ConfigureRequestEvent: lambda event: (xproto.ConfigureRequestEvent, event.window),
+            # Only the window the pointer ended up in matters for focus
+            xproto.EnterNotifyEvent: lambda event: xproto.EnterNotifyEvent,
+            # A drag only cares where the pointer is now
+            xproto.MotionNotifyEvent: lambda event: xproto.MotionNotifyEvent,
+        }
+        if outputs.randr is not None:
+            # Outputs are re-queried as a whole, once per batch is enough
+            self.coalesced_events[outputs.randr.ScreenChangeNotifyEvent] = lambda event: outputs.randr.ScreenChangeNotifyEvent
+
+    """Workspaces of the output actions currently apply to"""
+    @property
+    def workspace_manager(self) -> WorkspaceManager:
+        return self.workspace_managers[self.current_output]
+
+    """Index of the output a registry workspace belongs to"""
+    def _output_of(self, workspace) -> int:
+        return workspace // self.num_workspaces
+
+    """Workspaces of the output a managed window is on"""
+    def _workspace_manager_of(self, window) -> WorkspaceManager:
+        return self.workspace_managers[self._output_of(self.clients.get(window).workspace)]
 
     """Event loop of the WM; setup && run nichtwm."""
     def run(self) -> None:
@@ -84,13 +216,31 @@ class WindowManager:
             raise RuntimeError("Root window configuration failed.")
 
         try:
+            outputs.select_screen_changes(self.conn, self.root_window) # monitor hotplug, mode and layout changes
+            self.atoms = intern_atoms(self.conn, tuple(dict.fromkeys(ewmh.ATOM_NAMES + rules.ATOM_NAMES)))
+            self.rules = RuleEngine(self.config.get('rules'), self.atoms, self.num_workspaces)
+            self._adopt_windows()
+            self._setup_ewmh()
             self._grab_keys()
+            self._grab_buttons()
+            self._watch_config()
+            self._open_control_socket()
+            if METRICS.enabled:
+                METRICS.record_phase('startup', time.perf_counter() - self.started)
             self._start_event_loop()
 
         except Exception as e:
             logging.exception(f"An error ocurred during nichtwm's event loop: {e}")
+            self._dump_trace()
             self._graceful_shutdown()
 
+    """Crashing: leave the trace behind for the post-mortem"""
+    def _dump_trace(self) -> None:
+        try:
+            TRACE.dump()
+        except OSError as e:
+            logging.error(f"Could not write the trace: {e}")
+
     """Event mask listen for X events"""
     def _setup_event_mask(self) -> bool:
         logging.debug(f"Setting up event mask for root window: {self.root_window}")
@@ -121,347 +271,1140 @@ class WindowManager:
             logging.debug(traceback.format_exc()) # More detailed stack trace
             return False
 
-    """Grab key events defined on config.yaml"""
-    def _grab_keys(self) -> Nnnnsaone:
-        if self.config['modifier'].lower() == 'alt':
-            self.config['modifier'] = '_1'
-        if self.config['modifier'].lower() == 'super':
-            self.config['modifier'] = '_4'
+    """Announce ourselves as an EWMH window manager"""
+    def _setup_ewmh(self) -> None:
+        self.ewmh = EWMH(self.conn, self.root_window, self.atoms)
+        self.ewmh.setup('nichtwm')
+        self._update_ewmh()
 
-        for action in self.config['actions']:
-            # Get modifier from string
-            modifier = getattr(xproto.ModMask, self.config['modifier'])
-
-            try:
-                # Get the keysym for the key defined in the config
-                keysym = KeyUtil.string_to_keysym(action['key'])
-                if keysym is None:
-                    continue
+    """Publish the batch's outcome to the EWMH properties; only values that changed get written"""
+    def _update_ewmh(self) -> None:
+        if self.ewmh is None:
+            return
+        self.ewmh.update_desktops(len(self.clients.counts), self.workspace_manager.current_id, self.focused)
+        # Walking every client is only worth it when one came, went or changed workspace
+        if self.clients.changes != self.ewmh_changes:
+            self.ewmh_changes = self.clients.changes
+            self.ewmh.update_clients(self.clients, ((window, self.clients.get(window).workspace) for window in self.clients))
 
-                # Get the keycode from the keysym
+    """Grab key events defined on config.yaml"""
+    def _grab_keys(self) -> None:
+        # Resolve every binding's keysym once; keypresses only ever look at the compiled table
+        self.bindings = self._compile_bindings()
+        self._apply_keybinds(self._compile_keybinds())
+
+    """Resolve config.yaml's actions into (keysym, modifier, handler) bindings; those of the running
+    config unless another one (and its ConfigCache) is given"""
+    def _compile_bindings(self, config=None, config_cache=None) -> list:
+        config, config_cache = config or self.config, config_cache or self.config_cache
+        modifier = self._modifier_mask(config)
+
+        bindings = []
+        # The keysym of every key was resolved when the config was compiled (see ConfigCache)
+        for action, keysym in zip(config['actions'], config_cache.keysyms):
+            if keysym is None:
+                continue
+
+            if 'command' in action:
+                handler = functools.partial(self._run_command, action['command'])
+            elif 'action' in action:
+                handler = functools.partial(self._handle_action, action['action'])
+            else:
+                logging.error(f"Binding for key {action['key']} has neither a command nor an action")
+                continue
+
+            bindings.append((keysym, modifier, handler, action['key']))
+
+        return bindings
+
+    """ModMask of config.yaml's `modifier`"""
+    def _modifier_mask(self, config=None) -> int:
+        modifier_name = str((config or self.config)['modifier'])
+        if modifier_name.lower() == 'alt':
+            modifier_name = '_1'
+        if modifier_name.lower() == 'super':
+            modifier_name = '_4'
+
+        # Get modifier from string
+        modifier = getattr(xproto.ModMask, modifier_name, None)
+        if not isinstance(modifier, int):
+            raise ValueError(f"Unknown modifier: {(config or self.config)['modifier']}")
+        return modifier
+
+    """Grab modifier + button 1/3 for moving/resizing windows, again only if the modifier changed"""
+    def _grab_buttons(self) -> None:
+        modifier = self._modifier_mask()
+        if modifier == self.button_modifier:
+            return
+        if self.button_modifier is not None:
+            floating.ungrab_buttons(self.conn, self.root_window, self.button_modifier)
+        floating.grab_buttons(self.conn, self.root_window, modifier)
+        self.button_modifier = modifier
+
+    """Build the (keycode, modmask) -> handler dispatch table from resolved bindings, the running ones by default"""
+    def _compile_keybinds(self, bindings=None, config_cache=None) -> dict:
+        bindings = self.bindings if bindings is None else bindings
+        config_cache = config_cache or self.config_cache
+        # Keycodes cached for this exact keyboard mapping spare building the keymap's reverse index
+        keymap_digest = self.key_util.digest()
+        cached = config_cache.keycodes(keymap_digest)
+        keycodes = {}
+
+        keybinds = {}
+        for keysym, modifier, handler, key in bindings:
+            # Get the keycode from the keysym
+            if cached is not None and keysym in cached:
+                keycode = cached[keysym]
+            else:
                 keycode = self.key_util.get_keycode(keysym)
-
-                # Log the key and modifier to debug
-                logging.debug(f"Keysym {keysym} for key {action['key']} converted to keycode {keycode}")
-
-                # Use core.GrabKeyChecked to capture key events on the root window
-                self.conn.core.GrabKeyChecked(
-                    False,  # Send all key events to the root window
-                    self.root_window,
-                    modifier,
-                    keycode,
-                    xproto.GrabMode.Async,  # Non-blocking for key press events
-                    xproto.GrabMode.Async   # Non-blocking for key release events
-                ).check()
+            keycodes[keysym] = keycode
+            if keycode is None:
+                logging.error(f"No keycode for key {key} in the current keyboard mapping")
+                continue
+
+            # Log the key and modifier to debug
+            logging.debug(f"Keysym {keysym} for key {key} converted to keycode {keycode}")
+
+            # First binding wins, same as the old linear scan over config['actions']
+            keybinds.setdefault((keycode, modifier), handler)
+
+        config_cache.store_keycodes(keymap_digest, keycodes)
+        return keybinds
+
+    """Swap in a new dispatch table, grabbing/ungrabbing only the keys that differ"""
+    def _apply_keybinds(self, keybinds: dict) -> None:
+        for keycode, modifier in self.keybinds.keys() - keybinds.keys():
+            self.conn.core.UngrabKey(keycode, self.root_window, modifier)
+
+        # Send every grab first and only then check them: one round-trip for the lot instead of one per key
+        cookies = [
+            (keycode, modifier, self.conn.core.GrabKeyChecked(
+                False,  # Send all key events to the root window
+                self.root_window,
+                modifier,
+                keycode,
+                xproto.GrabMode.Async,  # Non-blocking for key press events
+                xproto.GrabMode.Async   # Non-blocking for key release events
+            ))
+            for keycode, modifier in keybinds.keys() - self.keybinds.keys()
+        ]
+
+        for keycode, modifier, cookie in cookies:
+            try:
+                cookie.check()
 
             except xproto.AccessError as e:
-                logging.error(f"Failed to grab key {action['key']} # with modifier {self.config['modifier']}: {e}")
+                logging.error(f"Failed to grab keycode {keycode} with modifier {modifier}: {e}")
                 logging.debug(traceback.format_exc())
 
             except Exception as e:
-                logging.error(f"Unexpected error when grabbing key {action['key']}: {e}")
+                logging.error(f"Unexpected error when grabbing keycode {keycode}: {e}")
                 logging.debug(traceback.format_exc())
 
+        self.keybinds = keybinds
+
     """nichtwm's event loop"""
     def _start_event_loop(self) -> None:
+        self.loop = asyncio.new_event_loop()
+        self.stopped = self.loop.create_future()
+
+        # The X connection: drained whenever its socket becomes readable. The descriptor is kept, as
+        # asking the connection for it again fails once the server is gone, which is how loops end
+        self.x_fd = self.conn.get_file_descriptor()
+        self.loop.add_reader(self.x_fd, self._process_x_events)
+        # Everything else shares the loop
+        if self.config_watcher is not None:
+            self.loop.add_reader(self.config_watcher, self._on_config_changed)
+        if self.control_server is not None:
+            self.control_server.attach(self.loop)
+        self.spawner.attach(self.loop)
+        self._install_signal_handlers()
+
+        # Events that arrived during startup are already sitting in xcb's queue, where the socket can't signal them
+        self._schedule_x_events()
+        try:
+            self.loop.run_until_complete(self.stopped)
+        finally:
+            self.loop.remove_reader(self.x_fd)
+            self.loop.close()
+            self.loop = None
+
+    """Drain and handle one batch of X events (at most max_batch), then commit it"""
+    def _process_x_events(self) -> None:
+        self.x_scheduled = False
+        try:
+            event = self._poll_event()
+            if event is None:
+                # Nothing queued: settle outstanding replies and push out what that changed. Reading
+                # the replies may queue events without the socket staying readable, so look again.
+                if self._settle_pending_attributes():
+                    self._commit_batch()
+                    self._schedule_x_events()
+                return
+
+            # Handle what the server already sent us as one batch
+            events, _ = self._drain_events(event, self.max_batch)
+            try:
+                for event in events:
+                    self._handle_event(event)
+                # Events come in request order: once one is past the fence, so is everything after it
+                sequence = getattr(events[-1], 'sequence', None) # KeymapNotify has none
+                if sequence is not None:
+                    self._before_fence(sequence)
+                # New windows go where their rules say before anything gets mapped
+                self._apply_rules()
+            finally:
+                # Whatever went wrong, what the batch did so far still gets laid out and flushed
+                self._commit_batch()
+
+            # Always look again, after the other sources had their turn: the rest of a burst, the pending
+            # replies of this one, and whatever xcb read off the socket while a handler (button-press
+            # geometry, keymap refresh, output query, rules) waited for a reply. Those events are already
+            # in xcb's queue, and the socket won't signal them. The look is one poll when nothing came
+            self._schedule_x_events()
+
+        except xcffib.ConnectionException as e: # Usually when user kills or exits the WM
+            if not self.stopping:
+                logging.info("Connection to X server successfully terminated.")
+            self._stop()
+
+        except xcffib.Error as e: # Errors of unchecked requests, e.g. BadWindow for a window that just died
+            TRACE.record(type(e), getattr(e, 'bad_value', 0))
+            self._schedule_x_events()
+
+        except Exception as e:
+            TRACE.record('error')
+            logging.error(f"Unexpected error in event loop: {e}")
+            logging.debug(traceback.format_exc())
+            self._dump_trace()
+            self._schedule_x_events()
+
+    """Run the handler of one event. Anything it raises, short of losing the connection, is logged
+    and costs only this event, not the rest of the batch"""
+    def _handle_event(self, event) -> None:
+        handler = self.event_handlers.get(type(event))
+        start = time.perf_counter()
+        try:
+            if handler is not None:
+                if METRICS.enabled:
+                    requests, round_trips = METRICS.requests, METRICS.round_trips
+                    handler(event)
+                    METRICS.record_event(type(event), time.perf_counter() - start,
+                                         METRICS.requests - requests, METRICS.round_trips - round_trips)
+                else:
+                    handler(event)
+
+        except xcffib.ConnectionException:
+            raise
+
+        except xcffib.Error as e: # e.g. BadWindow from a round-trip on a window that just died
+            TRACE.record(type(e), getattr(e, 'bad_value', 0))
+
+        except Exception as e:
+            TRACE.record('error', event_window(event))
+            logging.error(f"Unexpected error handling {type(event).__name__}: {e}")
+            logging.debug(traceback.format_exc())
+            self._dump_trace()
+
+        # Into the flight recorder, not the log: nothing is formatted unless the trace gets dumped
+        TRACE.record(type(event), event_window(event), start, time.perf_counter() - start)
+
+    """Next queued event, or None. X errors of unchecked requests come through the same queue;
+    they're recorded and skipped, however many sit in a row"""
+    def _poll_event(self):
         while True:
             try:
-                event = self.conn.wait_for_event()
+                return self.conn.poll_for_event()
+            except xcffib.Error as e:
+                TRACE.record(type(e), getattr(e, 'bad_value', 0))
+
+    """Look at the X queue again on the next loop iteration. Needed after anything that did a round-trip:
+    xcb reads the socket while waiting for the reply, so events can be queued with nothing left to wake us"""
+    def _schedule_x_events(self) -> None:
+        if self.loop is not None and not self.x_scheduled:
+            self.x_scheduled = True
+            self.loop.call_soon(self._process_x_events)
+
+    """Leave the event loop and release everything the loop was serving"""
+    def _stop(self) -> None:
+        if self.stopping:
+            return
+        self.stopping = True
+        self._close_control_socket()
+        self.spawner.close()
+        if self.config_watcher is not None:
+            if self.loop is not None:
+                self.loop.remove_reader(self.config_watcher)
+            self.config_watcher.close()
+            self.config_watcher = None
+        if self.stopped is not None and not self.stopped.done():
+            self.stopped.set_result(None)
+
+    """config.yaml's directory changed: reload once the writes have settled"""
+    def _on_config_changed(self) -> None:
+        if not self.config_watcher.changed():
+            return
+        if self.reload_timer is not None:
+            self.reload_timer.cancel()
+        self.reload_timer = self.loop.call_later(CONFIG_RELOAD_DELAY, self._reload_and_commit)
+
+    def _reload_and_commit(self) -> None:
+        self.reload_timer = None
+        self.reload_config()
+        self._commit_batch()
+        self._schedule_x_events()
+
+    """Pull up to `limit` queued events, keeping only the last of each coalescable kind.
+    Returns (events, whether more may be queued)"""
+    def _drain_events(self, event, limit) -> tuple:
+        events = []
+        latest = {} # coalescing key -> index of its most recent event in `events`
+
+        while event is not None:
+            coalesce = self.coalesced_events.get(type(event))
+            if coalesce is not None:
+                key = coalesce(event)
+                previous = latest.get(key)
+                if previous is not None:
+                    events[previous] = None # superseded by this one
+                latest[key] = len(events)
+            events.append(event)
+            if len(events) >= limit:
+                break
 
-                if isinstance(event, xproto.KeyPressEvent):
-                    self._handle_key_press_event(event)
-                if isinstance(event, xproto.MapRequestEvent):
-                    self._handle_map_request_event(event)
-                if isinstance(event, xproto.ConfigureRequestEvent):
-                    self._handle_configure_request_event(event)
-                if isinstance(event, xproto.EnterNotifyEvent):
-                    self._handle_enter_notify_event(event)
-                logging.debug(f"Received event: {event}")
+            event = self._poll_event() # errors between events are skipped, the batch keeps what it has
+
+        return [event for event in events if event is not None], event is not None
+
+    """End of a batch: one layout pass, map what's waiting for it, one flush"""
+    @timed('commit_batch')
+    def _commit_batch(self) -> None:
+        moved, self.windows_moved = self.windows_moved, False
+        if self.focused in self.clients:
+            # Scrolling layout: the view follows focus, however focus got there
+            self._workspace_manager_of(self.focused).reveal(self.focused)
+        for workspace_manager in self.workspace_managers:
+            moved = workspace_manager.commit() or moved # a no-op for outputs nothing happened on
+        self._sync_input_focus()
+        self._update_ewmh()
+        if moved:
+            # Fence: the crossings of everything above carry an older sequence number than this
+            self.crossing_fence = self.conn.core.NoOperation().sequence
+        self.conn.flush()
+        METRICS.batches += 1
 
-                self.conn.flush()
+    """SIGUSR1 dumps metrics, SIGUSR2 the trace, SIGCHLD reaps commands. Both run as loop callbacks, never in the middle of a batch.
+    Skipped off the main thread (e.g. bench/harness.py), where signal handlers can't be installed"""
+    def _install_signal_handlers(self) -> None:
+        if threading.current_thread() is not threading.main_thread():
+            logging.debug("Not on the main thread; signal handlers not installed")
+            return
+        self.loop.add_signal_handler(signal.SIGUSR1, METRICS.dump)
+        self.loop.add_signal_handler(signal.SIGUSR2, TRACE.dump)
+        self.loop.add_signal_handler(signal.SIGCHLD, self.spawner.reap_children)
+
+    """Control socket at `control-socket` (default: ipc.default_socket_path()); `control-socket: false` disables it"""
+    def _open_control_socket(self) -> None:
+        path = self.config.get('control-socket', True)
+        if path is False or self.control_server is not None:
+            return
+        try:
+            self.control_server = ControlServer(default_socket_path() if path is True else path, self._serve_control_message)
+        except OSError as e:
+            logging.error(f"Control socket unavailable: {e}")
+            return
+        if self.loop is not None:
+            self.control_server.attach(self.loop)
 
-            except xcffib.ConnectionException as e: # Usually when user kills or exits the WM
-                logging.info("Connection to X server successfully terminated.")
+    def _close_control_socket(self) -> None:
+        if self.control_server is not None:
+            self.control_server.close()
+            self.control_server = None
 
-            except Exception as e:
-                logging.error(f"Unexpected error in event loop: {e}")
-                logging.debug(traceback.format_exc())
+    """Control socket message from the loop: handle it, then commit it as one batch"""
+    def _serve_control_message(self, message) -> dict:
+        try:
+            return self._handle_control_message(message)
+        finally:
+            # Even if a command failed halfway, what the others did gets laid out and flushed
+            self._commit_batch()
+            self._schedule_x_events() # queries and actions may have done round-trips
+
+    """One control socket message: validate every command, then run them all; the caller flushes once"""
+    def _handle_control_message(self, message) -> dict:
+        commands = parse_message(message)
+        if not commands:
+            return {'ok': False, 'error': 'empty message'}
+
+        # All or nothing: one bad command rejects the whole message before anything is applied
+        for command in commands:
+            error = self._validate_command(command)
+            if error is not None:
+                return {'ok': False, 'error': f"{command}: {error}"}
+
+        results = []
+        for command in commands:
+            if command.startswith('QUERY_'):
+                results.append(self._query(command))
+            else:
+                self._handle_action(command)
+                results.append(None)
+        return {'ok': True, 'results': results}
+
+    """Why `command` can't run, or None if it can"""
+    def _validate_command(self, command):
+        if command in ('QUERY_WORKSPACES', 'QUERY_WINDOWS', 'QUERY_FOCUSED', 'QUERY_METRICS'):
+            return None
+        if command in ('DUMP_METRICS', 'DUMP_TRACE', 'RELOAD_CONFIG', 'RESTART', 'NEXT_LAYOUT', 'NEXT_WINDOW', 'PREVIOUS_WINDOW',
+                       'PROMOTE_WINDOW', 'KILL_WINDOW', 'TOGGLE_FLOATING'):
+            return None
+
+        if command.startswith('SET_LAYOUT_'):
+            layout = command[len('SET_LAYOUT_'):].lower()
+            return None if layout in layouts.LAYOUTS else f"unknown layout, one of {', '.join(layouts.LAYOUTS)}"
+
+        if command.startswith(('SWITCH_WORKSPACE_', 'MOVE_TO_WORKSPACE_')):
+            number = command.split('_')[-1]
+            if not number.isdigit() or not 1 <= int(number) <= self.workspace_manager.num_workspaces:
+                return f"workspaces are 1 to {self.workspace_manager.num_workspaces}"
+            return None
+
+        return "unknown command"
+
+    """Answer a QUERY_* command"""
+    def _query(self, command):
+        if command == 'QUERY_WORKSPACES':
+            return [{
+                'output': output_index,
+                'workspace': index + 1,
+                'windows': self.clients.count(tiling_manager.workspace),
+                'layout': tiling_manager.layout,
+                'current': index == workspace_manager.current_workspace,
+            } for output_index, workspace_manager in enumerate(self.workspace_managers)
+              for index, tiling_manager in enumerate(workspace_manager.tiling_managers)]
+
+        if command == 'QUERY_WINDOWS':
+            # Numbered like QUERY_WORKSPACES: the output, and the workspace within it (what MOVE_TO_WORKSPACE_n takes)
+            return [{
+                'window': window,
+                'output': self._output_of(self.clients.get(window).workspace),
+                'workspace': self.clients.get(window).workspace % self.num_workspaces + 1,
+                'focused': window == self.focused,
+            } for window in self.clients]
+
+        if command == 'QUERY_FOCUSED':
+            return self.focused
+
+        if command == 'QUERY_METRICS':
+            return METRICS.snapshot()
 
     """Handle actions such as switching between windows"""
     def _handle_action(self, action) -> None:
-        if not self.windows:
-            logging.debug("No windows available to switch.")
+        if action == 'DUMP_METRICS':
+            METRICS.dump()
             return
-        # Unmap current window before switching
-        self.conn.core.UnmapWindow(self.windows[self.current_window])
 
-        # Switch to the next or previous window
-        if action == 'NEXT_WINDOW':
-            self.current_window = (self.current_window + 1) % len(self.windows)
+        if action == 'DUMP_TRACE':
+            TRACE.dump()
+            return
 
-        if action == 'PREVIOUS_WINDOW':
-            self.current_window = (self.current_window - 1) % len(self.windows)
+        if action == 'RELOAD_CONFIG':
+            self.reload_config()
+            return
 
-        if action == 'KILL_WINDOW':
-            self.kill_current_window()
+        if action == 'RESTART':
+            # After this batch (and the control socket's reply) is out
+            if self.loop is not None:
+                self.loop.call_soon(self._restart)
+            else:
+                self._restart()
+            return
+
+        if action == 'NEXT_LAYOUT':
+            self.workspace_manager.tiling_manager().next_layout()
+            return
+
+        if action.startswith("SET_LAYOUT_"): # e.g. SET_LAYOUT_GRID, SET_LAYOUT_MASTER-STACK
+            layout = action[len("SET_LAYOUT_"):].lower()
+            self.workspace_manager.tiling_manager().set_layout(layout)
+            return
 
         if action.startswith("SWITCH_WORKSPACE"): # startswith due to the many different workspaces
             workspace_index = int(action.split("_")[-1]) - 1  # Parse the workspace number from the action
             self._switch_workspace(workspace_index)
             return
 
-        if not self.workspaces[self.current_workspace]['windows']:
+        if self.focused is None:
             logging.debug("No windows available to switch.")
             return
 
-        # Map the new current window
-        self.conn.core.MapWindow(self.windows[self.current_window])
-        self.conn.flush()
-
-    """Handle a key press event and execute the corresponding action or command."""
-    def _handle_key_press_event(self, event):
-        keycode = event.detail  # The keycode from the KeyPressEvent
-        modifier = event.state  # The modifier mask (e.g., Mod1, Mod4)
-        logging.debug(f"Received KeyPressEvent with keycode {keycode} and modifier {modifier}")
+        # Cycle focus within the current workspace and bring the new window to the top
+        if action == 'NEXT_WINDOW':
+            self._focus_window(self.clients.next(self.focused))
 
-        # Iterate over the defined actions in the config file
-        for action in self.config['actions']:
-            # Convert the action key (e.g., 'o', 'a', etc.) to keysym
-            action_keysym = KeyUtil.string_to_keysym(action['key'])
+        if action == 'PREVIOUS_WINDOW':
+            self._focus_window(self.clients.prev(self.focused))
 
-            # Convert the keysym to keycode
-            action_keycode = self.key_util.get_keycode(action_keysym)
+        if action == 'PROMOTE_WINDOW': # Move the focused window to the master slot
+            self.clients.promote(self.focused)
+            self.workspace_manager.tiling_manager().dirty = True
 
-            # Map the modifier string in the config to the actual modifier mask (e.g., Mod1 or Mod4)
-            action_modifier = getattr(xproto.ModMask, self.config['modifier'], 0)
+        if action.startswith("MOVE_TO_WORKSPACE"):
+            workspace_index = int(action.split("_")[-1]) - 1
+            self._move_window_to_workspace(self.focused, workspace_index)
 
-            logging.debug(f"Processing action: {action['key']}, keysym: {action_keysym}, keycode: {action_keycode}") #, modifier: {action_modifier}")
+        if action == 'KILL_WINDOW':
+            self.kill_current_window()
 
-            # Check if the keycode and modifier from the event match those from the config
-            if action_keycode == keycode and action_modifier == modifier:
-                logging.info(f"Executing action for key: {action['key']}, command: {action.get('command', 'No command specified')}")
+        if action == 'TOGGLE_FLOATING':
+            self._set_floating(self.focused, not self.clients.get(self.focused).floating)
 
-                # Execute the command specified in the config
-                if 'command' in action:
-                    subprocess.Popen(action['command'], shell=True)
-                    logging.info(f"Successfully executed command: {action['command']}")
-                elif 'action' in action:
-                    self._handle_action(action['action'])
-                break
-            else:
-                logging.debug(f"No match for keycode {keycode} and modifier {modifier}")
+    """Re-exec in place, handing the client/workspace state over to the new image (see restart.py)"""
+    def _restart(self) -> None:
+        try:
+            path = restart.save_state(self._restart_state())
+        except OSError as e:
+            logging.error(f"Not restarting, the state could not be saved: {e}")
+            return
+        logging.info(f"Restart state written to {path}")
 
-    """Handle a map request (when a window requests to become visible)."""
-    def _handle_map_request_event(self, event) -> None:
+        self._stop()
+        self.conn.flush()
+        self.conn.disconnect() # the server destroys our check window; client windows stay as they are
+        restart.reexec()
+
+    """What a restarted nichtwm needs to put every window back: JSON-friendly, outputs referred to by name"""
+    def _restart_state(self) -> dict:
+        windows = []
+        for output, workspace_manager in zip(self.outputs, self.workspace_managers):
+            for local in range(workspace_manager.num_workspaces):
+                for window in self.clients.windows(workspace_manager.first_workspace + local):
+                    windows.append([window, output.name, local, self.clients.get(window).floating])
+        return {
+            'outputs': [[output.name, workspace_manager.current_workspace,
+                         [tiling_manager.layout for tiling_manager in workspace_manager.tiling_managers]]
+                        for output, workspace_manager in zip(self.outputs, self.workspace_managers)],
+            'current_output': self.outputs[self.current_output].name,
+            'focused': self.focused,
+            'windows': windows, # in tiling order
+        }
+
+    """Manage the windows that already exist: after a restart where the saved state puts them, otherwise
+    the visible ones on the current workspace. Every request goes out before the first reply is read"""
+    @timed('adopt_windows')
+    def _adopt_windows(self) -> None:
+        state = restart.load_state()
         try:
-            # Get window attributes and check if it's override-redirect (bypasses window manager)
-            attributes = self.conn.core.GetWindowAttributes(event.window).reply()
-            if attributes.override_redirect:
-                return
+            children = list(self.conn.core.QueryTree(self.root_window).reply().children)
+        except xcffib.Error as e:
+            logging.error(f"Could not list existing windows, not adopting any: {e}")
+            return
 
-            import time
-            time.sleep(0.05)  # Adjust this delay if necessary
+        positions = {output.name: index for index, output in enumerate(self.outputs)}
+        saved = {} # window -> (output name, local workspace, floating)
+        if state is not None:
+            for name, current, layout_names in state['outputs']:
+                if name not in positions:
+                    continue
+                workspace_manager = self.workspace_managers[positions[name]]
+                workspace_manager.current_workspace = min(current, workspace_manager.num_workspaces - 1)
+                for tiling_manager, layout in zip(workspace_manager.tiling_managers, layout_names):
+                    tiling_manager.set_layout(layout)
+            self.current_output = positions.get(state['current_output'], self.current_output)
+            saved = {window: (name, local, floating) for window, name, local, floating in state['windows']}
+
+        # One burst: attributes of every top-level window, plus what the rules look at for windows the state doesn't place
+        attributes = {window: self.conn.core.GetWindowAttributes(window) for window in children}
+        rule_cookies = {window: self.rules.request(self.conn, window)
+                        for window in children if window not in saved} if self.rules else {}
+
+        viewable = {}
+        for window, cookie in attributes.items():
+            try:
+                reply = cookie.reply()
+            except xcffib.Error:
+                continue # gone already
+            if reply.override_redirect or reply._class == xproto.WindowClass.InputOnly:
+                continue
+            # Without state, an unmapped window can't be told apart from a withdrawn one
+            if window in saved or reply.map_state == xproto.MapState.Viewable:
+                viewable[window] = reply.map_state == xproto.MapState.Viewable
+
+        # Saved windows in their saved tiling order, then the rest in stacking order
+        for window in [window for window in saved if window in viewable] + [window for window in viewable if window not in saved]:
+            if window in saved:
+                name, local, floating = saved[window]
+                workspace_manager = self.workspace_managers[positions.get(name, self.current_output)]
+                local = min(local, workspace_manager.num_workspaces - 1)
+            else:
+                workspace_manager, local, floating = self.workspace_manager, self.workspace_manager.current_workspace, False
+
+            workspace_manager.tiling_manager(local).add_window(window)
+            client = self.clients.get(window)
+            client.floating, client.mapped = floating, viewable[window]
+            self.conn.core.ChangeWindowAttributes(window, xproto.CW.EventMask, [xproto.EventMask.EnterWindow])
+            if workspace_manager.is_visible(window):
+                workspace_manager.map_window(window)
+            else:
+                workspace_manager.unmap_window(window)
+
+        for window, cookies in rule_cookies.items():
+            if window not in self.clients:
+                self.rules.discard(cookies)
+                continue
+            actions = self.rules.match(cookies)
+            if actions:
+                self._apply_rule_actions(window, actions)
+
+        focused = state.get('focused') if state is not None else None
+        self.focused = focused if focused in self.clients else self.clients.first(self.workspace_manager.current_id)
+        if viewable:
+            logging.info(f"Adopted {len(viewable)} existing windows")
+            self._commit_batch()
+
+    """Start watching config.yaml unless `watch-config: false`"""
+    def _watch_config(self) -> None:
+        if not self.config.get('watch-config', True) or self.config_watcher is not None:
+            return
+        try:
+            self.config_watcher = ConfigWatcher(self.config_path)
+        except OSError as e:
+            logging.error(f"Cannot watch {self.config_path}, changes need RELOAD_CONFIG: {e}")
+            return
+        if self.loop is not None:
+            self.loop.add_reader(self.config_watcher, self._on_config_changed)
+
+    """Re-read config.yaml and apply what changed: key grabs, workspace count and layouts. Windows stay managed."""
+    @timed('reload_config')
+    def reload_config(self) -> bool:
+        # Everything the new config implies is loaded, checked and built before any of it is applied:
+        # a bad file leaves the running config, keys and layouts exactly as they were
+        config_cache = ConfigCache(self.config_path)
+        try:
+            config = config_cache.load() # checks the file's shape (see configcache.check_config)
+            if not config:
+                logging.error("Keeping the current config, the new one could not be loaded")
+                return False
+            bindings, keybinds, rules = self._prepare_config(config, config_cache)
+        except (KeyError, TypeError, ValueError) as e:
+            logging.error(f"Keeping the current config, the new one is invalid: {e}")
+            return False
 
-            # Map the window (make it visible)
-            self.conn.core.MapWindow(event.window)
+        old_config = self.config
+        self.config_cache, self.config = config_cache, config
+
+        # Workspace count first, so the layout update below covers new workspaces too
+        num_workspaces = config['num-o-workspaces']
+        if num_workspaces != self.num_workspaces:
+            self._arrange_outputs(self.outputs, num_workspaces)
+
+        # A changed default layout replaces whatever each workspace was cycled to; changed params apply everywhere
+        layout = config.get('layout', layouts.DEFAULT_LAYOUT)
+        layout_params = config.get('layout-params', {})
+        for tiling_manager in (tiling_manager for workspace_manager in self.workspace_managers
+                               for tiling_manager in workspace_manager.tiling_managers):
+            if layout != old_config.get('layout', layouts.DEFAULT_LAYOUT):
+                tiling_manager.set_layout(layout)
+            if layout_params != tiling_manager.params:
+                tiling_manager.params = layout_params
+                tiling_manager.dirty = True
+
+        # Only keys whose (keycode, modifier) appeared or disappeared get grabbed/ungrabbed;
+        # a key that merely changed action just gets its new handler in the table
+        self.bindings = bindings
+        self._apply_keybinds(keybinds)
+        self._grab_buttons()
+
+        self.focus_interval = config.get('focus-interval', FOCUS_INTERVAL)
+        self.drag_interval = 1 / config.get('drag-rate', DRAG_RATE)
+        self.rules = rules
+
+        self._watch_config() # `watch-config` / `control-socket` may have been turned on
+        self._open_control_socket()
+        logging.info(f"Reloaded {self.config_path}")
+        return True
+
+    """Check a freshly loaded config without touching the running WM, and build its bindings, key
+    table and rules. Raises ValueError (KeyError/TypeError for a malformed file) if it can't be used"""
+    def _prepare_config(self, config, config_cache) -> tuple:
+        num_workspaces = config['num-o-workspaces']
+        if not isinstance(num_workspaces, int) or num_workspaces < 1:
+            raise ValueError(f"num-o-workspaces must be a number from 1 up, not {num_workspaces!r}")
+        layout = config.get('layout', layouts.DEFAULT_LAYOUT)
+        if layout not in layouts.LAYOUTS:
+            raise ValueError(f"unknown layout {layout!r}, one of {', '.join(layouts.LAYOUTS)}")
+        if not isinstance(config.get('layout-params', {}), dict):
+            raise ValueError("layout-params must be a mapping")
+        if not isinstance(config.get('focus-interval', FOCUS_INTERVAL), (int, float)) or config.get('focus-interval', FOCUS_INTERVAL) < 0:
+            raise ValueError("focus-interval must be a number of seconds")
+        if not isinstance(config.get('drag-rate', DRAG_RATE), (int, float)) or config.get('drag-rate', DRAG_RATE) <= 0:
+            raise ValueError("drag-rate must be a positive number")
+
+        bindings = self._compile_bindings(config, config_cache) # checks the modifier too
+        keybinds = self._compile_keybinds(bindings, config_cache)
+        return bindings, keybinds, RuleEngine(config.get('rules'), self.atoms, num_workspaces)
+
+    """RandR says the monitor setup changed: re-query it and re-tile only the outputs that changed"""
+    def _handle_screen_change_event(self, event) -> None:
+        size = (event.width, event.height)
+        if event.rotation & (outputs.randr.Rotation.Rotate_90 | outputs.randr.Rotation.Rotate_270):
+            size = (event.height, event.width)
+
+        new_outputs = outputs.query_outputs(self.conn, self.root_window, size)
+        if new_outputs != self.outputs:
+            logging.info(f"Outputs changed: {new_outputs}")
+            self._arrange_outputs(new_outputs, self.num_workspaces)
+
+    """Switch to a new set of outputs and/or number of workspaces per output.
+
+    Outputs are matched by name. A surviving output keeps its workspaces, layouts and current
+    workspace, and only gets re-tiled if its area changed. Windows of a workspace that no longer
+    exists (output unplugged, fewer workspaces) join the same workspace number, or the last one,
+    of the primary output. Only windows whose visibility changed get mapped or unmapped."""
+    def _arrange_outputs(self, new_outputs, num_workspaces) -> None:
+        old_outputs, old_num = self.outputs, self.num_workspaces
+        before = {(output.name, index): self.clients.windows(manager.first_workspace + index)
+                  for output, manager in zip(old_outputs, self.workspace_managers)
+                  for index in range(manager.num_workspaces)}
+
+        positions = {output.name: index for index, output in enumerate(new_outputs)}
+        primary = next((index for index, output in enumerate(new_outputs) if output.primary), 0)
+
+        def renumber(workspace):
+            output = positions.get(old_outputs[workspace // old_num].name, primary)
+            return output * num_workspaces + min(workspace % old_num, num_workspaces - 1)
+
+        self.clients.remap(num_workspaces * len(new_outputs), renumber)
+
+        managers = {output.name: manager for output, manager in zip(old_outputs, self.workspace_managers)}
+        focused_output = old_outputs[self.current_output].name
+        self.outputs, self.num_workspaces = new_outputs, num_workspaces
+        self.workspace_managers = []
+        for index, output in enumerate(new_outputs):
+            manager = managers.get(output.name)
+            if manager is None:
+                manager = self._new_workspace_manager(index, output)
+            else:
+                manager.rebind(index * num_workspaces, num_workspaces, output.rect)
+            self.workspace_managers.append(manager)
+        self.current_output = positions.get(focused_output, primary)
+
+        # Workspaces that gained or lost windows need a new layout; the rest keep theirs
+        for index, output in enumerate(new_outputs):
+            manager = self.workspace_managers[index]
+            for local in range(num_workspaces):
+                if self.clients.windows(manager.first_workspace + local) != before.get((output.name, local), []):
+                    manager.tiling_manager(local).dirty = True
+
+        # Both calls are no-ops for windows that already are (or aren't) mapped
+        for window in self.clients:
+            workspace_manager = self._workspace_manager_of(window)
+            if workspace_manager.is_visible(window):
+                workspace_manager.map_window(window)
+            else:
+                workspace_manager.unmap_window(window)
 
-            # Configure window to be fullscreen
-            # X and Y coordinates (0, 0) place the window at the top-left corner of the screen
-            window_width = self.screen.width_in_pixels
-            window_height = self.screen.height_in_pixels
+        if self.focused not in self.clients or not self._workspace_manager_of(self.focused).is_visible(self.focused):
+            self.focused = self.clients.first(self.workspace_manager.current_id)
+        self.windows_moved = True
 
-            self.conn.core.ConfigureWindow(
-                event.window,
-                xproto.ConfigWindow.X |
-                xproto.ConfigWindow.Y |
-                xproto.ConfigWindow.Width |
-                xproto.ConfigWindow.Height,
-                [
-                    0,  # X position: 0 (left edge of the screen)
-                    0,  # Y position: 0 (top edge of the screen)
-                    window_width,
-                    window_height
-                ]
-            )
+    def _new_workspace_manager(self, index, output) -> WorkspaceManager:
+        return WorkspaceManager(self.conn, self.clients, self._new_tiling_manager, self.num_workspaces,
+                                grab_server=self.config.get('grab-server', False),
+                                first_workspace=index * self.num_workspaces, rect=output.rect)
 
-            # Set the event mask to listen for EnterNotify events for this window
-            self.conn.core.ChangeWindowAttributesChecked(
-                event.window,
-                xproto.CW.EventMask,
-                [xproto.EventMask.EnterWindow]  # Listen for cursor entering window
-            ).check()
+    def _new_tiling_manager(self, workspace, rect) -> TilingManager:
+        layout = self.config.get('layout', layouts.DEFAULT_LAYOUT)
+        layout_params = self.config.get('layout-params', {})
+        return TilingManager(self.conn, self.screen, self.root_window, self.clients, workspace, layout, layout_params, rect)
 
-            # Add the window to the current workspace only
-            current_workspace_data = self.workspaces[self.current_workspace]
-            if event.window not in current_workspace_data['windows']:
-                current_workspace_data['windows'].append(event.window)
-                current_workspace_data['tiling_manager'].add_window(event.window)
+    """Handle a key press event and execute the corresponding action or command."""
+    def _handle_key_press_event(self, event):
+        # keycode from the KeyPressEvent, modifier mask (e.g., Mod1, Mod4)
+        handler = self.keybinds.get((event.detail, event.state))
+        if handler is None:
+            return # the KeyPress is in the trace
+
+        handler()
+
+    """Run a shell command bound in the config"""
+    def _run_command(self, command) -> None:
+        # Handed to the spawn helper; no fork of the WM, no shell unless the command needs one
+        self.spawner.spawn(command)
+        TRACE.record('spawn')
+
+    """Keyboard mapping changed (setxkbmap, xmodmap...): patch the keymap index and regrab what moved"""
+    def _handle_mapping_notify_event(self, event) -> None:
+        if event.request != xproto.Mapping.Keyboard:
+            return
 
-            # If you still need a global list of windows (optional, depending on your design):
-            if event.window not in self.windows:
-                self.windows.insert(0, event.window)
-                self.current_window = 0  # Focus on the newly mapped window
+        changed = self.key_util.refresh(event.first_keycode, event.count)
+        if not changed:
+            return
 
-            self.conn.flush()
+        # Only rebuild when a bound keysym actually moved to another keycode
+        if any(keysym in changed for keysym, _, _, _ in self.bindings):
+            self._apply_keybinds(self._compile_keybinds())
 
-        except xcffib.ConnectionException as e:
-            logging.error(f"Failed to get window attributes for window {event.window}: {e}")
-            logging.debug(traceback.format_exc())
-            self._graceful_exit()
+    """Handle a map request (when a window requests to become visible)."""
+    def _handle_map_request_event(self, event) -> None:
+        # Ask whether it's override-redirect (bypasses window manager) without waiting for the answer:
+        # the reply is settled once the event queue runs dry, together with every other pending map
+        self.pending_attributes[event.window] = self.conn.core.GetWindowAttributes(event.window)
+
+        # Set the event mask to listen for EnterNotify events for this window.
+        # Unchecked: a BadWindow comes back through the event loop instead of a round-trip here
+        self.conn.core.ChangeWindowAttributes(
+            event.window,
+            xproto.CW.EventMask,
+            [xproto.EventMask.EnterWindow]  # Listen for cursor entering window
+        )
 
-        except Exception as e:
-            logging.error(f"Unexpected error in handling map request for window {event.window}: {e}")
-            logging.debug(traceback.format_exc())
-            self._graceful_shutdown()
+        # Add the window to the current workspace only; it gets tiled and mapped at the end of the batch
+        if event.window not in self.clients:
+            # What the rules look at is asked for now and read with the rest of the batch's, before mapping
+            if self.rules:
+                self.pending_rules[event.window] = self.rules.request(self.conn, event.window)
+            self.workspace_manager.add_window_to_workspace(event.window)
+            self.focused = event.window # Focus on the newly mapped window
+        else:
+            # Already managed: map it once the batch's layout pass configured it, if its workspace is shown
+            self._workspace_manager_of(event.window).map_window(event.window)
+
+    """Read the rule properties of the batch's new windows, one round-trip for all of them, and apply their rules"""
+    def _apply_rules(self) -> bool:
+        if not self.pending_rules:
+            return False
 
-    """Handle a configure request (resize/move requests)."""
-    def _handle_configure_request_event(self, event) -> None:
-        try:
-            # Extract parameters from the event. Ensure that they are available and default to 0 or None if not.
-            x = getattr(event, 'x', 0)
-            y = getattr(event, 'y', 0)
-            width = getattr(event, 'width', self.screen.width_in_pixels)
-            height = getattr(event, 'height', self.screen.height_in_pixels)
-            border_width = getattr(event, 'border_width', 0)
-            sibling = getattr(event, 'sibling', None)
-            stack_mode = getattr(event, 'stack_mode', None)
-
-            # Configure the window with the parameters provided in the event.
+        pending, self.pending_rules = self.pending_rules, {}
+        for window, cookies in pending.items():
+            actions = self.rules.match(cookies)
+            if actions and window in self.clients:
+                self._apply_rule_actions(window, actions)
+        return True
+
+    """Float, place and/or move a window that isn't mapped yet, as its matching rules say"""
+    def _apply_rule_actions(self, window, actions) -> None:
+        TRACE.record('rules', window)
+        client = self.clients.get(window)
+        workspace_manager = self._workspace_manager_of(window)
+
+        if 'floating' in actions and bool(actions['floating']) != client.floating:
+            client.floating = bool(actions['floating'])
+            workspace_manager.tiling_manager(client.workspace - workspace_manager.first_workspace).dirty = True
+            client.geometry = None
+
+        if client.floating and 'geometry' in actions:
+            x, y, width, height = actions['geometry']
+            output_x, output_y, _, _ = self.outputs[self._output_of(client.workspace)].rect
+            client.geometry = (output_x + x, output_y + y, max(1, width), max(1, height))
             self.conn.core.ConfigureWindow(
-                event.window,
-                xproto.ConfigWindow.X |
-                xproto.ConfigWindow.Y |
-                xproto.ConfigWindow.Width |
-                xproto.ConfigWindow.Height |
-                xproto.ConfigWindow.BorderWidth |
-                xproto.ConfigWindow.Sibling |
-                xproto.ConfigWindow.StackMode,
-                [
-                    x,
-                    y,
-                    width,
-                    height,
-                    border_width,
-                    sibling,
-                    stack_mode
-                ]
+                window,
+                xproto.ConfigWindow.X | xproto.ConfigWindow.Y | xproto.ConfigWindow.Width | xproto.ConfigWindow.Height,
+                list(client.geometry)
             )
 
-            self.conn.flush()
+        if 'workspace' in actions:
+            self._move_window_to_workspace(window, int(actions['workspace']) - 1)
 
-        except xcffib.ConnectionException as e:
-            logging.error(f"Failed to configure window {event.window}: {e}")
-            logging.debug(traceback.format_exc())
-            self._graceful_shutdown()
+    """Collect the GetWindowAttributes replies of recently mapped windows"""
+    def _settle_pending_attributes(self) -> bool:
+        if not self.pending_attributes:
+            return False
 
-        except Exception as e:
-            logging.error(f"Unexpected error in handling configure request for window {event.window}: {e}")
-            logging.debug(traceback.format_exc())
-            self._graceful_shutdown()
+        pending, self.pending_attributes = self.pending_attributes, {}
+        for window, cookie in pending.items():
+            try:
+                # All cookies went out with earlier flushes, so at most the first of these waits
+                if not cookie.reply().override_redirect:
+                    continue
+                TRACE.record('override-redirect', window)
+
+            except xcffib.Error:
+                # Usually BadWindow: the client died before we got to it
+                TRACE.record('gone-before-managed', window)
+
+            self._forget_window(window)
+
+        return True
+
+    """A window got unmapped: either by us (workspace switch, move) or by its client withdrawing it"""
+    def _handle_unmap_notify_event(self, event) -> None:
+        client = self.clients.get(event.window)
+        if client is None:
+            return
+        # A synthetic UnmapNotify is how ICCCM clients withdraw a window we had already unmapped
+        if client.ignore_unmaps and not getattr(event, 'response_type', 0) & 0x80:
+            client.ignore_unmaps -= 1
+            return
+        self._forget_window(event.window)
+
+    """A window is gone; usually unmapped just before, unless it was on a hidden workspace"""
+    def _handle_destroy_notify_event(self, event) -> None:
+        # Don't wait on the attributes of a window that no longer exists
+        cookie = self.pending_attributes.pop(event.window, None)
+        if cookie is not None:
+            cookie.discard_reply()
+        self._forget_window(event.window)
+
+    """Stop managing a window"""
+    def _forget_window(self, window) -> None:
+        client = self.clients.get(window)
+        if client is None:
+            return
+
+        # Hand focus to the neighbour before the window leaves its ring
+        if self.focused == window:
+            neighbour = self.clients.next(window)
+            self.focused = neighbour if neighbour != window else None
+        if self.input_focus == window:
+            self.input_focus = None # X reverts it to the pointer root
+        if self.pending_focus == window:
+            self.pending_focus = None
+        if self.ewmh is not None:
+            self.ewmh.forget(window)
+        cookies = self.pending_rules.pop(window, None)
+        if cookies is not None:
+            self.rules.discard(cookies)
+        if self.drag is not None and self.drag.window == window:
+            self._end_drag()
+
+        self._workspace_manager_of(window).remove_window_from_workspace(window)
+
+    """Handle a configure request (resize/move requests)."""
+    def _handle_configure_request_event(self, event) -> None:
+        client = self.clients.get(event.window)
+        if client is not None and not client.floating:
+            # Tiled windows keep their tile: the client is told where it is instead of getting what it asked for
+            workspace_manager = self._workspace_manager_of(event.window)
+            workspace_manager.tiling_manager(client.workspace - workspace_manager.first_workspace).confirm_geometry(event.window)
+            return
+        if client is not None:
+            client.geometry = None # a floating window goes wherever it asks
+
+        # Extract parameters from the event. Ensure that they are available and default to 0 or None if not.
+        x = getattr(event, 'x', 0)
+        y = getattr(event, 'y', 0)
+        width = getattr(event, 'width', self.screen.width_in_pixels)
+        height = getattr(event, 'height', self.screen.height_in_pixels)
+        border_width = getattr(event, 'border_width', 0)
+        sibling = getattr(event, 'sibling', None)
+        stack_mode = getattr(event, 'stack_mode', None)
+
+        # Configure the window with the parameters provided in the event.
+        self.conn.core.ConfigureWindow(
+            event.window,
+            xproto.ConfigWindow.X |
+            xproto.ConfigWindow.Y |
+            xproto.ConfigWindow.Width |
+            xproto.ConfigWindow.Height |
+            xproto.ConfigWindow.BorderWidth |
+            xproto.ConfigWindow.Sibling |
+            xproto.ConfigWindow.StackMode,
+            [
+                x,
+                y,
+                width,
+                height,
+                border_width,
+                sibling,
+                stack_mode
+            ]
+        )
 
     """Cursor hovering focus implementation"""
     def _handle_enter_notify_event(self, event):
         """Focus the window when the cursor enters it."""
-        try:
-            # Focus the window the cursor entered
-            self.conn.core.SetInputFocus(
-                xproto.InputFocus.PointerRoot,
-                event.event,
-                xproto.Time.CurrentTime
-            )
+        # Grab/ungrab crossings and the pointer coming back from a subwindow don't move it between windows
+        if event.mode != xproto.NotifyMode.Normal or event.detail == xproto.NotifyDetail.Inferior:
+            return
+        # Generated by our own layout, map or unmap requests, not by the pointer moving
+        if self._before_fence(event.sequence):
+            return
+        if not self._can_focus(event.event):
+            return
 
-            # Update the current window index to match the newly focused window
-            if event.event in self.windows:
-                self.current_window = self.windows.index(event.event)
-            logging.info(f"Focused window: {event.event}")
-            self.conn.flush()
-        except Exception as e:
-            logging.error(f"Failed to focus window {event.event}: {e}")
-            logging.debug(traceback.format_exc())
+        # Rate limit: inside the interval only the last window entered gets focus, once the interval ends
+        wait = self.last_focus_change + self.focus_interval - time.monotonic()
+        if wait > 0 and self.loop is not None:
+            self.pending_focus = event.event
+            if self.focus_timer is None:
+                self.focus_timer = self.loop.call_later(wait, self._apply_pending_focus)
+            return
+
+        self._focus_pointer_window(event.event)
 
-        def string_to_keysym(string):
+    """Whether an event was generated before the server processed the crossing fence. The first one
+    that wasn't drops the fence: sequence numbers are 16 bits, so a fence left in place would wrap
+    around 32768 requests later and swallow every crossing from then on"""
+    def _before_fence(self, sequence) -> bool:
+        if self.crossing_fence is None:
+            return False
+        if 0 < (self.crossing_fence - sequence) & 0xffff < 0x8000:
+            return True
+        self.crossing_fence = None
+        return False
+
+    """Whether the pointer entering `window` should focus it: a managed window on a workspace being shown"""
+    def _can_focus(self, window) -> bool:
+        # A switch maps and unmaps windows under the pointer; crossings into a window that's no longer
+        # (or not yet) on screen are noise from that, not the user; same for scrolling the strip
+        return window in self.clients and self._workspace_manager_of(window).is_visible(window)
+
+    """Focus the window under the pointer; the batch commit sends it"""
+    def _focus_pointer_window(self, window) -> None:
+        self.pending_focus = None
+        if window == self.focused:
+            return
+        self.last_focus_change = time.monotonic()
+        self.current_output = self._output_of(self.clients.get(window).workspace) # the pointer moved to this monitor
+        self.focused = window
+        TRACE.record('focus', window)
+
+    """End of a rate-limit interval: focus the last window the pointer entered during it"""
+    def _apply_pending_focus(self) -> None:
+        self.focus_timer = None
+        window, self.pending_focus = self.pending_focus, None
+        if window is None or not self._can_focus(window):
+            return
+        self._focus_pointer_window(window)
+        self._commit_batch()
+        self._schedule_x_events()
+
+    """Give X input focus to `focused` unless it already has it"""
+    def _sync_input_focus(self) -> None:
+        window = self.focused
+        if window is None or window == self.input_focus or not self._can_focus(window):
+            return
+        self.conn.core.SetInputFocus(xproto.InputFocus.PointerRoot, window, xproto.Time.CurrentTime)
+        self.input_focus = window
+
+    """Focus a window and bring it to the top; the batch commit sends the focus"""
+    def _focus_window(self, window) -> None:
+        self.current_output = self._output_of(self.clients.get(window).workspace)
+        self.workspace_manager.tiling_manager().focus_window(window)
+        self.focused = window
+
+    """Take a window out of the tiling (it keeps its current geometry, on top) or put it back"""
+    def _set_floating(self, window, value) -> None:
+        client = self.clients.get(window)
+        if client.floating == value:
+            return
+        client.floating = value
+        workspace_manager = self._workspace_manager_of(window)
+        workspace_manager.tiling_manager(client.workspace - workspace_manager.first_workspace).dirty = True
+        if value:
+            self._focus_window(window) # raise it above the tiles
+        else:
+            client.geometry = None # the layout pass gives it a tile again
+
+    """Modifier + button 1/3 on a window: start moving/resizing it, floating it first if it's tiled"""
+    def _handle_button_press_event(self, event) -> None:
+        client = self.clients.get(event.child) # the press is reported on the root; child is the window under the pointer
+        if client is None or self.drag is not None or event.detail not in (floating.MOVE, floating.RESIZE):
+            return
+
+        geometry = client.geometry
+        if geometry is None: # moved behind the layout's back; ask once, at the press
             try:
-                keysym = xpybutil.keysymdef.keysyms[string]
-                logging.debug(f"Converted string '{string}' to keysym: {keysym}")
-                return keysym
-            except KeyError:
-                logging.error(f"Failed to convert string '{string}' to keysym.")
-                return None
+                reply = self.conn.core.GetGeometry(event.child).reply()
+            except xcffib.Error:
+                return
+            geometry = (reply.x, reply.y, reply.width, reply.height)
+
+        if client.floating:
+            self._focus_window(event.child)
+        else:
+            self._set_floating(event.child, True) # focuses and raises it too
+        self.drag = Drag(event.child, event.detail, (event.root_x, event.root_y), geometry)
+        client.geometry = geometry
+
+    """Pointer moved with the button held: note where it is, send the geometry at most once per frame"""
+    def _handle_motion_notify_event(self, event) -> None:
+        if self.drag is None:
+            return
+        self.drag.target = (event.root_x, event.root_y)
+        if self.drag_timer is not None:
+            return # the next frame picks the new position up
+
+        wait = self.last_drag_frame + self.drag_interval - time.monotonic()
+        if wait > 0 and self.loop is not None:
+            self.drag_timer = self.loop.call_later(wait, self._drag_frame)
+        else:
+            self._send_drag_geometry()
+
+    """Button released: the window lands exactly under the pointer"""
+    def _handle_button_release_event(self, event) -> None:
+        if self.drag is None or event.detail != self.drag.mode:
+            return
+        self.drag.target = (event.root_x, event.root_y)
+        self._send_drag_geometry()
+        self._end_drag()
+
+    def _drag_frame(self) -> None:
+        self.drag_timer = None
+        if self.drag is not None:
+            self._send_drag_geometry()
+            self._commit_batch()
+
+    def _send_drag_geometry(self) -> None:
+        geometry = self.drag.geometry_for_target()
+        self.last_drag_frame = time.monotonic()
+        if geometry == self.drag.sent:
+            return
+        self.conn.core.ConfigureWindow(
+            self.drag.window,
+            xproto.ConfigWindow.X | xproto.ConfigWindow.Y | xproto.ConfigWindow.Width | xproto.ConfigWindow.Height,
+            list(geometry)
+        )
+        self.drag.sent = self.clients.get(self.drag.window).geometry = geometry
+        self.windows_moved = True
+
+    def _end_drag(self) -> None:
+        if self.drag_timer is not None:
+            self.drag_timer.cancel()
+            self.drag_timer = None
+        self.drag = None
 
     """Destroy currently focused window"""
     def kill_current_window(self) -> None:
-        if self.windows:
-            window = self.windows[self.current_window]
+        if self.focused is not None:
+            window = self.focused
             # Destroy the window using XCB's destroy_window
             self.conn.core.DestroyWindow(window)
-            self.windows.pop(self.current_window)
-
-            # Remove the window from the tiling manager
-            self.tiling_manager.remove_window(window)
-
-            # Rearrange the remaining windows
-            self.tiling_manager.arrange_windows()
-
-            # Adjust the current window index to prevent out-of-bounds issues
-            self.current_window = max(0, self.current_window - 1)
-            self.conn.flush()
-            arrange
 
+            # Remove the window from its workspace and tiling manager; the batch's layout pass rearranges the rest
+            self._forget_window(window)
 
     """Shutdown executor and disconnect connection gracefully"""
     def _graceful_shutdown(self) -> None:
         logging.info("Shutting down gracefully.")
+        self._stop()
         self.conn.disconnect()
 
-    def switch_workspace(self, workspace_index: int) -> None:
-        """Switch to a different workspace."""
-        if workspace_index == self.current_workspace:
-            return  # Already on the desired workspace
-
-        logging.info(f"Switching to workspace {workspace_index + 1}")
-
-        # Unmap windows from the current workspace
-        for window in self.workspaces[self.current_workspace]:
-            self.conn.core.UnmapWindow(window)
-
-        # Map windows in the new workspace
-        for window in self.workspaces[workspace_index]:
-            self.conn.core.MapWindow(window)
-
-        # Flush the X connection
-        self.conn.flush()
-
-        # Update the current workspace index
-        self.current_workspace = workspace_index
+    """Send a window to another workspace of its output"""
+    def _move_window_to_workspace(self, window, workspace_index: int) -> None:
+        client = self.clients.get(window)
+        if client is None:
+            return
+        workspace_manager = self._workspace_manager_of(window)
+        # Checked before focus moves on: a workspace the output doesn't have leaves the window where it is
+        if not 0 <= workspace_index < workspace_manager.num_workspaces:
+            logging.error(f"No workspace {workspace_index + 1} to move window {window} to")
+            return
+        if client.workspace == workspace_manager.first_workspace + workspace_index:
+            return
 
-    def add_window_to_workspace(self, window) -> None:
-        """Add a window to the current workspace."""
-        self.workspaces[self.current_workspace].append(window)
-        logging.info(f"Added window {window} to workspace {self.current_workspace + 1}")
+        if self.focused == window:
+            neighbour = self.clients.next(window)
+            self.focused = neighbour if neighbour != window else None
 
-    def remove_window_from_workspace(self, window) -> None:
-        """Remove a window from the current workspace."""
-        if window in self.workspaces[self.current_workspace]:
-            self.workspaces[self.current_workspace].remove(window)
+        workspace_manager.move_window_to_workspace(window, workspace_index)
 
+    """Switch to the specified workspace; WorkspaceManager sends it, the batch commit flushes it once"""
     def _switch_workspace(self, workspace_index: int) -> None:
-            """Switch to the specified workspace."""
-            if workspace_index == self.current_workspace:
-                return  # Do nothing if already in the desired workspace
-
-            # Unmap all windows in the current workspace
-            for window in self.workspaces[self.current_workspace]['windows']:
-                self.conn.core.UnmapWindow(window)
-
-            # Set the new current workspace
-            self.current_workspace = workspace_index
-
-            # Map all windows in the new workspace and tile them
-            for window in self.workspaces[self.current_workspace]['windows']:
-                self.conn.core.MapWindow(window)
-
-            self.workspaces[self.current_workspace]['tiling_manager'].arrange_windows()
-            self.conn.flush()
+        if self.workspace_manager.switch_to_workspace(workspace_index):
+            self.focused = self.clients.first(self.workspace_manager.current_id)
 
 # nichtwm
 # made by akai_hana, AKA. Matias Moya
@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+
+"""
+Monitor discovery through RandR.
+
+Each monitor RandR reports (GetMonitors, RandR 1.5) becomes an Output: the rectangle of the root
+window it shows, plus its name atom, which stays the same across hotplugs and mode changes and
+is what outputs are matched on when the setup changes. Without RandR, or on a server older than
+1.5, the whole screen is a single output, which is how nichtwm always behaved.
+"""
+
+import collections
+import logging
+
+import xcffib
+
+try:
+    import xcffib.randr as randr
+except ImportError: # xcffib built without the RandR bindings
+    randr = None
+
+class Output(collections.namedtuple('Output', ('name', 'x', 'y', 'width', 'height', 'primary'))):
+    __slots__ = ()
+
+    """(x, y, width, height), the area layouts tile."""
+    @property
+    def rect(self) -> tuple:
+        return (self.x, self.y, self.width, self.height)
+
+"""The whole screen as one output."""
+def screen_output(width, height) -> Output:
+    return Output(0, 0, 0, width, height, True)
+
+"""The RandR extension of `conn`, or None if the server (or xcffib) doesn't have it."""
+def randr_extension(conn):
+    if randr is None:
+        return None
+    try:
+        return conn(randr.key)
+    except Exception as e:
+        logging.info(f"RandR unavailable, using the whole screen as one output: {e}")
+        return None
+
+"""Ask for RRScreenChangeNotify on the root window. Returns False without RandR."""
+def select_screen_changes(conn, root_window) -> bool:
+    extension = randr_extension(conn)
+    if extension is None:
+        return False
+    extension.SelectInput(root_window, randr.NotifyMask.ScreenChange)
+    return True
+
+"""Current outputs, left to right then top to bottom. `size` is the screen's (width, height)."""
+def query_outputs(conn, root_window, size) -> list:
+    extension = randr_extension(conn)
+    if extension is None:
+        return [screen_output(*size)]
+
+    # Both requests go out together; GetMonitors' reply is only read if the version allows it
+    version_cookie = extension.QueryVersion(1, 5)
+    monitors_cookie = extension.GetMonitors(root_window, True)
+    try:
+        version = version_cookie.reply()
+        if (version.major_version, version.minor_version) < (1, 5):
+            monitors_cookie.discard_reply()
+            logging.info(f"RandR {version.major_version}.{version.minor_version} has no monitors, using the whole screen")
+            return [screen_output(*size)]
+        monitors = monitors_cookie.reply().monitors
+    except xcffib.Error as e:
+        logging.error(f"RandR monitor query failed, using the whole screen: {e}")
+        return [screen_output(*size)]
+
+    outputs = [Output(monitor.name, monitor.x, monitor.y, monitor.width, monitor.height, bool(monitor.primary))
+               for monitor in monitors if monitor.width and monitor.height]
+    if not outputs:
+        return [screen_output(*size)]
+    return sorted(outputs, key=lambda output: (output.x, output.y))
@@ -0,0 +1,59 @@
+#!/usr/bin/env python3
+
+"""
+In-place restart: hand the WM's state over to a fresh copy of itself.
+
+RESTART writes the compact client/workspace state (which window is on which workspace of which
+output, in tiling order, floating or not; each output's shown workspace and layouts; focus) to a
+small JSON file and execs the same command line again. The process keeps its pid, so the new image
+finds the file by pid alone and deletes it once read. Windows survive the restart untouched: the
+new instance adopts them from QueryTree (see WindowManager._adopt_windows) and puts them back where
+the state says. After a crash there's no state file and visible windows are simply adopted onto
+the current workspace.
+"""
+
+import os
+import sys
+import json
+import logging
+
+STATE_VERSION = 1
+
+"""Where the state of the process with `pid` (this one by default) is handed over."""
+def state_path(pid=None) -> str:
+    directory = os.environ.get('XDG_RUNTIME_DIR') or '/tmp'
+    return os.path.join(directory, f'nichtwm-restart-{pid or os.getpid()}.json')
+
+"""Write `state` for the next image of this process."""
+def save_state(state, path=None) -> str:
+    path = path or state_path()
+    temporary = f'{path}.tmp'
+    with open(temporary, 'w') as f:
+        json.dump(dict(state, version=STATE_VERSION), f, separators=(',', ':'))
+    os.replace(temporary, path)
+    return path
+
+"""State left by the previous image of this process, or None. The file is removed either way."""
+def load_state(path=None):
+    path = path or state_path()
+    try:
+        with open(path) as f:
+            state = json.load(f)
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError) as e:
+        logging.error(f"Ignoring unreadable restart state {path}: {e}")
+        state = None
+    try:
+        os.unlink(path)
+    except OSError:
+        pass
+    if state is not None and state.get('version') != STATE_VERSION:
+        logging.error(f"Ignoring restart state of another version ({state.get('version')})")
+        return None
+    return state
+
+"""Replace this process with a fresh run of the same command line. Never returns."""
+def reexec() -> None:
+    logging.info("Restarting in place")
+    os.execv(sys.executable, [sys.executable] + sys.argv)
@@ -0,0 +1,195 @@
+#!/usr/bin/env python3
+
+"""
+Window rules: float, place or send windows to a workspace by WM_CLASS, title or window type.
+
+  rules:
+    - class: Pavucontrol              # WM_CLASS class, exact
+      floating: true
+    - instance-regex: '^crx_'         # WM_CLASS instance, regular expression
+      workspace: 4                    # of the output the window shows up on, up to num-o-workspaces
+    - title: 'Picture-in-Picture'     # title (_NET_WM_NAME, else WM_NAME), regular expression
+      floating: true
+      geometry: [1500, 40, 400, 225]  # x y width height, relative to the output
+    - type: dialog                    # _NET_WM_WINDOW_TYPE_DIALOG
+      floating: true
+
+Rules are compiled when the config is loaded: exact matchers (class, instance, type) go into
+hash tables and regular expressions are compiled once. A window is only checked against the rules
+one of its exact values selects, plus the rules that have no exact matcher. Every rule that
+matches applies, in config order.
+
+Fetching what rules look at never blocks a MapRequest: RuleEngine.request sends one GetProperty
+per property some rule needs and returns the cookies. The WM reads the replies of a whole batch of
+new windows at once, before mapping them, so rules cost at most one round-trip per batch however
+many there are, and nothing at all without rules.
+"""
+
+import re
+import struct
+import logging
+import collections
+
+import xcffib
+import xcffib.xproto as xproto
+
+# _NET_WM_WINDOW_TYPE values a `type` matcher can name
+WINDOW_TYPES = ('desktop', 'dock', 'toolbar', 'menu', 'utility', 'splash', 'dialog', 'normal')
+
+# Atoms rules need; interned at startup together with the EWMH ones
+ATOM_NAMES = ('UTF8_STRING', '_NET_WM_NAME', '_NET_WM_WINDOW_TYPE') + \
+             tuple(f'_NET_WM_WINDOW_TYPE_{name.upper()}' for name in WINDOW_TYPES)
+
+# Matcher -> property it reads
+EXACT_MATCHERS = {'class': 'class', 'instance': 'class', 'type': 'type'}
+REGEX_MATCHERS = {'class-regex': 'class', 'instance-regex': 'class', 'title': 'title'}
+ACTIONS = ('workspace', 'floating', 'geometry')
+
+# GetProperty reads at most this many 32-bit units; plenty for classes, titles and type lists
+PROPERTY_LENGTH = 256
+
+Rule = collections.namedtuple('Rule', ('index', 'exact', 'regexes', 'actions'))
+
+"""Raw bytes of a GetProperty reply."""
+def _property_bytes(reply) -> bytes:
+    value = reply.value
+    return value.buf() if hasattr(value, 'buf') else bytes(value)
+
+class RuleEngine:
+    def __init__(self, rules, atoms, num_workspaces=None) -> None:
+        self.atoms = atoms       # name -> atom, see ewmh.intern_atoms()
+        self.num_workspaces = num_workspaces # workspaces per output, the highest `workspace` a rule can name
+        self.rules = []          # every valid rule, in config order
+        self.exact = {}          # (matcher, value) -> rules indexed under that exact matcher
+        self.scan = []           # rules without an exact matcher, checked against every window
+        self.properties = set()  # properties ('class', 'title', 'type') some rule looks at
+
+        for index, spec in enumerate(rules or ()):
+            rule = self._compile(index, spec)
+            if rule is None:
+                continue
+            self.rules.append(rule)
+            if rule.exact:
+                # Indexed under its first exact matcher; the others are checked once it's a candidate
+                self.exact.setdefault(rule.exact[0], []).append(rule)
+            else:
+                self.scan.append(rule)
+            self.properties.update(EXACT_MATCHERS.get(matcher) or REGEX_MATCHERS[matcher]
+                                   for matcher, _ in rule.exact + rule.regexes)
+
+    def __bool__(self) -> bool:
+        return bool(self.rules)
+
+    def _compile(self, index, spec):
+        if not isinstance(spec, dict):
+            logging.error(f"Rule {index + 1} is not a mapping, ignoring it")
+            return None
+
+        exact, regexes, actions = [], [], {}
+        for key, value in spec.items():
+            if key == 'type':
+                atom = self.atoms.get(f'_NET_WM_WINDOW_TYPE_{str(value).upper()}')
+                if atom is None:
+                    logging.error(f"Rule {index + 1}: unknown window type {value!r}, ignoring the rule")
+                    return None
+                exact.append((key, atom))
+            elif key in EXACT_MATCHERS:
+                exact.append((key, str(value)))
+            elif key in REGEX_MATCHERS:
+                try:
+                    regexes.append((key, re.compile(str(value))))
+                except re.error as e:
+                    logging.error(f"Rule {index + 1}: bad regular expression {value!r} ({e}), ignoring the rule")
+                    return None
+            elif key in ACTIONS:
+                actions[key] = value
+            else:
+                logging.error(f"Rule {index + 1}: unknown key {key!r}, ignoring the rule")
+                return None
+
+        if not exact and not regexes:
+            logging.error(f"Rule {index + 1} matches nothing, ignoring it")
+            return None
+        if 'workspace' in actions and (not isinstance(actions['workspace'], int) or actions['workspace'] < 1):
+            logging.error(f"Rule {index + 1}: workspace must be a number from 1 up, ignoring the rule")
+            return None
+        if 'workspace' in actions and self.num_workspaces is not None and actions['workspace'] > self.num_workspaces:
+            logging.error(f"Rule {index + 1}: there is no workspace {actions['workspace']} "
+                          f"(num-o-workspaces is {self.num_workspaces}), ignoring the rule")
+            return None
+        if 'geometry' in actions and (not isinstance(actions['geometry'], list) or len(actions['geometry']) != 4):
+            logging.error(f"Rule {index + 1}: geometry must be [x, y, width, height], ignoring the rule")
+            return None
+        return Rule(index, tuple(exact), tuple(regexes), actions)
+
+    """Send the GetProperty requests the rules need for `window` without waiting. Returns the cookies."""
+    def request(self, conn, window) -> dict:
+        cookies = {}
+        if 'class' in self.properties:
+            cookies['class'] = conn.core.GetProperty(False, window, xproto.Atom.WM_CLASS, xproto.Atom.STRING, 0, PROPERTY_LENGTH)
+        if 'title' in self.properties:
+            cookies['net_title'] = conn.core.GetProperty(False, window, self.atoms['_NET_WM_NAME'],
+                                                         self.atoms['UTF8_STRING'], 0, PROPERTY_LENGTH)
+            cookies['title'] = conn.core.GetProperty(False, window, xproto.Atom.WM_NAME, xproto.Atom.Any, 0, PROPERTY_LENGTH)
+        if 'type' in self.properties:
+            cookies['type'] = conn.core.GetProperty(False, window, self.atoms['_NET_WM_WINDOW_TYPE'],
+                                                    xproto.Atom.ATOM, 0, PROPERTY_LENGTH)
+        return cookies
+
+    """Read the replies behind `cookies` (from request()) and return the actions of every matching rule."""
+    def match(self, cookies) -> dict:
+        try:
+            properties = self._read(cookies)
+        except xcffib.Error as e:
+            # Usually BadWindow: the window is already gone, and will be forgotten as such
+            logging.debug(f"Could not read window properties for rules: {e}")
+            self.discard(cookies)
+            return {}
+
+        candidates = list(self.scan)
+        instance, window_class = properties['class']
+        candidates += self.exact.get(('class', window_class), ())
+        candidates += self.exact.get(('instance', instance), ())
+        for atom in properties['type']:
+            candidates += self.exact.get(('type', atom), ())
+
+        actions = {}
+        for rule in sorted(candidates, key=lambda rule: rule.index):
+            if self._matches(rule, properties):
+                actions.update(rule.actions)
+        return actions
+
+    """Throw away the replies behind `cookies` when the window won't be matched (it went away)."""
+    def discard(self, cookies) -> None:
+        for cookie in cookies.values():
+            cookie.discard_reply()
+
+    def _read(self, cookies) -> dict:
+        properties = {'class': ('', ''), 'title': '', 'type': ()}
+        if 'class' in cookies:
+            # WM_CLASS is two NUL-terminated strings: instance, then class
+            parts = _property_bytes(cookies['class'].reply()).decode('latin-1').split('\0')
+            properties['class'] = (parts[0], parts[1] if len(parts) > 1 else '')
+        if 'title' in cookies:
+            title = _property_bytes(cookies['net_title'].reply()).decode('utf-8', 'replace')
+            legacy = _property_bytes(cookies['title'].reply()).decode('latin-1')
+            properties['title'] = title or legacy
+        if 'type' in cookies:
+            data = _property_bytes(cookies['type'].reply())
+            properties['type'] = struct.unpack(f'={len(data) // 4}I', data[:len(data) // 4 * 4])
+        return properties
+
+    def _matches(self, rule, properties) -> bool:
+        instance, window_class = properties['class']
+        for matcher, value in rule.exact:
+            if matcher == 'class' and window_class != value:
+                return False
+            if matcher == 'instance' and instance != value:
+                return False
+            if matcher == 'type' and value not in properties['type']:
+                return False
+        for matcher, pattern in rule.regexes:
+            subject = {'class-regex': window_class, 'instance-regex': instance, 'title': properties['title']}[matcher]
+            if pattern.search(subject) is None:
+                return False
+        return True
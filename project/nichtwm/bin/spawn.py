@@ -0,0 +1,198 @@
+#!/usr/bin/env python3
+
+"""
+Command launcher for `command` bindings.
+
+subprocess.Popen(shell=True) on the event loop forked the whole WM (X connection, caches and
+all), went through /bin/sh even for a plain `alacritty`, and never waited on the child, so every
+launch left a zombie behind. Spawner instead forks a small helper once, at startup before the X
+connection exists, and hands it commands over a socketpair. The helper starts them with
+posix_spawnp (vfork+exec under glibc, no copy of anything), skips the shell when the command has
+no shell syntax, and reaps its children on SIGCHLD. For every command it acks the pid and the
+CLOCK_MONOTONIC time the process was started, which the WM turns into the 'spawn' latency phase.
+
+If the helper can't be started or dies, commands are spawned from the WM itself, with the same
+posix_spawnp path; those children are reaped when the WM gets SIGCHLD.
+"""
+
+import os
+import json
+import time
+import shlex
+import signal
+import socket
+import logging
+import collections
+
+from metrics import METRICS
+
+# Characters that need /bin/sh to mean what the user wrote
+SHELL_SYNTAX = set('|&;<>()$`\\"\'*?[]#~=%{}\n')
+
+# Python ignores SIGPIPE and the helper handles SIGCHLD/ignores SIGINT; children get the defaults back
+CHILD_DEFAULT_SIGNALS = (signal.SIGPIPE, signal.SIGCHLD, signal.SIGINT, signal.SIGUSR1)
+
+"""argv for `command`: split directly when it's plain words, through /bin/sh otherwise.
+Raises ValueError for a command that isn't one (not a string, or nothing but whitespace)."""
+def command_argv(command) -> list:
+    if not isinstance(command, str):
+        raise ValueError(f"command must be a string, not {type(command).__name__}")
+    if SHELL_SYNTAX.intersection(command):
+        return ['/bin/sh', '-c', command]
+    argv = shlex.split(command)
+    if not argv:
+        raise ValueError("empty command")
+    return argv
+
+"""Start `command` without forking the caller. Returns its pid."""
+def posix_spawn(command) -> int:
+    argv = command_argv(command)
+    return os.posix_spawnp(argv[0], argv, os.environ, setsid=True, setsigdef=CHILD_DEFAULT_SIGNALS)
+
+"""Wait for whichever of `pids` exited, without blocking. Returns the reaped pids."""
+def reap(pids) -> set:
+    reaped = set()
+    for pid in list(pids):
+        try:
+            done, _ = os.waitpid(pid, os.WNOHANG)
+        except ChildProcessError:
+            done = pid # someone else already waited on it
+        if done:
+            reaped.add(pid)
+    pids.difference_update(reaped)
+    return reaped
+
+class Spawner:
+    def __init__(self) -> None:
+        self.helper = None     # pid of the helper process
+        self.socket = None     # our end of the socketpair
+        self.children = set()  # pids to reap: the helper, and commands spawned from the WM itself
+        self.sent = collections.deque() # CLOCK_MONOTONIC time of each command the helper hasn't acked yet
+        self._buffer = b''
+        self.loop = None       # asyncio loop reading the acks, see attach()
+        self._start_helper()
+
+    def _start_helper(self) -> None:
+        try:
+            ours, theirs = socket.socketpair()
+            pid = os.fork()
+        except OSError as e:
+            logging.error(f"Could not start the spawn helper, spawning from the WM: {e}")
+            return
+
+        if pid == 0:
+            ours.close()
+            _helper(theirs) # never returns
+
+        theirs.close()
+        ours.setblocking(False)
+        self.helper, self.socket = pid, ours
+        self.children.add(pid)
+
+    """Read the helper's acks from an asyncio loop."""
+    def attach(self, loop) -> None:
+        self.loop = loop
+        if self.socket is not None:
+            loop.add_reader(self.socket, self.read_acks)
+
+    """Launch `command` (a config.yaml `command` string)."""
+    def spawn(self, command) -> None:
+        reap(self.children)
+
+        if self.socket is not None:
+            try:
+                self.sent.append(time.monotonic())
+                self.socket.sendall(json.dumps(command).encode() + b'\n')
+                return
+            except OSError as e:
+                self.sent.pop()
+                logging.error(f"Spawn helper is gone ({e}), spawning from the WM")
+                self._drop_helper()
+
+        start = time.monotonic()
+        try:
+            self.children.add(posix_spawn(command))
+        except (OSError, ValueError) as e:
+            logging.error(f"Failed to run command {command!r}: {e}")
+            return
+        METRICS.record_phase('spawn', time.monotonic() - start)
+
+    """Read whatever acks the helper sent; each one is a launch latency sample."""
+    def read_acks(self) -> None:
+        try:
+            data = self.socket.recv(65536)
+        except BlockingIOError:
+            return
+        except OSError:
+            data = b''
+        if not data:
+            logging.error("Spawn helper exited, spawning from the WM from now on")
+            self._drop_helper()
+            return
+
+        self._buffer += data
+        *lines, self._buffer = self._buffer.split(b'\n')
+        for line in lines:
+            ack = json.loads(line)
+            sent = self.sent.popleft() if self.sent else None
+            if 'error' in ack:
+                logging.error(f"Failed to run command {ack['command']!r}: {ack['error']}")
+            elif sent is not None:
+                METRICS.record_phase('spawn', ack['started'] - sent)
+
+    """SIGCHLD in the WM: reap the helper or directly spawned commands that exited."""
+    def reap_children(self) -> None:
+        reap(self.children)
+
+    def _drop_helper(self) -> None:
+        if self.socket is not None:
+            if self.loop is not None:
+                self.loop.remove_reader(self.socket)
+            self.socket.close()
+        self.socket = None
+        self.sent.clear()
+        reap(self.children)
+
+    """Stop the helper (it exits on EOF); commands it started keep running."""
+    def close(self) -> None:
+        helper = self.helper
+        self._drop_helper()
+        if helper is not None and helper in self.children:
+            try:
+                os.waitpid(helper, 0)
+            except ChildProcessError:
+                pass
+            self.children.discard(helper)
+        self.helper = None
+
+"""SIGCHLD in the helper: every child is a command it spawned, so wait on any of them."""
+def _reap_all(signum, frame) -> None:
+    while True:
+        try:
+            pid, _ = os.waitpid(-1, os.WNOHANG)
+        except ChildProcessError:
+            return
+        if pid == 0:
+            return
+
+"""Body of the helper process: spawn each command read from `connection`, ack it, reap children."""
+def _helper(connection) -> None:
+    status = 0
+    try:
+        signal.signal(signal.SIGINT, signal.SIG_IGN) # Ctrl-C on the WM's terminal is the WM's business
+        signal.signal(signal.SIGUSR1, signal.SIG_DFL)
+        signal.signal(signal.SIGCHLD, _reap_all)
+
+        with connection, connection.makefile('rb') as commands:
+            for line in commands: # EOF when the WM closes its end or exits
+                command = json.loads(line)
+                try:
+                    pid = posix_spawn(command)
+                    ack = {'pid': pid, 'started': time.monotonic()}
+                except Exception as e: # a bad command must never take the helper down with it
+                    ack = {'command': command, 'error': str(e)}
+                connection.sendall(json.dumps(ack).encode() + b'\n')
+    except BaseException:
+        status = 1
+    finally:
+        os._exit(status) # never fall back into the WM's code
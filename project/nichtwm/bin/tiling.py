@@ -3,99 +3,235 @@
 import xcffib.xproto as xproto
 import logging
 
+import layouts
+from metrics import timed
+
 """Manages tiling layouts and operations for nichtwm."""
 class TilingManager:
-    def __init__(self, conn, screen, root_window) -> None:
+    def __init__(self, conn, screen, root_window, clients, workspace, layout=layouts.DEFAULT_LAYOUT, params=None, rect=None) -> None:
         self.conn = conn
         self.screen = screen
         self.root_window = root_window
-        self.windows = []
+        self.clients = clients     # shared ClientRegistry
+        self.workspace = workspace # the workspace of the registry this manager tiles
+        # (x, y, width, height) of the output this workspace is shown on; the whole screen by default
+        self.rect = rect or (0, 0, screen.width_in_pixels, screen.height_in_pixels)
+        self.layout = layout if layout in layouts.LAYOUTS else layouts.DEFAULT_LAYOUT
+        self.params = params or {} # e.g. {'master-ratio': 0.5, 'masters': 1, 'gap': 0}
+        self.dirty = False # Layout needs recalculating
+        # Scrolling layout only: the view over the strip, which follows focus (see scroll_to)
+        self.anchor = None    # window at the left edge of the view; the start of the strip if None
+        self.shown = set()    # tiled windows in view after the last layout pass
+        self.hidden = []      # windows that scrolled out of view since the last commit, to unmap
+        self.revealed = []    # windows that scrolled into view since the last commit, to map
+
+    """Windows tiled by this manager, in layout order."""
+    @property
+    def windows(self) -> list:
+        return self.clients.windows(self.workspace)
 
-    """Adds a window and rearranges the layout."""
+    """Adds a window; the layout is recalculated on the next arrange_if_dirty."""
     def add_window(self, window) -> None:
-        if window not in self.windows:
-            self.windows.append(window)
-            self.arrange_windows()
-    """Removes a window and updates the layout."""
+        if window not in self.clients:
+            self.clients.add(window, self.workspace)
+            self.dirty = True
+
+    """Removes a window; the layout is recalculated on the next arrange_if_dirty."""
     def remove_window(self, window) -> None:
-        if window in self.windows:
-            self.windows.remove(window)
+        client = self.clients.get(window)
+        if client is not None and client.workspace == self.workspace:
+            self.leave_view(window)
+            self.clients.remove(window)
+            self.dirty = True
+
+    """Recalculate the layout only if windows were added or removed since the last pass."""
+    def arrange_if_dirty(self) -> None:
+        if self.dirty:
+            self.arrange_windows()
 
     """Recalculate and apply the tiling layout."""
+    @timed('arrange_windows')
     def arrange_windows(self) -> None:
-        if not self.windows:
+        self.dirty = False
+        if self.layout == 'scrolling':
+            self._arrange_strip()
+            return
+        windows = self.clients.tiled(self.workspace) # floating windows keep their own geometry
+        if not windows:
             logging.debug("No windows to arrange.")
             return
 
-        screen_width = self.screen.width_in_pixels
-        screen_height = self.screen.height_in_pixels
+        rects = layouts.LAYOUTS[self.layout](len(windows), self.rect, self.params)
+
+        for window, (x, y, width, height) in zip(windows, layouts.as_list(rects)):
+            self._configure_window(window, x, y, width, height)
+
+    """Scrolling layout pass: only the windows in view are walked, laid out and configured, so it
+    costs the same with 3 windows on the workspace or 300. The ones that left or entered the view
+    are queued for the WorkspaceManager to unmap/map (see take_view_changes)."""
+    def _arrange_strip(self) -> None:
+        view = self._view()
+        rects = layouts.scrolling(len(view), self.rect, self.params)
+        for window, (x, y, width, height) in zip(view, layouts.as_list(rects)):
+            self._configure_window(window, x, y, width, height)
+
+        shown = set(view)
+        self.hidden += [window for window in self.shown if window not in shown]
+        self.revealed += [window for window in view if window not in self.shown]
+        self.shown = shown
+
+    """Tiled windows in view, left to right: as many columns as fit, starting at the anchor, pulled
+    back from the end of the strip so the view is never half empty while there's more to the left."""
+    def _view(self) -> list:
+        first = self.clients.get(self.anchor)
+        if first is None or first.workspace != self.workspace:
+            first = self.clients.heads[self.workspace]
+        if first is not None and first.floating:
+            first = self._tiled_neighbour(first, forward=True) or self._tiled_neighbour(first, forward=False)
+        if first is None:
+            self.anchor = None
+            return []
 
+        count = layouts.columns_in_view(self.rect, self.params)
+        view = [first]
+        while len(view) < count:
+            client = self._tiled_neighbour(view[-1], forward=True)
+            if client is None:
+                break
+            view.append(client)
+        while len(view) < count:
+            client = self._tiled_neighbour(view[0], forward=False)
+            if client is None:
+                break
+            view.insert(0, client)
+
+        self.anchor = view[0].window
+        return [client.window for client in view]
+
+    """Next (or previous) tiled client on the strip; None past either end, the strip doesn't wrap."""
+    def _tiled_neighbour(self, client, forward):
+        head = self.clients.heads[self.workspace]
         while True:
-            num_windows = len(self.windows)
-
-            if len(self.windows) == 1:
-                # One window takes the full screen
-                self._tile_single_window(self.windows[0], screen_width, screen_height)
-                return
-            if len(self.windows) != 1:
-                # First window on the left (50% width), remaining windows stacked on the right
-                first_window_width = screen_width // 2
-                first_window_height = screen_height
-                remaining_window_width = screen_width // 2
-                remaining_window_height = screen_height // (len(self.windows) - 1)
-
-                self._tile_first_window(self.windows[0], first_window_width, first_window_height)
-
-                # Stacked windows on the right
-                for i, window in enumerate(self.windows[1:], start=1):
-                    y = (i - 1) * remaining_window_height
-                    x = first_window_width  # Update x coordinate for windows on the right
-                    self._tile_right_stack(window, x, y, remaining_window_width, remaining_window_height)
-                return
-
-            self.conn.flush()
-
-    def _tile_single_window(self, window, screen_width, screen_height):
-        """Configure a single window to take up the full screen."""
-        self.conn.core.ConfigureWindow(
-            window,
-            xproto.ConfigWindow.X |
-            xproto.ConfigWindow.Y |
-            xproto.ConfigWindow.Width |
-            xproto.ConfigWindow.Height,
-            [0, 0, screen_width, screen_height]
-        )
+            if forward:
+                client = client.next
+                if client is head:
+                    return None
+            else:
+                if client is head:
+                    return None
+                client = client.prev
+            if not client.floating:
+                return client
 
-    def _tile_first_window(self, window, width, height):
-        """Configure the first window to take up the left half of the screen."""
-        self.conn.core.ConfigureWindow(
-            window,
-            xproto.ConfigWindow.X |
-            xproto.ConfigWindow.Y |
-            xproto.ConfigWindow.Width |
-            xproto.ConfigWindow.Height,
-            [0, 0, width, height]
-        )
+    """Scroll the strip so a window is in view (scrolling layout only). A window just right of the
+    view slides it one column; anything else becomes the left edge (and the view is pulled back if
+    that's near the end of the strip)."""
+    def scroll_to(self, window) -> None:
+        client = self.clients.get(window)
+        if self.layout != 'scrolling' or client is None or client.workspace != self.workspace \
+                or client.floating or window in self.shown:
+            return
+        previous = self._tiled_neighbour(client, forward=False)
+        if previous is not None and previous.window in self.shown:
+            anchor = self.clients.get(self.anchor)
+            following = None
+            if anchor is not None and anchor.workspace == self.workspace:
+                following = self._tiled_neighbour(anchor, forward=True)
+            self.anchor = following.window if following is not None else window
+        else:
+            self.anchor = window
+        self.dirty = True
+
+    """A window is leaving this workspace: keep the view where it is without it."""
+    def leave_view(self, window) -> None:
+        self.shown.discard(window)
+        if window == self.anchor:
+            client = self.clients.get(window)
+            neighbour = self._tiled_neighbour(client, forward=True) or self._tiled_neighbour(client, forward=False)
+            self.anchor = neighbour.window if neighbour is not None else None
+
+    """Whether a window of this workspace is on screen while the workspace is shown: all of them,
+    except tiled windows scrolled out of view."""
+    def shows(self, client) -> bool:
+        return self.layout != 'scrolling' or client.floating or client.window in self.shown
+
+    """Windows of this workspace that are on screen while it's shown."""
+    def visible_windows(self) -> list:
+        if self.layout != 'scrolling':
+            return self.windows
+        return [window for window in self.windows if self.shows(self.clients.get(window))]
+
+    """Windows that scrolled out of and into view since the last call, as (hidden, revealed)."""
+    def take_view_changes(self) -> tuple:
+        changes = (self.hidden, self.revealed)
+        self.hidden, self.revealed = [], []
+        return changes
+
+    """Tile into another area (the output moved or changed mode); nothing happens if it's the same."""
+    def set_rect(self, rect) -> None:
+        if rect != self.rect:
+            self.rect = rect
+            self.dirty = True
+
+    """Switch to another layout by name (see layouts.LAYOUTS)."""
+    def set_layout(self, layout) -> None:
+        if layout not in layouts.LAYOUTS:
+            logging.error(f"Unknown layout: {layout}")
+            return
+        if self.layout == 'scrolling' and layout != 'scrolling':
+            # Off the strip: everything scrolled out of view comes back
+            self.revealed += [window for window in self.clients.tiled(self.workspace) if window not in self.shown]
+            self.shown = set()
+        elif layout == 'scrolling' and self.layout != 'scrolling':
+            # Everything is in view until the first pass scrolls the rest out
+            self.shown = set(self.clients.tiled(self.workspace))
+        self.layout = layout
+        self.dirty = True
+
+    """Cycle to the next layout in layouts.LAYOUTS."""
+    def next_layout(self) -> None:
+        names = list(layouts.LAYOUTS)
+        self.set_layout(names[(names.index(self.layout) + 1) % len(names)])
+
+    def _configure_window(self, window, x, y, width, height):
+        """Send a ConfigureWindow only if the rectangle differs from the last one applied."""
+        client = self.clients.get(window)
+        geometry = (x, y, width, height)
+        if client.geometry == geometry:
+            return
 
-    def _tile_right_stack(self, window, x, y, width, height):
-        """Configure the right stack of windows."""
         self.conn.core.ConfigureWindow(
             window,
             xproto.ConfigWindow.X |
             xproto.ConfigWindow.Y |
             xproto.ConfigWindow.Width |
             xproto.ConfigWindow.Height,
-            [x, y, width, height]
+            list(geometry)
         )
+        client.geometry = geometry
+
+    """Forget the cached geometry of a window that was moved/resized behind the layout's back."""
+    def invalidate_geometry(self, window) -> None:
+        client = self.clients.get(window)
+        if client is not None:
+            client.geometry = None
+
+    """Answer a tiled window's ConfigureRequest with where its tile is: a synthetic ConfigureNotify,
+    as ICCCM 4.1.5 asks of a WM that doesn't grant the request. Returns False, and has the next
+    layout pass place the window, if no tile was sent to it yet."""
+    def confirm_geometry(self, window) -> bool:
+        client = self.clients.get(window)
+        if client is None or client.geometry is None:
+            self.dirty = True
+            return False
+
+        x, y, width, height = client.geometry
+        event = xproto.ConfigureNotifyEvent.synthetic(window, window, 0, x, y, width, height, 0, False)
+        self.conn.core.SendEvent(False, window, xproto.EventMask.StructureNotify, event.pack())
+        return True
 
     def focus_window(self, window) -> None:
-        """Focus a specific window."""
-        if window in self.windows:
-            self.conn.core.RaiseWindow(window)
-            self.conn.flush()
-
-    def handle_window_close(self, event):
-        """Handles a window close event."""
-        window = event.window
-        self.remove_window(window)
-        self.conn.flush()
+        """Raise a specific window."""
+        client = self.clients.get(window)
+        if client is not None and client.workspace == self.workspace:
+            self.conn.core.ConfigureWindow(window, xproto.ConfigWindow.StackMode, [xproto.StackMode.Above])
@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+
+"""
+Flight recorder for nichtwm's event loop.
+
+TRACE (process-wide, like METRICS in metrics.py) keeps the last `trace-size` records in preallocated arrays:
+when something happened, what kind of thing (an X event type or a short name like 'focus'),
+the window involved and how long handling it took. Recording is four array stores and an index
+bump; nothing gets formatted, so it stays on all the time instead of DEBUG logging in the hot path.
+The records only turn into text when dumped: on SIGUSR2, the DUMP_TRACE action, or a crash.
+
+  kill -USR2 $(pidof -x nichtwm.py)   # writes $XDG_RUNTIME_DIR/nichtwm-trace-<pid>.jsonl, oldest first
+"""
+
+import os
+import json
+import time
+import array
+import logging
+
+DEFAULT_SIZE = 4096 # records kept; older ones are overwritten
+
+class Tracer:
+    def __init__(self, size=DEFAULT_SIZE) -> None:
+        self.resize(size)
+
+    """Start over with room for `size` records; 0 turns recording off."""
+    def resize(self, size) -> None:
+        self.size = max(0, int(size))
+        self.enabled = self.size > 0
+        self.times = array.array('d', bytes(8 * self.size))     # time.perf_counter() at the start
+        self.kinds = array.array('H', bytes(2 * self.size))     # index into self.kind_names
+        self.windows = array.array('I', bytes(4 * self.size))   # XID, 0 if none
+        self.durations = array.array('f', bytes(4 * self.size)) # seconds
+        self.count = 0         # records ever written; the next one goes to count % size
+        self.kind_codes = {}   # kind -> index into kind_names
+        self.kind_names = []
+
+    """Record that `kind` happened to `window` at `start` (perf_counter) and took `duration` seconds."""
+    def record(self, kind, window=0, start=None, duration=0.0) -> None:
+        if not self.enabled:
+            return
+        code = self.kind_codes.get(kind)
+        if code is None:
+            code = self.kind_codes[kind] = len(self.kind_names)
+            self.kind_names.append(getattr(kind, '__name__', str(kind)))
+        slot = self.count % self.size
+        self.times[slot] = time.perf_counter() if start is None else start
+        self.kinds[slot] = code
+        self.windows[slot] = window & 0xffffffff
+        self.durations[slot] = duration
+        self.count += 1
+
+    """The kept records, oldest first, as dicts."""
+    def records(self) -> list:
+        first = max(0, self.count - self.size)
+        records = []
+        for index in range(first, self.count):
+            slot = index % self.size
+            records.append({
+                't': self.times[slot],
+                'kind': self.kind_names[self.kinds[slot]],
+                'window': self.windows[slot],
+                'us': round(self.durations[slot] * 1e6, 1),
+            })
+        return records
+
+    """Write the kept records as JSON lines and return the path."""
+    def dump(self, path=None) -> str:
+        path = path or default_dump_path()
+        with open(path, 'w') as f:
+            for record in self.records():
+                f.write(json.dumps(record) + '\n')
+        logging.info(f"Trace of the last {min(self.count, self.size)} records written to {path}")
+        return path
+
+TRACE = Tracer()
+
+"""XID an X event is about: `window` for most, `event` for crossings and key presses, 0 otherwise."""
+def event_window(event) -> int:
+    return getattr(event, 'window', None) or getattr(event, 'event', 0)
+
+"""Where dumps go unless told otherwise."""
+def default_dump_path() -> str:
+    directory = os.environ.get('XDG_RUNTIME_DIR') or '/tmp'
+    return os.path.join(directory, f'nichtwm-trace-{os.getpid()}.jsonl')
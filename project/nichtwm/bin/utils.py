@@ -1,5 +1,6 @@
-import xpybutil
-import xpybutil.keybind
+import array
+import hashlib
+import logging
 
 """
 This module provides functions to translate between keycodes and keysyms
@@ -28,16 +29,41 @@ class KeyUtil:
             self.max_keycode - self.min_keycode + 1
         ).reply()
 
+        # Plain copy of the keycode x keysyms_per_keycode grid, so MappingNotify can patch rows in place
+        self.keysyms_per_keycode = self.keyboard_mapping.keysyms_per_keycode
+        self.keysyms = list(self.keyboard_mapping.keysyms)
+
+        # Reverse index: keysym -> every keycode carrying it, and keysym -> lowest of those.
+        # The lowest keycode is what the old row-major scan of the grid used to return.
+        # Built on first use, so a start whose keycodes come from the config cache never pays for it.
+        self.keysym_keycodes = None
+        self.keycodes = None
+
+    def digest(self) -> str:
+        """Short hash of the keyboard mapping; keycodes cached under it are only valid for this exact layout."""
+        hasher = hashlib.blake2b(digest_size=16)
+        hasher.update(f'{self.min_keycode}:{self.keysyms_per_keycode}:'.encode())
+        hasher.update(array.array('I', self.keysyms).tobytes())
+        return hasher.hexdigest()
+
+    @staticmethod
     def string_to_keysym(string):
         # Converts string to keysym
-        return xpybutil.keysymdef.keysyms[string]
+        # xpybutil is imported here rather than at module level: importing it opens its own
+        # X connection and the keysym table is large, and a cached config never needs either
+        import xpybutil.keysymdef
+
+        try:
+            return xpybutil.keysymdef.keysyms[string]
+        except KeyError:
+            logging.error(f"Failed to convert string '{string}' to keysym.")
+            return None
 
     def get_keysym(self, keycode, keysym_offset):
-        keysyms_per_keycode = self.keyboard_mapping.keysyms_per_keycode
-        index = (keycode - self.min_keycode) * keysyms_per_keycode + keysym_offset
+        index = (keycode - self.min_keycode) * self.keysyms_per_keycode + keysym_offset
 
-        if 0 <= index < len(self.keyboard_mapping.keysyms):
-            return self.keyboard_mapping.keysyms[index]
+        if 0 <= index < len(self.keysyms):
+            return self.keysyms[index]
         else:
             raise ValueError(f"Invalid keycode or keysym offset: keycode={keycode}, offset={keysym_offset}")
 
@@ -48,15 +74,84 @@ class KeyUtil:
         :param keysym: keysym you wish to convert to keycode
         :returns: Keycode if found, else None
         """
+        self._build_index()
+        return self.keycodes.get(keysym)
+
+    def _build_index(self) -> None:
+        """Build the reverse index over the whole keyboard mapping, unless it already exists."""
+        if self.keycodes is not None:
+            return
+        self.keysym_keycodes = {}
+        self._index_keycodes(self.min_keycode, self.max_keycode + 1)
+        self.keycodes = {keysym: min(keycodes) for keysym, keycodes in self.keysym_keycodes.items()}
+
+    def refresh(self, first_keycode, count):
+        """
+        Re-read part of the keyboard mapping after a MappingNotify
+
+        :param first_keycode: first keycode the server reported as changed
+        :param count: number of changed keycodes
+        :returns: set of keysyms whose keycode changed
+        """
+        mapping = self.conn.core.GetKeyboardMapping(first_keycode, count).reply()
+        self._build_index() # the old index is what changes are measured against
+
+        # A different grid width means every row moved; rebuild the whole index
+        if mapping.keysyms_per_keycode != self.keysyms_per_keycode:
+            old_keycodes = self.keycodes
+            self.keyboard_mapping = self.conn.core.GetKeyboardMapping(
+                self.min_keycode,
+                self.max_keycode - self.min_keycode + 1
+            ).reply()
+            self.keysyms_per_keycode = self.keyboard_mapping.keysyms_per_keycode
+            self.keysyms = list(self.keyboard_mapping.keysyms)
+            self.keycodes = None
+            self._build_index()
+            return {keysym for keysym in old_keycodes.keys() | self.keycodes.keys()
+                    if old_keycodes.get(keysym) != self.keycodes.get(keysym)}
+
+        # Same width: only the reported rows are dropped from the index and patched
+        start = (first_keycode - self.min_keycode) * self.keysyms_per_keycode
+        end = start + count * self.keysyms_per_keycode
+        touched = self._unindex_keycodes(first_keycode, first_keycode + count)
+        self.keysyms[start:end] = mapping.keysyms
+        touched |= self._index_keycodes(first_keycode, first_keycode + count)
 
-        keysyms_per_keycode = self.keyboard_mapping.keysyms_per_keycode
+        changed = set()
+        for keysym in touched:
+            keycodes = self.keysym_keycodes.get(keysym)
+            keycode = min(keycodes) if keycodes else None
+            if self.keycodes.get(keysym) != keycode:
+                changed.add(keysym)
+            if keycode is None:
+                self.keycodes.pop(keysym, None)
+            else:
+                self.keycodes[keysym] = keycode
+        return changed
 
-        # Loop through each keycode. Think of this as a row in a 2d array.
-        # Row: loop from the min_keycode through the max_keycode
-        for keycode in range(self.min_keycode, self.max_keycode + 1):
-            # Col: loop from 0 to keysyms_per_keycode. Think of this as a column in a 2d array.
-            for keysym_offset in range(0, keysyms_per_keycode):
-                if self.get_keysym(keycode, keysym_offset) == keysym:
-                    return keycode
+    def _index_keycodes(self, start_keycode, end_keycode):
+        """Add the keysyms of keycodes [start_keycode, end_keycode) to the reverse index."""
+        touched = set()
+        for keycode in range(start_keycode, end_keycode):
+            for keysym_offset in range(self.keysyms_per_keycode):
+                keysym = self.get_keysym(keycode, keysym_offset)
+                if not keysym:
+                    continue # NoSymbol
+                self.keysym_keycodes.setdefault(keysym, set()).add(keycode)
+                touched.add(keysym)
+        return touched
 
-        return None
+    def _unindex_keycodes(self, start_keycode, end_keycode):
+        """Drop the keysyms of keycodes [start_keycode, end_keycode) from the reverse index."""
+        touched = set()
+        for keycode in range(start_keycode, end_keycode):
+            for keysym_offset in range(self.keysyms_per_keycode):
+                keysym = self.get_keysym(keycode, keysym_offset)
+                keycodes = self.keysym_keycodes.get(keysym)
+                if not keycodes:
+                    continue
+                keycodes.discard(keycode)
+                if not keycodes:
+                    del self.keysym_keycodes[keysym]
+                touched.add(keysym)
+        return touched
@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+
+"""
+Watches config.yaml so nichtwm can reload it in place.
+
+Uses inotify through ctypes (no extra dependency). The watch is on the config's directory
+rather than the file itself: most editors save by writing a new file and renaming it over
+the old one, which would silently end a watch on the file's inode. ConfigWatcher has a
+fileno(), so the event loop can select() on it next to the X connection.
+"""
+
+import os
+import struct
+import ctypes
+import ctypes.util
+import logging
+
+# From <sys/inotify.h>
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+
+_EVENT = struct.Struct('iIII') # wd, mask, cookie, len; followed by `len` bytes of name
+
+class ConfigWatcher:
+    def __init__(self, path) -> None:
+        self.path = os.path.abspath(path)
+        self.directory, self.name = os.path.split(self.path)
+        self.name = self.name.encode()
+
+        libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        self.fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            error = ctypes.get_errno()
+            raise OSError(error, f"inotify_init1: {os.strerror(error)}")
+
+        mask = IN_CLOSE_WRITE | IN_MOVED_TO | IN_DELETE_SELF | IN_MOVE_SELF
+        if libc.inotify_add_watch(self.fd, self.directory.encode(), mask) < 0:
+            error = ctypes.get_errno()
+            os.close(self.fd)
+            raise OSError(error, f"inotify_add_watch {self.directory}: {os.strerror(error)}")
+
+        logging.debug(f"Watching {self.path} for changes")
+
+    def fileno(self) -> int:
+        return self.fd
+
+    """Read every queued notification; True if any of them was about the config file."""
+    def changed(self) -> bool:
+        changed = False
+        while True:
+            try:
+                data = os.read(self.fd, 4096)
+            except BlockingIOError:
+                return changed
+
+            offset = 0
+            while offset < len(data):
+                _, mask, _, length = _EVENT.unpack_from(data, offset)
+                offset += _EVENT.size
+                name = data[offset:offset + length].rstrip(b'\0')
+                offset += length
+
+                if mask & (IN_DELETE_SELF | IN_MOVE_SELF):
+                    logging.error(f"{self.directory} went away; config changes are no longer watched")
+                elif name == self.name:
+                    changed = True
+
+    def close(self) -> None:
+        os.close(self.fd)
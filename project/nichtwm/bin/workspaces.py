@@ -1,52 +1,187 @@
 #!/usr/bin/env python3
 
+"""
+Workspaces: which windows are on screen, and every change to that.
+
+WorkspaceManager owns the per-workspace TilingManagers and the windows waiting to be mapped, and
+is the only place that maps or unmaps windows for workspace reasons. Nothing here flushes: the
+WM commits a whole batch (layout pass, maps, one flush) at once.
+
+There is one WorkspaceManager per output. Its workspaces are numbered 0..num_workspaces-1 (what
+SWITCH_WORKSPACE_n talks about) and live in the shared ClientRegistry at first_workspace onwards.
+"""
+
+from metrics import timed
+
 class WorkspaceManager:
-    def __init__(self, conn, num_workspaces=6) -> None:
+    def __init__(self, conn, clients, tiling_factory, num_workspaces=6, grab_server=False, first_workspace=0, rect=None) -> None:
         self.conn = conn
-        self.num_workspaces = num_workspaces
-        self.workspaces = [[] for _ in range(num_workspaces)]  # List of lists to hold windows per workspace
-        self.current_workspace = 0
+        self.clients = clients               # shared ClientRegistry, which holds the windows of every workspace
+        self.tiling_factory = tiling_factory # (registry workspace, rect) -> TilingManager
+        self.first_workspace = first_workspace
+        self.rect = rect                     # area of the output, None for the whole screen
+        self.tiling_managers = [tiling_factory(first_workspace + index, rect) for index in range(num_workspaces)]
+        self.current_workspace = 0           # local index
+        self.grab_server = grab_server       # hold the server grabbed while a switch is sent
+        self.pending_maps = {}               # windows to map once the current batch has been tiled; a dict as an
+                                             # ordered set, so a burst of MapRequests stays linear
+        self.moved = False                   # windows were mapped, unmapped or moved under the pointer since the last commit
 
-    """Switch to a specific workspace."""
-    def switch_to_workspace(self, workspace_index: int) -> None:
-        if workspace_index < 0 or workspace_index >= self.num_workspaces:
-            return  # Invalid workspace index
+    @property
+    def num_workspaces(self) -> int:
+        return len(self.tiling_managers)
 
-        # Unmap all windows in the current workspace
-        for window in self.workspaces[self.current_workspace]:
-            self.conn.core.UnmapWindow(window)
+    """Registry workspace being shown."""
+    @property
+    def current_id(self) -> int:
+        return self.first_workspace + self.current_workspace
+
+    """Whether a registry workspace belongs to this output."""
+    def owns(self, workspace) -> bool:
+        return self.first_workspace <= workspace < self.first_workspace + self.num_workspaces
 
-        # Switch to the new workspace
+    """TilingManager of a (local) workspace, the current one by default."""
+    def tiling_manager(self, workspace=None):
+        return self.tiling_managers[self.current_workspace if workspace is None else workspace]
+
+    """Whether a managed window is on screen: on the workspace being shown and, with the scrolling layout, in view."""
+    def is_visible(self, window) -> bool:
+        client = self.clients.get(window)
+        return client is not None and client.workspace == self.current_id and self.tiling_manager().shows(client)
+
+    """Windows of the workspace being shown that are on screen."""
+    def visible_windows(self) -> list:
+        return self.tiling_manager().visible_windows()
+
+    """Scroll a window of this output into view, if its workspace has the scrolling layout."""
+    def reveal(self, window) -> None:
+        client = self.clients.get(window)
+        if client is not None and self.owns(client.workspace):
+            self.tiling_manager(client.workspace - self.first_workspace).scroll_to(window)
+
+    """Switch to a specific workspace. Returns False if there was nothing to do."""
+    @timed('switch_workspace')
+    def switch_to_workspace(self, workspace_index: int) -> bool:
+        if workspace_index < 0 or workspace_index >= self.num_workspaces:
+            return False # Invalid workspace index
+        if workspace_index == self.current_workspace:
+            return False
+
+        leaving = self.clients.windows(self.current_id) # unmap_window() skips the ones scrolled out of view
         self.current_workspace = workspace_index
 
-        # Map all windows in the new workspace
-        for window in self.workspaces[self.current_workspace]:
-            self.conn.core.MapWindow(window)
+        # Nothing becomes visible or invisible: no need to hold everyone else off
+        grab = self.grab_server and bool(leaving or self.clients.count(self.current_id))
+        if grab:
+            self.conn.core.GrabServer()
 
-        self.conn.flush()
+        # Geometry first, while the windows are still unmapped: no visible resize, no exposes wasted on it
+        tiling_manager = self.tiling_manager()
+        tiling_manager.arrange_windows()
+        tiling_manager.take_view_changes() # everything of a hidden workspace is unmapped already
 
-    """Add a window to the current workspace."""
+        # Map the new windows before unmapping the old ones, so the root window never shows through
+        for window in tiling_manager.visible_windows():
+            self._map_now(window)
+        for window in leaving:
+            self.unmap_window(window)
+
+        if grab:
+            self.conn.core.UngrabServer()
+        self.moved = True
+        return True
+
+    """Cycle between workspaces (forward or backward)."""
+    def cycle_workspace(self, forward=True) -> bool:
+        next_workspace = (self.current_workspace + (1 if forward else -1)) % self.num_workspaces
+        return self.switch_to_workspace(next_workspace)
+
+    """Start managing a window on the current workspace; it's tiled and mapped when the batch commits."""
     def add_window_to_workspace(self, window) -> None:
-        if window not in self.workspaces[self.current_workspace]:
-            self.workspaces[self.current_workspace].append(window)
+        self.tiling_manager().add_window(window)
+        self.map_window(window)
+
+    """Map a window at the end of the batch, once tiled, if it's on the workspace being shown."""
+    def map_window(self, window) -> None:
+        if self.is_visible(window) and not self.clients.get(window).mapped:
+            self.pending_maps[window] = None
+
+    def _map_now(self, window) -> None:
+        client = self.clients.get(window)
+        if client is not None and not client.mapped:
+            self.conn.core.MapWindow(window)
+            client.mapped = True
 
-    """Remove a window from the current workspace."""
+    """Hide a window of this output. The UnmapNotify this causes is ours, not the client withdrawing the window."""
+    def unmap_window(self, window) -> None:
+        if window in self.pending_maps:
+            del self.pending_maps[window] # never mapped in the first place
+            return
+        client = self.clients.get(window)
+        if client is not None and client.mapped:
+            self.conn.core.UnmapWindow(window)
+            client.ignore_unmaps += 1
+            client.mapped = False
+
+    """Stop managing a window."""
     def remove_window_from_workspace(self, window) -> None:
-        if window in self.workspaces[self.current_workspace]:
-            self.workspaces[self.current_workspace].remove(window)
+        client = self.clients.get(window)
+        if client is None:
+            return
+        self.tiling_manager(client.workspace - self.first_workspace).remove_window(window)
+        self.pending_maps.pop(window, None)
 
-    """Move a window to a specific workspace."""
+    """Move a window of this output to another of its workspaces, unmapping or mapping it if it leaves or enters the view."""
     def move_window_to_workspace(self, window, workspace_index: int) -> None:
-        if workspace_index < 0 or workspace_index >= self.num_workspaces:
-            return  # Invalid workspace index
+        client = self.clients.get(window)
+        if client is None or not self.owns(client.workspace) or not 0 <= workspace_index < self.num_workspaces:
+            return
+        source = client.workspace - self.first_workspace
+        if source == workspace_index:
+            return
 
-        # Remove the window from the current workspace
-        self.remove_window_from_workspace(window)
+        self.tiling_manager(source).dirty = True
+        self.tiling_manager(source).leave_view(window)
+        self.tiling_manager(workspace_index).dirty = True
+        self.clients.move(window, self.first_workspace + workspace_index)
 
-        # Add the window to the new workspace
-        self.workspaces[workspace_index].append(window)
+        if source == self.current_workspace:
+            self.unmap_window(window)
+            self.moved = True
+        elif workspace_index == self.current_workspace:
+            self.map_window(window)
 
-    """Cycle between workspaces (forward or backward)."""
-    def cycle_workspace(self, forward=True) -> None:
-        next_workspace = (self.current_workspace + 1) % self.num_workspaces if forward else (self.current_workspace - 1) % self.num_workspaces
-        self.switch_to_workspace(next_workspace)
+    """Follow a renumbering of the registry (outputs or num-o-workspaces changed): new first workspace,
+    workspace count and output area. Layout choices survive; only a changed area causes a re-tile."""
+    def rebind(self, first_workspace, num_workspaces, rect) -> None:
+        self.first_workspace = first_workspace
+        self.rect = rect
+        del self.tiling_managers[num_workspaces:]
+        self.tiling_managers += [self.tiling_factory(first_workspace + index, rect)
+                                 for index in range(self.num_workspaces, num_workspaces)]
+        for index, tiling_manager in enumerate(self.tiling_managers):
+            tiling_manager.workspace = first_workspace + index
+            tiling_manager.set_rect(rect)
+        self.current_workspace = min(self.current_workspace, num_workspaces - 1)
+
+    """End of a batch: one layout pass over the workspace being shown, then map what's waiting for it.
+    Returns whether windows may have moved under the pointer since the last commit."""
+    def commit(self) -> bool:
+        tiling_manager = self.tiling_manager()
+        moved = self.moved or tiling_manager.dirty or bool(self.pending_maps)
+        self.moved = False
+        tiling_manager.arrange_if_dirty()
+
+        # Scrolling layout: windows that left the view go, the ones that entered it join the new windows
+        hidden, revealed = tiling_manager.take_view_changes()
+        for window in hidden:
+            self.unmap_window(window)
+        for window in revealed:
+            self.map_window(window)
+
+        # New windows get mapped after the layout pass so they show up at their tiled geometry
+        for window in self.pending_maps:
+            if self.is_visible(window): # could have changed output since
+                self._map_now(window)
+        self.pending_maps.clear()
+        return moved